@@ -0,0 +1,184 @@
+import os
+import json
+import hashlib
+import logging
+import typing
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class DiscoveryCache:
+    """
+    On-disk cache of discovered gateways, keyed by (interface name, lan address, gateway address).
+
+    Each entry holds what is needed to rebuild a Gateway without searching for it again: the SSDP reply that located
+    it, the raw device and service descriptor responses, and the soap commands that were registered from them.
+
+    The cache also learns which M-SEARCH variant each gateway model (by SERVER header) answers to, so that later
+    searches can lead with it.
+    """
+
+    version = 1
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @staticmethod
+    def get_key(interface_name: str, lan_address: str, gateway_address: str) -> str:
+        return f"{interface_name}|{lan_address}|{gateway_address}"
+
+    def _load(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        cached: Dict[str, Dict[str, Dict[str, Any]]] = {'gateways': {}, 'm_search_preferences': {}}
+        try:
+            with open(self.path, 'r') as f:
+                loaded = json.loads(f.read())
+        except FileNotFoundError:
+            return cached
+        except (OSError, ValueError) as err:
+            log.warning("failed to read discovery cache %s: %s", self.path, str(err))
+            return cached
+        if not isinstance(loaded, dict) or loaded.get('version') != self.version:
+            return cached
+        for k in cached:
+            if isinstance(loaded.get(k), dict):
+                cached[k] = loaded[k]
+        return cached
+
+    def _save(self, cached: Dict[str, Dict[str, Dict[str, Any]]]) -> None:
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(dict(version=self.version, **cached), indent=2))
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            log.warning("failed to write discovery cache %s: %s", self.path, str(err))
+        return None
+
+    def get(self, interface_name: str, lan_address: str, gateway_address: str) -> Optional[Dict[str, Any]]:
+        return self._load()['gateways'].get(self.get_key(interface_name, lan_address, gateway_address))
+
+    def set(self, interface_name: str, lan_address: str, gateway_address: str,
+            entry: typing.Dict[str, Any]) -> None:
+        cached = self._load()
+        cached['gateways'][self.get_key(interface_name, lan_address, gateway_address)] = entry
+        self._save(cached)
+        return None
+
+    def remove(self, interface_name: str, lan_address: str, gateway_address: str) -> None:
+        cached = self._load()
+        if cached['gateways'].pop(self.get_key(interface_name, lan_address, gateway_address), None) is not None:
+            self._save(cached)
+        return None
+
+    def get_m_search_preferences(self) -> Dict[str, Dict[str, typing.Union[int, str]]]:
+        """
+        The learned M-SEARCH variant for each gateway fingerprint, most often answered first
+        """
+        preferences = self._load()['m_search_preferences']
+        ordered = sorted(preferences.items(), key=lambda item: item[1]['replies'], reverse=True)
+        return {fingerprint: preference['m_search_args'] for fingerprint, preference in ordered}
+
+    def add_m_search_preference(self, fingerprint: str, m_search_args: Dict[str, typing.Union[int, str]]) -> None:
+        cached = self._load()
+        preference = cached['m_search_preferences'].get(fingerprint)
+        if preference and preference['m_search_args'] == m_search_args:
+            preference['replies'] += 1
+        else:
+            cached['m_search_preferences'][fingerprint] = {'m_search_args': m_search_args, 'replies': 1}
+        self._save(cached)
+        return None
+
+
+class ParseCache:
+    """
+    Process wide LRU cache of parsed device and service descriptors, keyed by a hash of the document.
+
+    Routers of the same model serve byte identical descriptors, so managing many gateways (or discovering the same
+    one again) only parses each distinct document once. The parsed dicts and action lists are shared by everything
+    they are returned to, and are not to be modified.
+    """
+
+    prefix_size = 512
+
+    def __init__(self, max_size: int = 64) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # document hash -> [parsed document, action list or None, leading bytes of the document]
+        self._entries: 'OrderedDict[bytes, List[Any]]' = OrderedDict()
+        # the leading bytes of the cached documents, and how many of them start with each
+        self._prefixes: Dict[bytes, int] = {}
+
+    @staticmethod
+    def get_key(document: bytes) -> bytes:
+        return hashlib.sha256(document).digest()
+
+    def get(self, document: bytes) -> Optional[Dict[str, Any]]:
+        return self.get_by_key(self.get_key(document))
+
+    def get_by_key(self, key: bytes) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        parsed: Dict[str, Any] = entry[0]
+        return parsed
+
+    def set(self, document: bytes, parsed: Dict[str, Any]) -> None:
+        return self.set_by_key(self.get_key(document), document[:self.prefix_size], parsed)
+
+    def set_by_key(self, key: bytes, prefix: bytes, parsed: Dict[str, Any]) -> None:
+        """
+        Cache a document by its key, given the leading prefix_size bytes (or all) of the document
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return None
+        prefix = prefix[:self.prefix_size]
+        self._entries[key] = [parsed, None, prefix]
+        self._prefixes[prefix] = self._prefixes.get(prefix, 0) + 1
+        while len(self._entries) > self.max_size:
+            self._evict()
+        return None
+
+    def _evict(self) -> None:
+        _, (_, _, prefix) = self._entries.popitem(last=False)
+        self._prefixes[prefix] -= 1
+        if not self._prefixes[prefix]:
+            del self._prefixes[prefix]
+        return None
+
+    def may_contain(self, prefix: bytes) -> bool:
+        """
+        Whether a document starting with these (prefix_size, or all of the) bytes could be cached
+        """
+        return prefix[:self.prefix_size] in self._prefixes
+
+    def get_action_list(self, document: bytes) -> Optional[List[Tuple[str, List[str], List[str]]]]:
+        entry = self._entries.get(self.get_key(document))
+        if entry is None:
+            return None
+        action_list: Optional[List[Tuple[str, List[str], List[str]]]] = entry[1]
+        return action_list
+
+    def set_action_list(self, document: bytes, action_list: List[Tuple[str, List[str], List[str]]]) -> None:
+        entry = self._entries.get(self.get_key(document))
+        if entry is not None:
+            entry[1] = action_list
+        return None
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._prefixes.clear()
+        self.hits = self.misses = 0
+        return None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+PARSE_CACHE = ParseCache()
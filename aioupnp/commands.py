@@ -2,7 +2,8 @@ import asyncio
 import time
 import typing
 import logging
-from aioupnp.protocols.scpd import scpd_post
+from aioupnp.protocols.scpd import scpd_post, SCPDConnectionPool
+from aioupnp.serialization.soap import SOAPRequestTemplate, decode_port_mapping_list
 from aioupnp.device import Service
 from aioupnp.fault import UPnPError
 from aioupnp.util import is_valid_public_ipv4
@@ -18,6 +19,10 @@ def soap_bool(x: typing.Optional[typing.Union[str, int]]) -> bool:
     return False if not x or str(x).lower() in ['false', 'False'] else True
 
 
+def soap_optional_int(x: typing.Optional[typing.Union[str, int]]) -> typing.Optional[int]:
+    return None if x is None else int(x)
+
+
 class GetSpecificPortMappingEntryResponse(typing.NamedTuple):
     internal_port: int
     lan_address: str
@@ -37,19 +42,99 @@ class GetGenericPortMappingEntryResponse(typing.NamedTuple):
     lease_time: int
 
 
+PortMappingList = typing.List[GetGenericPortMappingEntryResponse]
+
+# the fields of a PortMappingEntry in the listing returned by GetListOfPortMappings, in the order of the fields of
+# GetGenericPortMappingEntryResponse
+PORT_MAPPING_LIST_FIELDS = {
+    'NewRemoteHost': 0, 'NewExternalPort': 1, 'NewProtocol': 2, 'NewInternalPort': 3, 'NewInternalClient': 4,
+    'NewEnabled': 5, 'NewDescription': 6, 'NewLeaseTime': 7
+}
+
+
+def soap_port_mapping_list(x: typing.Optional[typing.Union[str, int]]) -> PortMappingList:
+    if not x:
+        return []
+    converters: typing.List[typing.Callable[[typing.Optional[str]], typing.Any]] = [
+        soap_optional_str, soap_optional_int, soap_optional_str, soap_optional_int, soap_optional_str, soap_bool,
+        soap_optional_str, soap_optional_int
+    ]
+    return [
+        GetGenericPortMappingEntryResponse(*(convert(value) for convert, value in zip(converters, values)))
+        for values in decode_port_mapping_list(str(x), PORT_MAPPING_LIST_FIELDS)
+    ]
+
+
+CommandResult = typing.Optional[typing.Union[str, int, bool, GetSpecificPortMappingEntryResponse,
+                                             GetGenericPortMappingEntryResponse, PortMappingList]]
+
+
 class SCPDRequestDebuggingInfo(typing.NamedTuple):
     method: str
     kwargs: typing.Dict[str, typing.Union[str, int, bool]]
     response_xml: bytes
-    result: typing.Optional[typing.Union[str, int, bool, GetSpecificPortMappingEntryResponse,
-                                         GetGenericPortMappingEntryResponse]]
+    result: CommandResult
     err: typing.Optional[Exception]
     ts: float
 
 
+class ResponseFieldMap:
+    """
+    How to build the typed result of a command from its output arguments, built once when the command is registered
+
+    fields maps each output argument name (and its lower cased form) to its index in the result, which is given to
+    decode_soap_post_response_fields so that a response can be decoded without building a dict for recast_return.
+    """
+
+    converters: typing.Dict[typing.Any, typing.Callable[[typing.Optional[str]], typing.Any]] = {
+        bool: soap_bool, str: soap_optional_str, int: soap_optional_int, PortMappingList: soap_port_mapping_list
+    }
+
+    def __init__(self, output_names: typing.List[str],
+                 converters: typing.List[typing.Callable[[typing.Optional[str]], typing.Any]],
+                 result_type: typing.Optional[typing.Callable[..., typing.Any]] = None) -> None:
+        self.fields: typing.Dict[str, int] = {}
+        for i, name in enumerate(output_names):
+            self.fields.setdefault(name.lower(), i)
+        for i, name in enumerate(output_names):
+            self.fields[name] = i
+        self._converters = converters
+        self._result_type = result_type
+
+    @classmethod
+    def from_annotation(cls, return_annotation: typing.Any,
+                        output_names: typing.List[str]) -> typing.Optional['ResponseFieldMap']:
+        """
+        The field map giving the same results as recast_return, or None if the results can only be recast
+        """
+        if not output_names:
+            if return_annotation in [GetGenericPortMappingEntryResponse, GetSpecificPortMappingEntryResponse]:
+                return None
+            return cls(output_names, [])
+        if len(output_names) == 1:
+            if return_annotation not in cls.converters:
+                return None
+            return cls(output_names, [cls.converters[return_annotation]])
+        if return_annotation in [GetGenericPortMappingEntryResponse, GetSpecificPortMappingEntryResponse]:
+            field_types: typing.List[typing.Type[typing.Any]] = list(typing.get_type_hints(return_annotation).values())
+            if len(field_types) != len(output_names) or any(t not in cls.converters for t in field_types):
+                return None
+            return cls(output_names, [cls.converters[t] for t in field_types], return_annotation)
+        return None
+
+    def build(self, values: typing.List[typing.Optional[str]]) -> CommandResult:
+        if self._result_type is not None:
+            result: typing.Union[GetSpecificPortMappingEntryResponse, GetGenericPortMappingEntryResponse] = \
+                self._result_type(*(convert(value) for convert, value in zip(self._converters, values)))
+            return result
+        if not self._converters:
+            return None
+        single_result: CommandResult = self._converters[0](values[0])
+        return single_result
+
+
 def recast_return(return_annotation, result: typing.Union[str, int, bool, typing.Dict[str, typing.Union[int, str]]],
-                  result_keys: typing.List[str]) -> typing.Optional[
-                typing.Union[str, int, bool, GetSpecificPortMappingEntryResponse, GetGenericPortMappingEntryResponse]]:
+                  result_keys: typing.List[str]) -> CommandResult:
     if len(result_keys) == 1:
         if isinstance(result, (str, int, bool)):
             single_result = result
@@ -62,14 +147,14 @@ def recast_return(return_annotation, result: typing.Union[str, int, bool, typing
                     single_result = flattened[result_keys[0].lower()]
                 else:
                     raise UPnPError(f"expected response key {result_keys[0]}, got {list(result.keys())}")
-        if return_annotation is bool:
-            return soap_bool(single_result)
-        if return_annotation is str:
-            return soap_optional_str(single_result)
-        return None if single_result is None else int(single_result)
+        convert: typing.Callable[[typing.Any], typing.Any] = ResponseFieldMap.converters.get(
+            return_annotation, soap_optional_int
+        )
+        recast_result: CommandResult = convert(single_result)
+        return recast_result
     elif return_annotation in [GetGenericPortMappingEntryResponse, GetSpecificPortMappingEntryResponse]:
         assert isinstance(result, dict)
-        arg_types: typing.Dict[str, typing.Type[typing.Any]] = return_annotation._field_types
+        arg_types: typing.Dict[str, typing.Type[typing.Any]] = typing.get_type_hints(return_annotation)
         assert len(arg_types) == len(result_keys)
         recast_results: typing.Dict[str, typing.Optional[typing.Union[str, int, bool]]] = {}
         for i, (field_name, result_key) in enumerate(zip(arg_types, result_keys)):
@@ -85,6 +170,21 @@ def recast_return(return_annotation, result: typing.Union[str, int, bool, typing
     return None
 
 
+class CompiledCommand(typing.NamedTuple):
+    """
+    Everything needed to dispatch a registered command, compiled once when it is registered
+    """
+
+    service: Service
+    control_url: typing.Optional[str]
+    inputs: typing.List[str]
+    outputs: typing.List[str]
+    takes_arguments: bool
+    return_annotation: typing.Any
+    field_map: typing.Optional[ResponseFieldMap]
+    template: typing.Optional[SOAPRequestTemplate]
+
+
 class SOAPCommands:
     """
     Type annotated wrappers for common UPnP SOAP functions
@@ -102,6 +202,8 @@ class SOAPCommands:
         'GetSpecificPortMappingEntry',
         'DeletePortMapping',
         'GetExternalIPAddress',
+        'GetListOfPortMappings',
+        'AddAnyPortMapping',
         # 'SetConnectionType',
         # 'GetNATRSIPStatus',
         # 'GetConnectionTypeInfo',
@@ -121,56 +223,80 @@ class SOAPCommands:
         # 'GetMaximumActiveConnections',
         # 'GetActiveConnections'
     ]
+    _COMMAND_NAMES: typing.FrozenSet[str] = frozenset(SOAP_COMMANDS)
 
-    def __init__(self, loop: asyncio.AbstractEventLoop, base_address: bytes, port: int) -> None:
+    def __init__(self, loop: asyncio.AbstractEventLoop, base_address: bytes, port: int, pool_size: int = 4,
+                 idle_timeout: float = 5.0) -> None:
         self._loop = loop
-        self._registered: typing.Dict[Service,
-                                      typing.Dict[str, typing.Tuple[typing.List[str], typing.List[str]]]] = {}
+        self._index: typing.Dict[str, CompiledCommand] = {}
         self._wrappers_no_args: typing.Dict[str, typing.Callable[[], typing.Awaitable[typing.Any]]] = {}
         self._wrappers_kwargs: typing.Dict[str, typing.Callable[..., typing.Awaitable[typing.Any]]] = {}
 
         self._base_address = base_address
         self._port = port
+        self._pool = SCPDConnectionPool(base_address.decode(), port, pool_size, idle_timeout, loop)
         self._request_debug_infos: typing.List[SCPDRequestDebuggingInfo] = []
 
     def is_registered(self, name: str) -> bool:
-        if name not in self.SOAP_COMMANDS:
+        if name in self._index:
+            return True
+        if name not in self._COMMAND_NAMES:
             raise ValueError("unknown command")  # pragma: no cover
-        for service in self._registered.values():
-            if name in service:
-                return True
         return False
 
     def get_service(self, name: str) -> Service:
-        if name not in self.SOAP_COMMANDS:
+        if name not in self._COMMAND_NAMES:
             raise ValueError("unknown command")  # pragma: no cover
-        for service, commands in self._registered.items():
-            if name in commands:
-                return service
-        raise ValueError(name)  # pragma: no cover
+        if name not in self._index:
+            raise ValueError(name)  # pragma: no cover
+        return self._index[name].service
 
-    def _register_soap_wrapper(self, name: str) -> None:
+    def get_command(self, name: str) -> CompiledCommand:
+        """
+        The compiled index entry of a registered command
+        """
+        if name not in self._index:
+            raise ValueError(name)
+        return self._index[name]
+
+    def _compile_command(self, name: str, service: Service, inputs: typing.List[str],
+                         outputs: typing.List[str]) -> CompiledCommand:
         annotations: typing.Dict[str, typing.Any] = typing.get_type_hints(getattr(self, name))
-        service = self.get_service(name)
-        input_names: typing.List[str] = self._registered[service][name][0]
-        output_names: typing.List[str] = self._registered[service][name][1]
+        assert 'return' in annotations
+        template: typing.Optional[SOAPRequestTemplate] = None
+        if service.controlURL is not None and service.serviceType is not None:
+            template = SOAPRequestTemplate(
+                name, inputs, service.serviceType.encode(), self._base_address, service.controlURL.encode()
+            )
+        return CompiledCommand(
+            service, service.controlURL, list(inputs), list(outputs), len(annotations) > 1, annotations['return'],
+            ResponseFieldMap.from_annotation(annotations['return'], outputs), template
+        )
 
-        async def wrapper(**kwargs: typing.Any) -> typing.Optional[
-              typing.Union[str, int, bool, GetSpecificPortMappingEntryResponse, GetGenericPortMappingEntryResponse]]:
+    def _register_soap_wrapper(self, name: str) -> None:
+        command = self._index[name]
+        service, input_names, output_names = command.service, command.inputs, command.outputs
+        field_map, template = command.field_map, command.template
+
+        async def wrapper(**kwargs: typing.Any) -> CommandResult:
 
-            assert service.controlURL is not None
+            assert command.control_url is not None
             assert service.serviceType is not None
             response, xml_bytes, err = await scpd_post(
-                service.controlURL, self._base_address.decode(), self._port, name, input_names,
-                service.serviceType.encode(), self._loop, **kwargs
+                command.control_url, self._base_address.decode(), self._port, name, input_names,
+                service.serviceType.encode(), self._loop, self._pool,
+                response_fields=None if field_map is None else field_map.fields, template=template, **kwargs
             )
             if err is not None:
                 assert isinstance(xml_bytes, bytes)
                 self._request_debug_infos.append(SCPDRequestDebuggingInfo(name, kwargs, xml_bytes, None, err, time.time()))
                 raise err
-            assert 'return' in annotations
             try:
-                result = recast_return(annotations['return'], response, output_names)
+                if isinstance(response, list):
+                    assert field_map is not None
+                    result = field_map.build(response)
+                else:
+                    result = recast_return(command.return_annotation, response, output_names)
                 self._request_debug_infos.append(SCPDRequestDebuggingInfo(name, kwargs, xml_bytes, result, None, time.time()))
             except Exception as err:
                 if isinstance(err, asyncio.CancelledError):
@@ -179,20 +305,18 @@ class SOAPCommands:
                 raise UPnPError(f"Raised {str(type(err).__name__)}({str(err)}) parsing response for {name}")
             return result
 
-        if not len(list(k for k in annotations if k != 'return')):
+        if not command.takes_arguments:
             self._wrappers_no_args[name] = wrapper
         else:
             self._wrappers_kwargs[name] = wrapper
         return None
 
     def register(self, name: str, service: Service, inputs: typing.List[str], outputs: typing.List[str]) -> None:
-        if name not in self.SOAP_COMMANDS:
+        if name not in self._COMMAND_NAMES:
             raise AttributeError(name)
-        if self.is_registered(name):
+        if name in self._index:
             raise AttributeError(f"{name} is already a registered SOAP command")
-        if service not in self._registered:
-            self._registered[service] = {}
-        self._registered[service][name] = inputs, outputs
+        self._index[name] = self._compile_command(name, service, inputs, outputs)
         self._register_soap_wrapper(name)
 
     async def AddPortMapping(self, NewRemoteHost: str, NewExternalPort: int, NewProtocol: str, NewInternalPort: int,
@@ -210,6 +334,21 @@ class SOAPCommands:
         )
         return None
 
+    async def AddAnyPortMapping(self, NewRemoteHost: str, NewExternalPort: int, NewProtocol: str,
+                                NewInternalPort: int, NewInternalClient: str, NewEnabled: int,
+                                NewPortMappingDescription: str, NewLeaseDuration: str) -> int:
+        """Returns NewReservedPort, the external port the gateway mapped (IGDv2)"""
+        name = "AddAnyPortMapping"
+        if not self.is_registered(name):
+            raise NotImplementedError()  # pragma: no cover
+        assert name in self._wrappers_kwargs
+        reserved_port: int = await self._wrappers_kwargs[name](
+            NewRemoteHost=NewRemoteHost, NewExternalPort=NewExternalPort, NewProtocol=NewProtocol,
+            NewInternalPort=NewInternalPort, NewInternalClient=NewInternalClient, NewEnabled=NewEnabled,
+            NewPortMappingDescription=NewPortMappingDescription, NewLeaseDuration=NewLeaseDuration
+        )
+        return reserved_port
+
     async def GetGenericPortMappingEntry(self, NewPortMappingIndex: int) -> GetGenericPortMappingEntryResponse:
         """
         Returns (NewRemoteHost, NewExternalPort, NewProtocol, NewInternalPort, NewInternalClient, NewEnabled,
@@ -258,6 +397,22 @@ class SOAPCommands:
             raise UPnPError(f"Got invalid external ipv4 address: {external_ip}")
         return external_ip
 
+    async def GetListOfPortMappings(self, NewStartPort: int, NewEndPort: int, NewProtocol: str, NewManage: int,
+                                    NewNumberOfPorts: int) -> PortMappingList:
+        """
+        Returns [(NewRemoteHost, NewExternalPort, NewProtocol, NewInternalPort, NewInternalClient, NewEnabled,
+                  NewDescription, NewLeaseTime)] for the mappings of the protocol in the port range (IGDv2)
+        """
+        name = "GetListOfPortMappings"
+        if not self.is_registered(name):
+            raise NotImplementedError()  # pragma: no cover
+        assert name in self._wrappers_kwargs
+        result: PortMappingList = await self._wrappers_kwargs[name](
+            NewStartPort=NewStartPort, NewEndPort=NewEndPort, NewProtocol=NewProtocol, NewManage=NewManage,
+            NewNumberOfPorts=NewNumberOfPorts
+        )
+        return result
+
     # async def GetNATRSIPStatus(self) -> Tuple[bool, bool]:
     #     """Returns (NewRSIPAvailable, NewNATEnabled)"""
     #     name = "GetNATRSIPStatus"
@@ -3,14 +3,17 @@ ROOT = "root"
 SPEC_VERSION = "specVersion"
 XML_VERSION = "<?xml version=\"1.0\"?>"
 XML_VERSION_PREFIX = "<?xml version=\"1.0\""
-FAULT = "{http://schemas.xmlsoap.org/soap/envelope/}Fault"
 ENVELOPE = "{http://schemas.xmlsoap.org/soap/envelope/}Envelope"
-BODY = "{http://schemas.xmlsoap.org/soap/envelope/}Body"
+# children of the envelope, whose namespace is stripped when parsing
+FAULT = "Fault"
+BODY = "Body"
 
 
+SOAP_ENVELOPE = 'http://schemas.xmlsoap.org/soap/envelope/'
 CONTROL = 'urn:schemas-upnp-org:control-1-0'
 SERVICE = 'urn:schemas-upnp-org:service-1-0'
 DEVICE = 'urn:schemas-upnp-org:device-1-0'
+UPNP_NAMESPACES = (DEVICE, SERVICE, CONTROL, SOAP_ENVELOPE)
 
 WIFI_ALLIANCE_ORG_IGD = "urn:schemas-wifialliance-org:device:WFADevice:1"
 UPNP_ORG_IGD = 'urn:schemas-upnp-org:device:InternetGatewayDevice:1'
@@ -19,6 +22,12 @@ WAN_SCHEMA = 'urn:schemas-upnp-org:service:WANCommonInterfaceConfig:1'
 LAYER_SCHEMA = 'urn:schemas-upnp-org:service:Layer3Forwarding:1'
 IP_SCHEMA = 'urn:schemas-upnp-org:service:WANIPConnection:1'
 
+# lower case search target fragments, from most to least likely to belong to a usable gateway
+IGD_PROBE_PRIORITY = [
+    ('internetgatewaydevice', 'wanipconnection', 'wanpppconnection'),
+    ('wandevice', 'wanconnectiondevice', 'wfadevice'),
+]
+
 SSDP_IP_ADDRESS = '239.255.255.250'
 SSDP_PORT = 1900
 SSDP_HOST = "%s:%i" % (SSDP_IP_ADDRESS, SSDP_PORT)
@@ -4,45 +4,88 @@ import logging
 
 log = logging.getLogger(__name__)
 
+_Value = typing.Union[str, typing.Dict[str, typing.Any], typing.List]
 
-class CaseInsensitive:
-    def __init__(self, **kwargs: typing.Dict[str, typing.Union[str, typing.Dict[str, typing.Any],
-                                                               typing.List[typing.Any]]]) -> None:
-        keys: typing.List[str] = list(kwargs.keys())
-        for k in keys:
+
+class _CaseInsensitiveMeta(type):
+    """
+    Turns the public class attributes of a CaseInsensitive subclass into slots, keeping their values as defaults,
+    and precomputes the lower case name -> attribute name map used to resolve attributes regardless of case.
+    """
+
+    def __new__(mcs, name: str, bases: typing.Tuple[type, ...],
+                namespace: typing.Dict[str, typing.Any]) -> '_CaseInsensitiveMeta':
+        fields: typing.Dict[str, typing.Any] = {}
+        for k in list(namespace.get('__annotations__', {})) + list(namespace):
+            if k.startswith('_') or k in fields:
+                continue
+            default = namespace.get(k)
+            if callable(default) or isinstance(default, (property, classmethod, staticmethod)):
+                continue
+            fields[k] = namespace.pop(k, None)
+        namespace.setdefault('__slots__', tuple(fields))
+        cls = typing.cast(_CaseInsensitiveMeta, super().__new__(mcs, name, bases, namespace))
+        defaults: typing.Dict[str, typing.Any] = {}
+        for base in reversed(cls.__mro__[1:]):
+            defaults.update(getattr(base, '_defaults', {}))
+        defaults.update(fields)
+        setattr(cls, '_defaults', defaults)
+        setattr(cls, '_attribute_names', {k.lower(): k for k in defaults})
+        return cls
+
+
+class CaseInsensitive(metaclass=_CaseInsensitiveMeta):
+    __slots__ = ('_extra',)
+    _extra: typing.Optional[typing.Dict[str, _Value]]
+    _defaults: typing.Dict[str, typing.Any]
+    _attribute_names: typing.Dict[str, str]
+
+    def __init__(self, **kwargs: typing.Dict[str, _Value]) -> None:
+        object.__setattr__(self, '_extra', None)
+        for k, v in kwargs.items():
             if not k.startswith("_"):
-                assert k in kwargs
-                setattr(self, k, kwargs[k])
-
-    def __getattr__(self, item: str) -> typing.Union[str, typing.Dict[str, typing.Any], typing.List]:
-        keys: typing.List[str] = list(self.__class__.__dict__.keys())
-        for k in keys:
-            if k.lower() == item.lower():
-                value: typing.Optional[typing.Union[str, typing.Dict[str, typing.Any],
-                                                    typing.List]] = self.__dict__.get(k)
-                assert value is not None and isinstance(value, (str, dict, list))
-                return value
+                setattr(self, k, v)
+
+    def __getattr__(self, item: str) -> _Value:
+        # only reached for attributes that aren't set under their declared name
+        name = self._attribute_names.get(item.lower())
+        if name is not None:
+            if name != item:
+                try:
+                    value: _Value = object.__getattribute__(self, name)
+                    return value
+                except AttributeError:
+                    pass
+            default: _Value = self._defaults[name]
+            return default
+        if not item.startswith("_") and self._extra and item in self._extra:
+            extra: _Value = self._extra[item]
+            return extra
         raise AttributeError(item)
 
-    def __setattr__(self, item: str,
-                    value: typing.Union[str, typing.Dict[str, typing.Any], typing.List]) -> None:
+    def __setattr__(self, item: str, value: _Value) -> None:
         assert isinstance(value, (str, dict)), ValueError(f"got type {str(type(value))}, expected str")
-        keys: typing.List[str] = list(self.__class__.__dict__.keys())
-        for k in keys:
-            if k.lower() == item.lower():
-                self.__dict__[k] = value
-                return
-        if not item.startswith("_"):
-            self.__dict__[item] = value
-            return
-        raise AttributeError(item)
+        name = self._attribute_names.get(item.lower())
+        if name is not None:
+            object.__setattr__(self, name, value)
+        elif not item.startswith("_"):
+            extra = self._extra
+            if extra is None:
+                extra = {}
+                object.__setattr__(self, '_extra', extra)
+            extra[item] = value
+        else:
+            raise AttributeError(item)
 
-    def as_dict(self) -> typing.Dict[str, typing.Union[str, typing.Dict[str, typing.Any], typing.List]]:
-        result: typing.Dict[str, typing.Union[str, typing.Dict[str, typing.Any], typing.List]] = OrderedDict()
-        keys: typing.List[str] = list(self.__dict__.keys())
-        for k in keys:
-            if not k.startswith("_"):
-                result[k] = self.__getattr__(k)
+    def as_dict(self) -> typing.Dict[str, _Value]:
+        result: typing.Dict[str, _Value] = OrderedDict()
+        for k in self._defaults:
+            try:
+                result[k] = object.__getattribute__(self, k)
+            except AttributeError:
+                pass
+        if self._extra:
+            result.update(self._extra)
         return result
 
 
@@ -1,2 +1,12 @@
+import typing
+
+
 class UPnPError(Exception):
-    pass
+    """
+    An error from a gateway or from talking to one. Errors from a soap fault keep the UPnP errorCode of the fault
+    as error_code, for other errors it is None.
+    """
+
+    def __init__(self, *args: typing.Any, error_code: typing.Optional[int] = None) -> None:
+        super().__init__(*args)
+        self.error_code = error_code
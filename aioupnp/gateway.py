@@ -1,17 +1,20 @@
 import re
+import heapq
+import itertools
 import logging
 import typing
 import asyncio
 from typing import Dict, List, Optional
-from aioupnp.util import get_dict_val_case_insensitive
-from aioupnp.constants import SPEC_VERSION, SERVICE
+from aioupnp.util import CaseInsensitiveDict
+from aioupnp.constants import SPEC_VERSION, IGD_PROBE_PRIORITY
 from aioupnp.commands import SOAPCommands
 from aioupnp.device import Device, Service
-from aioupnp.protocols.ssdp import m_search, multi_m_search
+from aioupnp.protocols.ssdp import m_search, multi_m_search, get_fingerprint
 from aioupnp.protocols.scpd import scpd_get
+from aioupnp.serialization.scpd import deserialize_scpd_get_response
 from aioupnp.serialization.ssdp import SSDPDatagram
-from aioupnp.util import flatten_keys
 from aioupnp.fault import UPnPError
+from aioupnp.cache import PARSE_CACHE
 
 log = logging.getLogger(__name__)
 
@@ -22,7 +25,7 @@ BASE_PORT_REGEX = re.compile("^http:\/\/\d*\.\d*\.\d*\.\d*:(\d*)\/.*$".encode())
 def get_action_list(element_dict: typing.Dict[str, typing.Union[str, typing.Dict[str, str],
                                                                 typing.List[typing.Dict[str, typing.Dict[str, str]]]]]
                     ) -> typing.List[typing.Tuple[str, typing.List[str], typing.List[str]]]:
-    service_info = flatten_keys(element_dict, "{%s}" % SERVICE)
+    service_info: typing.Dict[str, typing.Any] = element_dict
     result: typing.List[typing.Tuple[str, typing.List[str], typing.List[str]]] = []
     if "actionList" in service_info:
         action_list = service_info["actionList"]
@@ -32,33 +35,43 @@ def get_action_list(element_dict: typing.Dict[str, typing.Union[str, typing.Dict
         return result
 
     action = action_list["action"]
-    if isinstance(action, dict):
-        arg_dicts: typing.List[typing.Dict[str, str]] = []
-        if not isinstance(action['argumentList']['argument'], list):  # when there is one arg
-            arg_dicts.extend([action['argumentList']['argument']])
-        else:
-            arg_dicts.extend(action['argumentList']['argument'])
-
-        result.append((action_list["action"]['name'], [i['name'] for i in arg_dicts if i['direction'] == 'in'],
-                       [i['name'] for i in arg_dicts if i['direction'] == 'out']))
-        return result
-    assert isinstance(action, list)
-    for _action in action:
-        if not _action.get('argumentList'):
-            result.append((_action['name'], [], []))
-        else:
-            if not isinstance(_action['argumentList']['argument'], list):  # when there is one arg
-                arg_dicts = [_action['argumentList']['argument']]
-            else:
-                arg_dicts = _action['argumentList']['argument']
-            result.append((
-                _action['name'],
-                [i['name'] for i in arg_dicts if i['direction'] == 'in'],
-                [i['name'] for i in arg_dicts if i['direction'] == 'out']
-            ))
+    for _action in (action if isinstance(action, list) else [action]):
+        inputs: typing.List[str] = []
+        outputs: typing.List[str] = []
+        if _action.get('argumentList'):
+            arguments = _action['argumentList']['argument']
+            for argument in (arguments if isinstance(arguments, list) else [arguments]):  # a lone arg is a dict
+                if argument['direction'] == 'in':
+                    inputs.append(argument['name'])
+                elif argument['direction'] == 'out':
+                    outputs.append(argument['name'])
+        result.append((_action['name'], inputs, outputs))
     return result
 
 
+def get_probe_priority(datagram: SSDPDatagram) -> int:
+    """
+    Rank a SSDP reply for probing, lower is probed first. Replies for the gateway device or its connection
+    services are much more likely to lead to a usable gateway than those for any root device.
+    """
+    st = (datagram.st or '').lower()
+    for priority, search_targets in enumerate(IGD_PROBE_PRIORITY):
+        if any(search_target in st for search_target in search_targets):
+            return priority
+    return len(IGD_PROBE_PRIORITY)
+
+
+def deserialize_cached_response(raw_response: bytes) -> typing.Tuple[typing.Dict[str, typing.Any], bytes,
+                                                                     typing.Optional[Exception]]:
+    """
+    Parse a raw descriptor response stored by Gateway.get_cache_entry the way scpd_get parses a fresh one
+    """
+    try:
+        return deserialize_scpd_get_response(raw_response.split(b'\r\n\r\n', 1)[-1]), raw_response, None
+    except Exception as err:
+        return {}, raw_response, UPnPError(err)
+
+
 def parse_location(location: bytes) -> typing.Tuple[bytes, int]:
     base_address_result: typing.List[bytes] = BASE_ADDRESS_REGEX.findall(location)
     base_address = base_address_result[0]
@@ -69,7 +82,8 @@ def parse_location(location: bytes) -> typing.Tuple[bytes, int]:
 
 class Gateway:
     def __init__(self, ok_packet: SSDPDatagram, lan_address: str, gateway_address: str,
-                 loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+                 loop: Optional[asyncio.AbstractEventLoop] = None, soap_pool_size: int = 4,
+                 soap_idle_timeout: float = 5.0) -> None:
         self._loop = loop or asyncio.get_event_loop()
         self._ok_packet = ok_packet
         self._lan_address = lan_address
@@ -95,10 +109,18 @@ class Gateway:
         self._device: Optional[Device] = None
         self._devices: List[Device] = []
         self._services: List[Service] = []
+        # indexes of the device tree, built on first use and dropped when the tree is reloaded
+        self._services_index: Optional[Dict[str, Service]] = None
+        self._devices_index: Optional[Dict[str, Device]] = None
+
+        # the M-SEARCH variant the gateway replied to, if known
+        self.m_search_args: Optional[Dict[str, typing.Union[int, str]]] = None
 
         self._unsupported_actions: Dict[str, typing.List[str]] = {}
         self._registered_commands: Dict[str, str] = {}
-        self.commands = SOAPCommands(self._loop, self.base_ip, self.port)
+        self.commands = SOAPCommands(self._loop, self.base_ip, self.port, soap_pool_size, soap_idle_timeout)
+        # bounds the batched soap requests to the gateway, so they can share the kept-alive connections
+        self.soap_request_limit = asyncio.Semaphore(soap_pool_size, loop=self._loop)
 
     @property
     def manufacturer_string(self) -> str:
@@ -109,23 +131,29 @@ class Gateway:
             manufacturer_string = f"{device.manufacturer} {device.modelName}"
         return manufacturer_string
 
+    @property
+    def fingerprint(self) -> str:
+        return get_fingerprint(self._ok_packet)
+
     @property
     def services(self) -> Dict[str, Service]:
-        services: Dict[str, Service] = {}
-        if self._services:
-            for service in self._services:
-                if service.serviceType is not None:
-                    services[service.serviceType] = service
-        return services
+        if self._services_index is None:
+            self._services_index = {
+                service.serviceType: service for service in self._services if service.serviceType is not None
+            }
+        return self._services_index
 
     @property
     def devices(self) -> Dict[str, Device]:
-        devices: Dict[str, Device] = {}
-        if self._device:
-            for device in self._devices:
-                if device.udn is not None:
-                    devices[device.udn] = device
-        return devices
+        if self._devices_index is None:
+            self._devices_index = {} if not self._device else {
+                device.udn: device for device in self._devices if device.udn is not None
+            }
+        return self._devices_index
+
+    def _device_tree_changed(self) -> None:
+        self._services_index = None
+        self._devices_index = None
 
     # def get_service(self, service_type: str) -> Optional[Service]:
     #     for service in self._services:
@@ -156,14 +184,15 @@ class Gateway:
     @classmethod
     async def _try_gateway_from_ssdp(cls, datagram: SSDPDatagram, lan_address: str,
                                      gateway_address: str,
-                                     loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional['Gateway']:
+                                     loop: Optional[asyncio.AbstractEventLoop] = None, soap_pool_size: int = 4,
+                                     soap_idle_timeout: float = 5.0) -> Optional['Gateway']:
         required_commands: typing.List[str] = [
             'AddPortMapping',
             'DeletePortMapping',
             'GetExternalIPAddress'
         ]
         try:
-            gateway = cls(datagram, lan_address, gateway_address, loop=loop)
+            gateway = cls(datagram, lan_address, gateway_address, loop, soap_pool_size, soap_idle_timeout)
             log.debug('get gateway descriptor %s', datagram.location)
             await gateway.discover_commands()
             requirements_met = all([gateway.commands.is_registered(required) for required in required_commands])
@@ -187,60 +216,172 @@ class Gateway:
     async def _gateway_from_igd_args(cls, lan_address: str, gateway_address: str,
                                      igd_args: typing.Dict[str, typing.Union[int, str]],
                                      timeout: int = 30,
-                                     loop: Optional[asyncio.AbstractEventLoop] = None) -> 'Gateway':
+                                     loop: Optional[asyncio.AbstractEventLoop] = None, soap_pool_size: int = 4,
+                                     soap_idle_timeout: float = 5.0) -> 'Gateway':
         datagram = await m_search(lan_address, gateway_address, igd_args, timeout, loop)
-        gateway = await cls._try_gateway_from_ssdp(datagram, lan_address, gateway_address, loop)
+        gateway = await cls._try_gateway_from_ssdp(
+            datagram, lan_address, gateway_address, loop, soap_pool_size, soap_idle_timeout
+        )
         if not gateway:
             raise UPnPError("no gateway found for given args")
+        gateway.m_search_args = igd_args
         return gateway
 
     @classmethod
     async def _discover_gateway(cls, lan_address: str, gateway_address: str, timeout: int = 3,
-                                loop: Optional[asyncio.AbstractEventLoop] = None) -> 'Gateway':
-        ignored: typing.Set[str] = set()
+                                loop: Optional[asyncio.AbstractEventLoop] = None, soap_pool_size: int = 4,
+                                soap_idle_timeout: float = 5.0, max_concurrent_probes: int = 4,
+                                preferred_m_search_args: Optional[typing.List[typing.Dict[str, typing.Union[int, str]]]]
+                                = None) -> 'Gateway':
+        loop = loop or asyncio.get_event_loop()
+        probed: typing.Set[str] = set()
+        candidates: typing.List[typing.Tuple[int, int, SSDPDatagram]] = []
+        arrival = itertools.count()
+        probes: typing.Set['asyncio.Future[Optional[Gateway]]'] = set()
+        next_reply: Optional['asyncio.Future[SSDPDatagram]'] = None
         ssdp_proto = await multi_m_search(
-            lan_address, gateway_address, timeout, loop
+            lan_address, gateway_address, timeout, loop, preferred_m_search_args
         )
         try:
             while True:
-                datagram = await ssdp_proto.devices.get()
-                if datagram.location in ignored:
-                    continue
-                gateway = await cls._try_gateway_from_ssdp(datagram, lan_address, gateway_address, loop)
-                if gateway:
-                    return gateway
-                elif datagram.location:
-                    ignored.add(datagram.location)
+                while not ssdp_proto.devices.empty():
+                    datagram = ssdp_proto.devices.get_nowait()
+                    heapq.heappush(candidates, (get_probe_priority(datagram), next(arrival), datagram))
+                while candidates and len(probes) < max_concurrent_probes:
+                    datagram = heapq.heappop(candidates)[2]
+                    if not datagram.location or datagram.location in probed:
+                        continue
+                    probed.add(datagram.location)
+                    probes.add(loop.create_task(cls._try_gateway_from_ssdp(
+                        datagram, lan_address, gateway_address, loop, soap_pool_size, soap_idle_timeout
+                    )))
+                if next_reply is None:
+                    next_reply = loop.create_task(ssdp_proto.devices.get())
+                waiting: typing.Set['asyncio.Future[typing.Any]'] = set(probes)
+                waiting.add(next_reply)
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if next_reply in done:
+                    datagram = next_reply.result()
+                    heapq.heappush(candidates, (get_probe_priority(datagram), next(arrival), datagram))
+                    next_reply = None
+                for probe in probes.intersection(done):
+                    probes.remove(probe)
+                    gateway = probe.result()
+                    if gateway:
+                        gateway.m_search_args = ssdp_proto.replied_variants.get(gateway.fingerprint)
+                        return gateway
         finally:
+            for probe in probes:
+                probe.cancel()
+            if next_reply is not None:
+                next_reply.cancel()
             ssdp_proto.disconnect()
 
     @classmethod
     async def discover_gateway(cls, lan_address: str, gateway_address: str, timeout: int = 3,
                                igd_args: Optional[typing.Dict[str, typing.Union[int, str]]] = None,
-                               loop: Optional[asyncio.AbstractEventLoop] = None) -> 'Gateway':
+                               loop: Optional[asyncio.AbstractEventLoop] = None, soap_pool_size: int = 4,
+                               soap_idle_timeout: float = 5.0, max_concurrent_probes: int = 4,
+                               preferred_m_search_args: Optional[typing.List[typing.Dict[str, typing.Union[int, str]]]]
+                               = None) -> 'Gateway':
         loop = loop or asyncio.get_event_loop()
         if igd_args:
-            return await cls._gateway_from_igd_args(lan_address, gateway_address, igd_args, timeout, loop)
+            return await cls._gateway_from_igd_args(
+                lan_address, gateway_address, igd_args, timeout, loop, soap_pool_size, soap_idle_timeout
+            )
         try:
             return await asyncio.wait_for(loop.create_task(
-                cls._discover_gateway(lan_address, gateway_address, timeout, loop)
+                cls._discover_gateway(
+                    lan_address, gateway_address, timeout, loop, soap_pool_size, soap_idle_timeout,
+                    max_concurrent_probes, preferred_m_search_args
+                )
             ), timeout, loop=loop)
         except asyncio.TimeoutError:
             raise UPnPError(f"M-SEARCH for {gateway_address}:1900 timed out")
 
-    async def discover_commands(self) -> None:
+    def get_cache_entry(self) -> Dict[str, typing.Any]:
+        return {
+            'reply': self._ok_packet.as_dict(),
+            'gateway_xml': self._xml_response.decode(),
+            'services_xml': dict(self._service_descriptors),
+            'registered_soap_commands': dict(self._registered_commands)
+        }
+
+    @classmethod
+    async def from_cache_entry(cls, entry: Dict[str, typing.Any], lan_address: str, gateway_address: str,
+                               loop: Optional[asyncio.AbstractEventLoop] = None, soap_pool_size: int = 4,
+                               soap_idle_timeout: float = 5.0) -> 'Gateway':
+        """
+        Rebuild a gateway from a cache entry, validating it by fetching the device description again. The cached
+        service descriptors are used in place of requesting them.
+        """
+        try:
+            gateway = cls(
+                SSDPDatagram("OK", entry['reply']), lan_address, gateway_address, loop, soap_pool_size,
+                soap_idle_timeout
+            )
+            cached_response = deserialize_cached_response(entry['gateway_xml'].encode())[0]
+            services_xml: Dict[str, str] = entry['services_xml']
+            registered_commands: Dict[str, str] = entry['registered_soap_commands']
+        except (AssertionError, IndexError, KeyError, TypeError, AttributeError) as err:
+            raise UPnPError(f"invalid cached gateway: {err.__class__.__name__}({str(err)})")
+        response, xml_bytes, get_err = await scpd_get(
+            gateway.path.decode(), gateway.base_ip.decode(), gateway.port, loop=gateway._loop
+        )
+        if get_err is not None:
+            raise get_err
+        if not response or response != cached_response:
+            raise UPnPError("gateway description does not match the cached description")
+        gateway._xml_response = xml_bytes
+        gateway._load_device_description(response)
+        for service in gateway.services.values():
+            if service.SCPDURL not in services_xml:
+                raise UPnPError(f"no cached descriptor for {service.SCPDURL}")
+            gateway._register_service_commands(
+                service, *deserialize_cached_response(services_xml[service.SCPDURL].encode())
+            )
+        if gateway._registered_commands != registered_commands:
+            raise UPnPError("registered commands do not match the cached commands")
+        return gateway
+
+    async def discover_commands(self, max_concurrent_requests: int = 3) -> None:
         response, xml_bytes, get_err = await scpd_get(
             self.path.decode(), self.base_ip.decode(), self.port, loop=self._loop
         )
         self._xml_response = xml_bytes
         if get_err is not None:
             raise get_err
-        spec_version = get_dict_val_case_insensitive(response, SPEC_VERSION)
+        self._load_device_description(response)
+        services = list(self.services.values())
+        semaphore = asyncio.Semaphore(max_concurrent_requests, loop=self._loop)
+
+        async def get_descriptor(service: Service) -> typing.Tuple[typing.Dict[str, typing.Any], bytes,
+                                                                     typing.Optional[Exception]]:
+            async with semaphore:
+                return await self._get_service_descriptor(service, self._loop)
+
+        # fetch the service descriptors concurrently, but register their commands in the order of the device tree
+        descriptors = await asyncio.gather(
+            *(get_descriptor(service) for service in services), loop=self._loop, return_exceptions=True
+        )
+        for service, descriptor in zip(services, descriptors):
+            if isinstance(descriptor, BaseException):
+                raise descriptor
+            self._register_service_commands(service, *descriptor)
+        return None
+
+    def _load_device_description(self, response: typing.Dict[str, typing.Any]) -> None:
+        # only the keys read here, so that keys differing only by case elsewhere in the description are not an error
+        fields: CaseInsensitiveDict[str, typing.Any] = CaseInsensitiveDict(
+            (key, value) for key, value in response.items()
+            if key.lower() in (SPEC_VERSION.lower(), "urlbase", "device")
+        )
+        spec_version = fields.get(SPEC_VERSION)
         if isinstance(spec_version, bytes):
             self.spec_version = spec_version.decode()
         else:
             self.spec_version = spec_version
-        url_base = get_dict_val_case_insensitive(response, "urlbase")
+        url_base = fields.get("urlbase")
         if isinstance(url_base, bytes):
             self.url_base = url_base.decode()
         else:
@@ -248,37 +389,35 @@ class Gateway:
         if not self.url_base:
             self.url_base = self.base_address.decode()
         if response:
-            source_keys: typing.List[str] = list(response.keys())
-            matches: typing.List[str] = list(filter(lambda x: x.lower() == "device", source_keys))
-            match_key = matches[0]
-            match: dict = response[match_key]
-            # if not len(match):
-            #     return None
-            # if len(match) > 1:
-            #     raise KeyError("overlapping keys")
-            # if len(match) == 1:
-            #     matched_key: typing.AnyStr = match[0]
-            #     return source[matched_key]
-            # raise KeyError("overlapping keys")
-
+            match: dict = fields["device"]
             self._device = Device(
                 self._devices, self._services, **match
             )
         else:
             self._device = Device(self._devices, self._services)
-        for service_type in self.services.keys():
-            await self.register_commands(self.services[service_type], self._loop)
+        self._device_tree_changed()
         return None
 
-    async def register_commands(self, service: Service,
-                                loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+    async def _get_service_descriptor(self, service: Service,
+                                      loop: Optional[asyncio.AbstractEventLoop] = None) -> typing.Tuple[
+                                            typing.Dict[str, typing.Any], bytes, typing.Optional[Exception]]:
         if not service.SCPDURL:
             raise UPnPError("no scpd url")
         if not service.serviceType:
             raise UPnPError("no service type")
 
         log.debug("get descriptor for %s from %s", service.serviceType, service.SCPDURL)
-        service_dict, xml_bytes, get_err = await scpd_get(service.SCPDURL, self.base_ip.decode(), self.port, loop=loop)
+        return await scpd_get(service.SCPDURL, self.base_ip.decode(), self.port, loop=loop)
+
+    async def register_commands(self, service: Service,
+                                loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        service_dict, xml_bytes, get_err = await self._get_service_descriptor(service, loop)
+        self._register_service_commands(service, service_dict, xml_bytes, get_err)
+        return None
+
+    def _register_service_commands(self, service: Service, service_dict: typing.Dict[str, typing.Any],
+                                   xml_bytes: bytes, get_err: typing.Optional[Exception]) -> None:
+        assert service.SCPDURL is not None and service.serviceType is not None
         self._service_descriptors[service.SCPDURL] = xml_bytes.decode()
 
         if get_err is not None:
@@ -289,7 +428,11 @@ class Gateway:
         if not service_dict:
             return None
 
-        action_list = get_action_list(service_dict)
+        body = xml_bytes.split(b'\r\n\r\n', 1)[-1]
+        action_list = PARSE_CACHE.get_action_list(body)
+        if action_list is None:
+            action_list = get_action_list(service_dict)
+            PARSE_CACHE.set_action_list(body, action_list)
         for name, inputs, outputs in action_list:
             try:
                 self.commands.register(name, service, inputs, outputs)
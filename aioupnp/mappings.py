@@ -0,0 +1,220 @@
+import math
+import time
+import typing
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, NamedTuple
+from aioupnp.fault import UPnPError
+from aioupnp.commands import GetGenericPortMappingEntryResponse
+
+log = logging.getLogger(__name__)
+
+# the error descriptions gateways answer GetGenericPortMappingEntry with past the end of the table
+END_OF_TABLE_ERRORS = ('SpecifiedArrayIndexInvalid', 'NoSuchEntryInArray')
+# the error descriptions gateways answer GetListOfPortMappings with for a range without mappings
+EMPTY_RANGE_ERRORS = ('PortMappingNotFound',) + END_OF_TABLE_ERRORS
+# the error codes of AddPortMapping for an external port that is already taken (ConflictInMappingEntry and
+# ConflictWithOtherMechanisms)
+CONFLICT_ERROR_CODES = (718, 729)
+
+
+class PortMappingSpec(NamedTuple):
+    """A port mapping to add with UPnP.add_port_mappings"""
+    external_port: int
+    protocol: str
+    internal_port: int
+    lan_address: str
+    description: str
+    lease_time: int = 0
+
+
+class PortMappingTable:
+    """
+    In memory copy of a gateway's port mapping table, keyed by (external port, protocol).
+
+    The table is loaded from a full walk of the gateway's mappings and then kept up to date with the mappings added
+    and deleted through the same UPnP object. It goes stale ttl seconds after it was loaded, or when invalidated
+    (for instance after a failed change, when the state of the gateway is unknown), and is then loaded again.
+    """
+
+    def __init__(self, ttl: float = 60.0, clock: typing.Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self._clock = clock
+        self._loaded_at: Optional[float] = None
+        self._mappings: 'OrderedDict[Tuple[int, str], GetGenericPortMappingEntryResponse]' = OrderedDict()
+
+    @staticmethod
+    def get_key(external_port: int, protocol: str) -> Tuple[int, str]:
+        return int(external_port), protocol.upper()
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and self._clock() - self._loaded_at < self.ttl
+
+    def load(self, mappings: List[GetGenericPortMappingEntryResponse]) -> None:
+        self._mappings.clear()
+        for mapping in mappings:
+            self._mappings[self.get_key(mapping.external_port, mapping.protocol)] = mapping
+        self._loaded_at = self._clock()
+        return None
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+        return None
+
+    def add(self, mapping: GetGenericPortMappingEntryResponse) -> None:
+        if self._loaded_at is not None:
+            self._mappings[self.get_key(mapping.external_port, mapping.protocol)] = mapping
+        return None
+
+    def remove(self, external_port: int, protocol: str) -> None:
+        self._mappings.pop(self.get_key(external_port, protocol), None)
+        return None
+
+    def get(self, external_port: int, protocol: str) -> Optional[GetGenericPortMappingEntryResponse]:
+        return self._mappings.get(self.get_key(external_port, protocol))
+
+    def mappings(self) -> List[GetGenericPortMappingEntryResponse]:
+        return list(self._mappings.values())
+
+    def __contains__(self, key: Tuple[int, str]) -> bool:
+        return self.get_key(*key) in self._mappings
+
+    def __len__(self) -> int:
+        return len(self._mappings)
+
+
+class FetchWindow:
+    """
+    How many GetGenericPortMappingEntry requests to keep in flight while walking a gateway's mapping table.
+
+    The size is tuned by hill climbing on the rate entries are fetched at: after every sample of twice the window's
+    worth of answers it doubles if the rate improved on the previous sample (or there is none yet), halves if the
+    rate got worse, and otherwise holds. When the gateway fails a request that it answers when asked again the size
+    halves, and stays at most that from then on. The size is kept between walks, so a gateway is only probed for a
+    good window once.
+    """
+
+    def __init__(self, size: int = 4, max_size: int = 16, clock: typing.Callable[[], float] = time.monotonic) -> None:
+        self.size = max(1, min(size, max_size))
+        self.max_size = max_size
+        self._limit = max_size  # lowered to below the sizes that made the gateway fail requests
+        self._clock = clock
+        self._rate: Optional[float] = None
+        self._sample_started_at = clock()
+        self._sample_count = 0
+
+    def start(self) -> None:
+        self._sample_started_at = self._clock()
+        self._sample_count = 0
+        return None
+
+    def completed(self) -> None:
+        self._sample_count += 1
+        if self._sample_count < self.size * 2:
+            return None
+        rate = self._sample_count / max(self._clock() - self._sample_started_at, 1e-6)
+        if self._rate is None or rate > self._rate * 1.1:
+            self.size = min(self._limit, self.size * 2)
+        elif rate < self._rate * 0.9:
+            self.size = max(1, self.size // 2)
+        self._rate = rate
+        self.start()
+        return None
+
+    def failed(self) -> None:
+        self.size = self._limit = max(1, self.size // 2)
+        self._rate = None
+        self.start()
+        return None
+
+
+async def walk_mapping_table(fetch: typing.Callable[[int], typing.Awaitable[GetGenericPortMappingEntryResponse]],
+                             window: FetchWindow,
+                             loop: Optional[asyncio.AbstractEventLoop] = None
+                             ) -> List[GetGenericPortMappingEntryResponse]:
+    """
+    Fetch the entries of a mapping table by index, keeping window.size requests in flight for the indexes past the
+    last answered one.
+
+    The table ends at the lowest index that fails (or is answered with nothing). Requests past it are cancelled and
+    their answers dropped. A failure other than the end of table errors, for a request sent alongside others, is
+    retried once without the requests past it in flight before it is taken as the end, and shrinks the window if
+    the retry is answered.
+    """
+    loop = loop or asyncio.get_event_loop()
+    entries: Dict[int, GetGenericPortMappingEntryResponse] = {}
+    pending: Dict['asyncio.Future[GetGenericPortMappingEntryResponse]', Tuple[int, int]] = {}
+    next_index = 0
+    end: Optional[int] = None
+    window.start()
+    try:
+        while True:
+            while end is None and len(pending) < window.size:
+                if next_index not in entries:
+                    pending[loop.create_task(fetch(next_index))] = (next_index, window.size)
+                next_index += 1
+            if not pending:
+                break
+            done, _ = await asyncio.wait(list(pending), loop=loop, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: pending[t][0]):
+                if task not in pending:  # past an end found earlier in this loop
+                    continue
+                index, window_size = pending.pop(task)
+                err = task.exception()
+                if err is not None and not isinstance(err, UPnPError):
+                    raise err
+                entry = task.result() if err is None else None
+                if entry is not None:
+                    entries[index] = entry
+                    window.completed()
+                    continue
+                if err is not None and window_size > 1 and str(err) not in END_OF_TABLE_ERRORS:
+                    # stop the requests past this one, to be sent again if it's answered
+                    for other, (other_index, _) in list(pending.items()):
+                        if other_index > index:
+                            other.cancel()
+                            del pending[other]
+                    next_index = index + 1
+                    try:
+                        entry = await fetch(index)
+                    except UPnPError:
+                        entry = None
+                    if entry is not None:
+                        log.debug("gateway failed a concurrent mapping request (%s), shrinking the window", err)
+                        entries[index] = entry
+                        window.failed()
+                        continue
+                end = index
+                for other, (other_index, _) in list(pending.items()):
+                    if other_index > end:
+                        other.cancel()
+                        del pending[other]
+    finally:
+        for task in pending:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # retrieved so that it isn't logged as never retrieved
+    return [entries[index] for index in sorted(entries) if end is None or index < end]
+
+
+def port_probe_sequence(port: int, seed: str, low: int = 1024, high: int = 65535) -> typing.Iterator[int]:
+    """
+    The external ports to try for a mapping: the requested port, then each port in [low, high] once, in an order
+    given by hashing the seed (such as the lan address and the mapping), so that hosts probing for a free port at
+    the same time are unlikely to try the same ports
+    """
+    yield port
+    size = high - low + 1
+    digest = hashlib.sha256(seed.encode()).digest()
+    start = int.from_bytes(digest[:8], 'big') % size
+    step = int.from_bytes(digest[8:16], 'big') % size | 1
+    while math.gcd(step, size) != 1:
+        step += 2
+    for i in range(size):
+        candidate = low + (start + i * step) % size
+        if candidate != port:
+            yield candidate
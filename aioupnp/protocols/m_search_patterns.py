@@ -45,6 +45,7 @@ ST
 """
 
 import typing
+import functools
 from collections import OrderedDict
 from aioupnp.constants import SSDP_DISCOVER, SSDP_HOST
 
@@ -58,6 +59,13 @@ SEARCH_TARGETS: typing.List[str] = [
     'ssdp:all'
 ]
 
+# the search targets an internet gateway is most likely to answer, these are searched for first
+LIKELY_SEARCH_TARGETS: typing.List[str] = [
+    'urn:schemas-upnp-org:device:InternetGatewayDevice:1',
+    "urn:schemas-upnp-org:service:WANIPConnection:1",
+    "urn:schemas-upnp-org:service:WANPPPConnection:1",
+]
+
 
 def format_packet_args(order: typing.List[str],
                        kwargs: typing.Dict[str, typing.Union[int, str]]) -> typing.Dict[str, typing.Union[int, str]]:
@@ -85,3 +93,37 @@ def packet_generator() -> typing.Iterator[typing.Dict[str, typing.Union[int, str
         order = ["HOST", "ST", "MAN", "MX"]
         yield format_packet_args(order, {'HOST': SSDP_HOST, 'MAN': '"%s"' % SSDP_DISCOVER, 'MX': 1, 'ST': st})
         yield format_packet_args(order, {'HOST': SSDP_HOST, 'MAN': SSDP_DISCOVER, 'MX': 1, 'ST': st})
+
+
+@functools.lru_cache(maxsize=1)
+def _standard_variants() -> typing.Tuple[typing.Dict[str, typing.Union[int, str]], ...]:
+    return tuple(packet_generator())
+
+
+def packet_stages(preferred: typing.Optional[typing.List[typing.Dict[str, typing.Union[int, str]]]] = None
+                  ) -> typing.List[typing.List[typing.Dict[str, typing.Union[int, str]]]]:
+    """
+    Split the packet_generator variants into the stages of a staged M-SEARCH: the first (spec formatted) variant of
+    each likely search target, then the first variant of the remaining search targets, then every other variant.
+
+    Preferred variants, such as ones gateways are known to answer, are sent in a stage of their own ahead of these.
+    """
+    preferred = preferred or []
+    likely: typing.List[typing.Dict[str, typing.Union[int, str]]] = []
+    remaining: typing.List[typing.Dict[str, typing.Union[int, str]]] = []
+    others: typing.List[typing.Dict[str, typing.Union[int, str]]] = []
+    seen: typing.Set[str] = set()
+    skip = [list(packet_args.items()) for packet_args in preferred]
+    for packet_args in _standard_variants():
+        st = str(packet_args['ST'])
+        if list(packet_args.items()) in skip:
+            seen.add(st)
+            continue
+        if st in seen:
+            others.append(packet_args)
+        elif st in LIKELY_SEARCH_TARGETS:
+            likely.append(packet_args)
+        else:
+            remaining.append(packet_args)
+        seen.add(st)
+    return [stage for stage in (list(preferred), likely, remaining, others) if stage]
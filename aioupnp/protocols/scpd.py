@@ -1,14 +1,15 @@
 import logging
 import typing
 import re
-from collections import OrderedDict
 import asyncio
 from asyncio.protocols import Protocol
 from aioupnp.fault import UPnPError
-from aioupnp.util import get_dict_val_case_insensitive
-from aioupnp.serialization.scpd import deserialize_scpd_get_response
+from aioupnp.util import CaseInsensitiveDict
+from aioupnp.serialization.scpd import deserialize_scpd_get_dict, DescriptorStreamParser
+from aioupnp.serialization.xml import XMLStreamParser
 from aioupnp.serialization.scpd import serialize_scpd_get
 from aioupnp.serialization.soap import serialize_soap_post, deserialize_soap_post_response
+from aioupnp.serialization.soap import decode_soap_post_response_fields, SOAPRequestTemplate
 
 
 log = logging.getLogger(__name__)
@@ -22,18 +23,15 @@ def parse_http_response_code(http_response: bytes) -> typing.Tuple[bytes, bytes]
     return parsed[0]
 
 
-def parse_headers(response: bytes) -> typing.Tuple[typing.Dict[bytes, bytes], int, bytes]:
-    lines = response.split(b'\r\n')
-    headers: typing.Dict[bytes, bytes] = OrderedDict([
-        (l.split(b':')[0], b':'.join(l.split(b':')[1:]).lstrip(b' ').rstrip(b' '))
-        for l in response.split(b'\r\n')
-    ])
-    if len(lines) != len(headers):
-        raise ValueError("duplicate headers")
-    header_keys: typing.List[bytes] = list(headers.keys())
-    http_response = header_keys[0]
+def parse_headers(response: bytes) -> typing.Tuple[CaseInsensitiveDict[bytes, bytes], int, bytes]:
+    http_response, *lines = response.split(b'\r\n')
+    headers: CaseInsensitiveDict[bytes, bytes] = CaseInsensitiveDict()
+    for line in lines:
+        name, _, value = line.partition(b':')
+        if name in headers:
+            raise ValueError("duplicate headers")
+        headers[name] = value.strip(b' ')
     response_code, message = parse_http_response_code(http_response)
-    del headers[http_response]
     return headers, int(response_code), message
 
 
@@ -43,12 +41,22 @@ class SCPDHTTPClientProtocol(Protocol):
 
     It differs from spec HTTP in that the version string can be invalid, all we care about is the xml body
     and devices respond with an invalid HTTP version line
+
+    The response is parsed incrementally: received bytes are appended to a buffer once, the header block is
+    located and parsed a single time, and the body is measured against the content length from the remembered
+    header/body offset, so parsing is linear in the size of the response.
+
+    If given a xml_parser the body is fed into it as it arrives, so that parsing the xml overlaps with receiving it.
+    The fed body is then kept as the received chunks instead of in the buffer, which only holds the headers, and the
+    result holds the raw response without a separate copy of the body.
     """
 
     def __init__(self, message: bytes, finished: 'asyncio.Future[typing.Tuple[bytes, bytes, int, bytes]]',
-                 soap_method: typing.Optional[str] = None, soap_service_id: typing.Optional[str] = None) -> None:
+                 soap_method: typing.Optional[str] = None, soap_service_id: typing.Optional[str] = None,
+                 xml_parser: typing.Optional[XMLStreamParser] = None) -> None:
         self.message = message
-        self.response_buff = b""
+        self.xml_parser = xml_parser
+        self._buffer = bytearray()
         self.finished = finished
         self.soap_method = soap_method
         self.soap_service_id = soap_service_id
@@ -57,69 +65,271 @@ class SCPDHTTPClientProtocol(Protocol):
         self._content_length = 0
         self._got_headers = False
         self._has_content_length = True
-        self._headers: typing.Dict[bytes, bytes] = {}
-        self._body = b""
+        self._headers: CaseInsensitiveDict[bytes, bytes] = CaseInsensitiveDict()
+        self._body_offset = 0
+        self._body_chunks: typing.List[bytes] = []
+        self._body_length = 0
+        self._scanned = 0
+        self.keep_alive = False
+        self.closed = False
         self.transport: typing.Optional[asyncio.WriteTransport] = None
 
+    @property
+    def response_buff(self) -> bytes:
+        return b''.join([self._buffer, *self._body_chunks])
+
     def connection_made(self, transport: asyncio.BaseTransport) -> None:
         assert isinstance(transport, asyncio.WriteTransport)
         self.transport = transport
         self.transport.write(self.message)
         return None
 
+    def connection_lost(self, exc: typing.Optional[Exception]) -> None:
+        self.closed = True
+        self.keep_alive = False
+        if not self.finished.done() and not self._buffer:
+            self.finished.set_exception(UPnPError("connection closed by gateway"))
+        return None
+
+    def send_request(self, message: bytes, finished: 'asyncio.Future[typing.Tuple[bytes, bytes, int, bytes]]',
+                     soap_method: typing.Optional[str] = None,
+                     soap_service_id: typing.Optional[str] = None) -> None:
+        """
+        Reset the response parser and write another request on this (kept-alive) connection
+        """
+        assert self.transport is not None and not self.closed
+        self.message = message
+        self._buffer = bytearray()
+        self.finished = finished
+        self.soap_method = soap_method
+        self.soap_service_id = soap_service_id
+        self._response_code = 0
+        self._response_msg = b""
+        self._content_length = 0
+        self._got_headers = False
+        self._has_content_length = True
+        self._headers = CaseInsensitiveDict()
+        self._body_offset = 0
+        self._body_chunks = []
+        self._body_length = 0
+        self._scanned = 0
+        self.keep_alive = False
+        self.transport.write(message)
+        return None
+
+    def _find_headers_end(self) -> int:
+        # resume the search for the blank line a few bytes back in case the separator was split between chunks
+        idx = self._buffer.find(b'\r\n\r\n', max(0, self._scanned - 3))
+        self._scanned = len(self._buffer)
+        return idx
+
+    def _feed_body(self, data: bytes) -> None:
+        assert self.xml_parser is not None
+        self.xml_parser.feed(data)
+        self._body_chunks.append(data)
+        self._body_length += len(data)
+        return None
+
+    def _body_endswith(self, suffix: bytes) -> bool:
+        if self.xml_parser is None:
+            return self._buffer.endswith(suffix)
+        # the suffix may be split between the last chunks
+        tail = b''
+        for chunk in reversed(self._body_chunks):
+            tail = chunk + tail
+            if len(tail) >= len(suffix):
+                break
+        return tail.endswith(suffix)
+
+    def _set_response(self) -> None:
+        raw_response = self.response_buff
+        # a streamed body was already consumed by the xml parser
+        body = b'' if self.xml_parser is not None else raw_response[self._body_offset:]
+        self.finished.set_result((raw_response, body, self._response_code, self._response_msg))
+        return None
+
     def data_received(self, data: bytes) -> None:
         if self.finished.done():  # possible to hit during tests
             return
-        self.response_buff += data
-        for i, line in enumerate(self.response_buff.split(b'\r\n')):
-            if not line:  # we hit the blank line between the headers and the body
-                if i == (len(self.response_buff.split(b'\r\n')) - 1):
-                    return None  # the body is still yet to be written
-                if not self._got_headers:
-                    try:
-                        self._headers, self._response_code, self._response_msg = parse_headers(
-                            b'\r\n'.join(self.response_buff.split(b'\r\n')[:i])
+        if self._got_headers and self.xml_parser is not None:
+            self._feed_body(data)
+        else:
+            self._buffer.extend(data)
+        if not self._got_headers:
+            headers_end = self._find_headers_end()
+            if headers_end < 0:
+                return None  # the body is still yet to be written
+            try:
+                self._headers, self._response_code, self._response_msg = parse_headers(
+                    bytes(self._buffer[:headers_end])
+                )
+            except ValueError as err:
+                self.finished.set_exception(UPnPError(str(err)))
+                return None
+            content_length = self._headers.get(b'Content-Length')
+            if content_length is not None:
+                self._content_length = int(content_length)
+            else:
+                self._has_content_length = False
+            connection = self._headers.get(b'Connection')
+            if not self._has_content_length:  # the end of the body can't be told apart from a following response
+                self.keep_alive = False
+            elif connection is not None:
+                self.keep_alive = connection.strip().lower() == b'keep-alive'
+            else:  # persistent by default unless the gateway answered as HTTP/1.0
+                self.keep_alive = not self._buffer.startswith(b'HTTP/1.0')
+            self._body_offset = headers_end + 4
+            self._got_headers = True
+            if self.xml_parser is not None:
+                body = bytes(self._buffer[self._body_offset:])
+                del self._buffer[self._body_offset:]
+                self._feed_body(body)
+
+        body_length = self._body_length if self.xml_parser is not None else len(self._buffer) - self._body_offset
+        if self._has_content_length:
+            if self._content_length == body_length:
+                self._set_response()
+            elif self._content_length < body_length:
+                self.finished.set_exception(
+                    UPnPError(
+                        "too many bytes written to response (%i vs %i expected)" % (
+                            body_length, self._content_length
                         )
-                    except ValueError as err:
-                        self.finished.set_exception(UPnPError(str(err)))
-                        return
-                    content_length = get_dict_val_case_insensitive(
-                        self._headers, b'Content-Length'
                     )
-                    if content_length is not None:
-                        self._content_length = int(content_length)
-                    else:
-                        self._has_content_length = False
-                    self._got_headers = True
-                if self._got_headers and self._has_content_length:
-                    body = b'\r\n'.join(self.response_buff.split(b'\r\n')[i+1:])
-                    if self._content_length == len(body):
-                        self.finished.set_result((self.response_buff, body, self._response_code, self._response_msg))
-                    elif self._content_length > len(body):
-                        pass
-                    else:
-                        self.finished.set_exception(
-                            UPnPError(
-                                "too many bytes written to response (%i vs %i expected)" % (
-                                    len(body), self._content_length
-                                )
-                            )
-                        )
-                elif any(map(self.response_buff.endswith, (b"</root>\r\n", b"</scpd>\r\n"))):
-                    # Actiontec has a router that doesn't give a Content-Length for the gateway xml
-                    body = b'\r\n'.join(self.response_buff.split(b'\r\n')[i+1:])
-                    self.finished.set_result((self.response_buff, body, self._response_code, self._response_msg))
-                elif len(self.response_buff) >= 65535:
-                    self.finished.set_exception(
-                        UPnPError(
-                            "too many bytes written to response (%i) with unspecified content length" % len(self.response_buff)
-                            )
-                        )
-                    return
+                )
+        elif self._body_endswith(b"</root>\r\n") or self._body_endswith(b"</scpd>\r\n"):
+            # Actiontec has a router that doesn't give a Content-Length for the gateway xml
+            self._set_response()
+        elif self._body_offset + body_length >= 65535:
+            self.finished.set_exception(
+                UPnPError(
+                    "too many bytes written to response (%i) with unspecified content length" % (
+                        self._body_offset + body_length
+                    )
+                )
+            )
+        return None
+
+
+class SCPDConnectionPool:
+    """
+    Kept-alive HTTP/1.1 connections to the SOAP control server of a gateway
+
+    A connection is returned to the pool after a complete response unless the gateway asked to close it (or
+    answered as HTTP/1.0), and is closed after idling for `idle_timeout` seconds. Gateways that close the
+    connection anyway transparently fall back to one connection per request. If a gateway fails to answer on a
+    reused connection (some send `Connection: keep-alive` and then ignore a second request) the idle connections
+    are closed and the request is retried on a new connection. After `max_reuse_failures` such failures in a row
+    connections to it are no longer reused, `keep_alive` is cleared.
+
+    At most `pool_size` requests are in flight at once, further requests wait for a connection.
+    """
+
+    def __init__(self, address: str, port: int, pool_size: int = 4, idle_timeout: float = 5.0,
+                 loop: typing.Optional[asyncio.AbstractEventLoop] = None, max_reuse_failures: int = 3) -> None:
+        self._loop = loop or asyncio.get_event_loop()
+        self.address = address
+        self.port = port
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.max_reuse_failures = max_reuse_failures
+        self.keep_alive = True
+        self._reuse_failures = 0
+        self._idle: typing.List[typing.Tuple[asyncio.BaseTransport, SCPDHTTPClientProtocol,
+                                             asyncio.TimerHandle]] = []
+        self._checkouts = asyncio.Semaphore(pool_size, loop=self._loop)
+
+    def _checkout(self) -> typing.Optional[typing.Tuple[asyncio.BaseTransport, SCPDHTTPClientProtocol]]:
+        while self._idle:
+            transport, protocol, expire_handle = self._idle.pop()
+            expire_handle.cancel()
+            if not protocol.closed:
+                return transport, protocol
+            transport.close()
+        return None
+
+    def _release(self, transport: asyncio.BaseTransport, protocol: SCPDHTTPClientProtocol) -> None:
+        if not self.keep_alive or not protocol.keep_alive or protocol.closed or len(self._idle) >= self.pool_size:
+            transport.close()
+            return None
+        expire_handle = self._loop.call_later(self.idle_timeout, self._expire, protocol)
+        self._idle.append((transport, protocol, expire_handle))
+        return None
+
+    def _expire(self, protocol: SCPDHTTPClientProtocol) -> None:
+        for i, (transport, idle_protocol, _) in enumerate(self._idle):
+            if idle_protocol is protocol:
+                del self._idle[i]
+                transport.close()
+                break
+        return None
+
+    def close(self) -> None:
+        while self._idle:
+            transport, _, expire_handle = self._idle.pop()
+            expire_handle.cancel()
+            transport.close()
+        return None
+
+    async def request(self, message: bytes, soap_method: typing.Optional[str] = None,
+                      soap_service_id: typing.Optional[str] = None,
+                      timeout: float = 1.0) -> SCPDHTTPClientProtocol:
+        """
+        Send a request on an idle connection, or on a new one if there are none, and wait for the response
+
+        Returns the protocol once its `finished` future is done, raises ConnectionError or asyncio.TimeoutError
+        """
+        async with self._checkouts:
+            retry = False
+            while True:
+                finished: 'asyncio.Future[typing.Tuple[bytes, bytes, int, bytes]]' = self._loop.create_future()
+                idle = self._checkout() if not retry else None
+                if idle is not None:
+                    transport, protocol = idle
+                    protocol.send_request(message, finished, soap_method, soap_service_id)
                 else:
-                    # needed for the actiontec case
-                    pass
-                return None
+                    proto_factory: typing.Callable[[], SCPDHTTPClientProtocol] = lambda: SCPDHTTPClientProtocol(
+                        message, finished, soap_method=soap_method, soap_service_id=soap_service_id
+                    )
+                    connect_tup: typing.Tuple[asyncio.BaseTransport, asyncio.BaseProtocol] = \
+                        await self._loop.create_connection(proto_factory, self.address, self.port)
+                    transport = connect_tup[0]
+                    assert isinstance(connect_tup[1], SCPDHTTPClientProtocol)
+                    protocol = connect_tup[1]
+                try:
+                    await asyncio.wait_for(finished, timeout, loop=self._loop)
+                except UPnPError:
+                    transport.close()
+                    if idle is not None and protocol.closed and not protocol.response_buff:
+                        self._reuse_failed("was closed")
+                        retry = True
+                        continue
+                    return protocol
+                except asyncio.TimeoutError:
+                    transport.close()
+                    if idle is not None:
+                        self._reuse_failed("timed out")
+                        retry = True
+                        continue
+                    raise
+                except BaseException:
+                    transport.close()
+                    raise
+                if idle is not None:
+                    self._reuse_failures = 0
+                self._release(transport, protocol)
+                return protocol
+
+    def _reuse_failed(self, reason: str) -> None:
+        self._reuse_failures += 1
+        if self._reuse_failures >= self.max_reuse_failures:
+            log.debug("kept-alive connection to %s:%i %s, retrying without reusing connections", self.address,
+                      self.port, reason)
+            self.keep_alive = False
+        else:
+            log.debug("kept-alive connection to %s:%i %s, retrying on a new connection", self.address, self.port,
+                      reason)
+        self.close()
         return None
 
 
@@ -129,7 +339,10 @@ async def scpd_get(control_url: str, address: str, port: int,
     loop = loop or asyncio.get_event_loop()
     packet = serialize_scpd_get(control_url, address)
     finished: 'asyncio.Future[typing.Tuple[bytes, bytes, int, bytes]]' = loop.create_future()
-    proto_factory: typing.Callable[[], SCPDHTTPClientProtocol] = lambda: SCPDHTTPClientProtocol(packet, finished)
+    xml_parser = DescriptorStreamParser()
+    proto_factory: typing.Callable[[], SCPDHTTPClientProtocol] = lambda: SCPDHTTPClientProtocol(
+        packet, finished, xml_parser=xml_parser
+    )
     try:
         connect_tup: typing.Tuple[asyncio.BaseTransport, asyncio.BaseProtocol] = await loop.create_connection(
             proto_factory, address, port
@@ -155,7 +368,8 @@ async def scpd_get(control_url: str, address: str, port: int,
         transport.close()
     if not error:
         try:
-            return deserialize_scpd_get_response(body), raw_response, None
+            document = raw_response.split(b'\r\n\r\n', 1)[-1] if xml_parser.held_back else None
+            return deserialize_scpd_get_dict(xml_parser.close(document)), raw_response, None
         except Exception as err:
             error = UPnPError(err)
 
@@ -164,35 +378,71 @@ async def scpd_get(control_url: str, address: str, port: int,
 
 async def scpd_post(control_url: str, address: str, port: int, method: str, param_names: list, service_id: bytes,
                     loop: typing.Optional[asyncio.AbstractEventLoop] = None,
+                    pool: typing.Optional[SCPDConnectionPool] = None,
+                    response_fields: typing.Optional[typing.Dict[str, int]] = None,
+                    template: typing.Optional[SOAPRequestTemplate] = None,
                     **kwargs: typing.Dict[str, typing.Any]
-                    ) -> typing.Tuple[typing.Dict, bytes, typing.Optional[Exception]]:
+                    ) -> typing.Tuple[typing.Union[typing.Dict, typing.List[typing.Optional[str]]], bytes,
+                                      typing.Optional[Exception]]:
+    """
+    If given response_fields (output argument name to index) a successful response is decoded straight into a list
+    of the argument values, otherwise (and for faults) the response is returned as a dict.
+
+    A template compiled for the method and service is used to serialize the request if given.
+    """
     loop = loop or asyncio.get_event_loop()
-    finished: 'asyncio.Future[typing.Tuple[bytes, bytes, int, bytes]]' = loop.create_future()
-    packet = serialize_soap_post(method, param_names, service_id, address.encode(), control_url.encode(), **kwargs)
-    proto_factory: typing.Callable[[], SCPDHTTPClientProtocol] = lambda:\
-        SCPDHTTPClientProtocol(packet, finished, soap_method=method, soap_service_id=service_id.decode())
-    try:
-        connect_tup: typing.Tuple[asyncio.BaseTransport, asyncio.BaseProtocol] = await loop.create_connection(
-            proto_factory, address, port
+    keep_alive = pool is not None and pool.keep_alive
+    if template is not None:
+        packet = template.serialize(keep_alive=keep_alive, **kwargs)
+    else:
+        packet = serialize_soap_post(
+            method, param_names, service_id, address.encode(), control_url.encode(), keep_alive=keep_alive,
+            **kwargs
         )
-    except ConnectionError as err:
-        return {}, b'', UPnPError(f"{err.__class__.__name__}({str(err)})")
-    protocol = connect_tup[1]
-    transport = connect_tup[0]
-    assert isinstance(protocol, SCPDHTTPClientProtocol)
+    if pool is not None:
+        try:
+            protocol = await pool.request(packet, method, service_id.decode())
+            raw_response, body, response_code, response_msg = protocol.finished.result()
+        except ConnectionError as err:
+            return {}, b'', UPnPError(f"{err.__class__.__name__}({str(err)})")
+        except asyncio.TimeoutError:
+            return {}, b'', UPnPError("Timeout")
+        except UPnPError as err:
+            return {}, protocol.response_buff, err
+    else:
+        finished: 'asyncio.Future[typing.Tuple[bytes, bytes, int, bytes]]' = loop.create_future()
+        proto_factory: typing.Callable[[], SCPDHTTPClientProtocol] = lambda:\
+            SCPDHTTPClientProtocol(packet, finished, soap_method=method, soap_service_id=service_id.decode())
+        try:
+            connect_tup: typing.Tuple[asyncio.BaseTransport, asyncio.BaseProtocol] = await loop.create_connection(
+                proto_factory, address, port
+            )
+        except ConnectionError as err:
+            return {}, b'', UPnPError(f"{err.__class__.__name__}({str(err)})")
+        transport = connect_tup[0]
+        assert isinstance(connect_tup[1], SCPDHTTPClientProtocol)
+        protocol = connect_tup[1]
 
-    try:
-        wait_task: typing.Awaitable[typing.Tuple[bytes, bytes, int, bytes]] = asyncio.wait_for(finished, 1.0, loop=loop)
-        raw_response, body, response_code, response_msg = await wait_task
-    except asyncio.TimeoutError:
-        return {}, b'', UPnPError("Timeout")
-    except UPnPError as err:
-        return {}, protocol.response_buff, err
-    finally:
-        transport.close()
+        try:
+            wait_task: typing.Awaitable[typing.Tuple[bytes, bytes, int, bytes]] = asyncio.wait_for(
+                finished, 1.0, loop=loop
+            )
+            raw_response, body, response_code, response_msg = await wait_task
+        except asyncio.TimeoutError:
+            return {}, b'', UPnPError("Timeout")
+        except UPnPError as err:
+            return {}, protocol.response_buff, err
+        finally:
+            transport.close()
+    if response_fields is not None:
+        values = decode_soap_post_response_fields(body, method, response_fields)
+        if values is not None:
+            return values, raw_response, None
     try:
         return (
             deserialize_soap_post_response(body, method, service_id.decode()), raw_response, None
         )
+    except UPnPError as err:
+        return {}, raw_response, err
     except Exception as err:
         return {}, raw_response, UPnPError(err)
@@ -4,23 +4,58 @@ import asyncio
 import logging
 import typing
 import socket
-from typing import List, Set, Dict, Tuple, Optional
+import functools
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional
 from asyncio.transports import DatagramTransport
 from aioupnp.fault import UPnPError
 from aioupnp.serialization.ssdp import SSDPDatagram
 from aioupnp.constants import SSDP_IP_ADDRESS, SSDP_PORT
 from aioupnp.protocols.multicast import MulticastProtocol
-from aioupnp.protocols.m_search_patterns import packet_generator
+from aioupnp.protocols.m_search_patterns import packet_stages
 
 ADDRESS_REGEX = re.compile("^http:\/\/(\d+\.\d+\.\d+\.\d+)\:(\d*)(\/[\w|\/|\:|\-|\.]*)$")
 
 log = logging.getLogger(__name__)
 
+# how long to wait for a reply before sending the next stage of a staged M-SEARCH, doubled for every stage that
+# goes unanswered
+STAGE_INTERVAL = 0.25
+MIN_STAGE_INTERVAL = 0.05
+# once a likely gateway has replied, how long to give it to be confirmed before escalating anyway
+LIKELY_REPLY_GRACE = 1.0
+
+
+@functools.lru_cache(maxsize=256)
+def _encode_m_search(items: Tuple[Tuple[str, typing.Union[str, int]], ...]) -> Tuple[str, bytes]:
+    packet = SSDPDatagram("M-SEARCH", OrderedDict(items))
+    assert packet.st is not None
+    return packet.st, packet.encode().encode()
+
+
+def encode_m_search(m_search_args: Dict[str, typing.Union[str, int]]) -> Tuple[str, bytes]:
+    """
+    Get the ST and the serialized datagram for M-SEARCH arguments, these are only built once for a set of arguments
+    """
+    return _encode_m_search(tuple(m_search_args.items()))
+
+
+def get_fingerprint(packet: SSDPDatagram) -> str:
+    """
+    Identify the gateway model a SSDP reply came from by its SERVER header, or the USN prefix if it has none
+    """
+    if packet.server:
+        return packet.server
+    return (packet.usn or '').split('::')[0]
+
 
 class PendingSearch(typing.NamedTuple):
     address: str
     st: str
     fut: 'asyncio.Future[SSDPDatagram]'
+    devices: 'asyncio.Queue[SSDPDatagram]'
+    m_search_args: Dict[str, typing.Union[str, int]]
+    batch: int  # the send_m_searches call that sent it
 
 
 class SSDPProtocol(MulticastProtocol):
@@ -29,10 +64,15 @@ class SSDPProtocol(MulticastProtocol):
         super().__init__(multicast_address, lan_address)
         self.loop: asyncio.AbstractEventLoop = loop or asyncio.get_event_loop()
         self.transport: Optional[DatagramTransport] = None
-        self._pending_searches: List[PendingSearch] = []
+        # pending searches indexed by the (address, ST) a reply has to match
+        self._pending_searches: Dict[Tuple[str, str], List[PendingSearch]] = {}
         self.notifications: List[SSDPDatagram] = []
         self.connected = asyncio.Event(loop=self.loop)
         self.devices: 'asyncio.Queue[SSDPDatagram]' = asyncio.Queue(loop=self.loop)
+        self._staged_searches: typing.Set['asyncio.Future[None]'] = set()
+        self._batches_sent = 0
+        # the M-SEARCH variant that first got a valid reply, by gateway fingerprint
+        self.replied_variants: Dict[str, Dict[str, typing.Union[str, int]]] = {}
 
     def connection_made(self, transport: asyncio.DatagramTransport) -> None:  # type: ignore
         super().connection_made(transport)
@@ -44,57 +84,115 @@ class SSDPProtocol(MulticastProtocol):
             self.leave_group(self.multicast_address, self.bind_address)
             self.transport.close()
         self.connected.clear()
+        while self._staged_searches:
+            self._staged_searches.pop().cancel()
         while self._pending_searches:
-            pending = self._pending_searches.pop()[2]
-            if not pending.cancelled() and not pending.done():
-                pending.cancel()
+            for pending in self._pending_searches.popitem()[1]:
+                if not pending.fut.cancelled() and not pending.fut.done():
+                    pending.fut.cancel()
         return None
 
     def _callback_m_search_ok(self, address: str, packet: SSDPDatagram) -> None:
-        futures: Set['asyncio.Future[SSDPDatagram]'] = set()
-        replied: List[PendingSearch] = []
-
-        for pending in self._pending_searches:
-            # if pending.address == address and pending.st in (packet.st, "upnp:rootdevice"):
-            if pending.address == address and pending.st == packet.st:
-                replied.append(pending)
-                if pending.fut not in futures:
-                    futures.add(pending.fut)
-        if replied:
-            self.devices.put_nowait(packet)
-
-        while replied:
-            self._pending_searches.remove(replied.pop())
-
-        while futures:
-            fut = futures.pop()
+        if packet.st is None:
+            return None
+        replied = self._pending_searches.pop((address, packet.st), None)
+        if not replied:
+            return None
+        # the reply can't tell which variant of its ST it answered. Variants sent earlier went unanswered for at least
+        # as long as the stage interval, so credit the most recent batch, and the earliest variant sent in it
+        latest = max(pending.batch for pending in replied)
+        self.replied_variants.setdefault(
+            get_fingerprint(packet), next(pending for pending in replied if pending.batch == latest).m_search_args
+        )
+        # a search can have sent several variants for the same ST, deliver the reply to it once
+        queues: List['asyncio.Queue[SSDPDatagram]'] = []
+        futures: List['asyncio.Future[SSDPDatagram]'] = []
+        for pending in replied:
+            if pending.devices not in queues:
+                queues.append(pending.devices)
+            if pending.fut not in futures:
+                futures.append(pending.fut)
+        for devices in queues:
+            devices.put_nowait(packet)
+        for fut in futures:
             if not fut.done():
                 fut.set_result(packet)
+        return None
 
-    def _send_m_search(self, address: str, packet: SSDPDatagram, fut: 'asyncio.Future[SSDPDatagram]') -> None:
+    def _send_m_search(self, address: str, st: str, datagram: bytes, fut: 'asyncio.Future[SSDPDatagram]',
+                       devices: 'asyncio.Queue[SSDPDatagram]',
+                       m_search_args: Dict[str, typing.Union[str, int]]) -> None:
         if not self.transport:
             if not fut.done():
                 fut.set_exception(UPnPError("SSDP transport not connected"))
             return
-        assert packet.st is not None
-        self._pending_searches.append(
-            PendingSearch(address, packet.st, fut)
+        self._pending_searches.setdefault((address, st), []).append(
+            PendingSearch(address, st, fut, devices, m_search_args, self._batches_sent)
         )
-        self.transport.sendto(packet.encode().encode(), (SSDP_IP_ADDRESS, SSDP_PORT))
+        self.transport.sendto(datagram, (SSDP_IP_ADDRESS, SSDP_PORT))
 
         # also send unicast
-        log.debug("send m search to %s: %s", address, packet.st)
-        self.transport.sendto(packet.encode().encode(), (address, SSDP_PORT))
+        log.debug("send m search to %s: %s", address, st)
+        self.transport.sendto(datagram, (address, SSDP_PORT))
 
-    def send_m_searches(self, address: str,
-                        datagrams: List[Dict[str, typing.Union[str, int]]]) -> 'asyncio.Future[SSDPDatagram]':
+    def send_m_searches(self, address: str, datagrams: List[Dict[str, typing.Union[str, int]]],
+                        devices: Optional['asyncio.Queue[SSDPDatagram]'] = None) -> 'asyncio.Future[SSDPDatagram]':
+        """
+        Send M-SEARCH datagrams, returning a future for the first matching reply. Every matching reply is also put
+        on the `devices` queue, which defaults to the protocol wide queue. Searches given their own queue do not see
+        each other's replies.
+        """
         fut: 'asyncio.Future[SSDPDatagram]' = self.loop.create_future()
-        for datagram in datagrams:
-            packet = SSDPDatagram("M-SEARCH", datagram)
-            assert packet.st is not None
-            self._send_m_search(address, packet, fut)
+        self._batches_sent += 1
+        for m_search_args in datagrams:
+            st, datagram = encode_m_search(m_search_args)
+            self._send_m_search(
+                address, st, datagram, fut, devices if devices is not None else self.devices, m_search_args
+            )
         return fut
 
+    def send_staged_m_searches(self, address: str,
+                               stages: List[List[Dict[str, typing.Union[str, int]]]], timeout: float,
+                               devices: Optional['asyncio.Queue[SSDPDatagram]'] = None) -> 'asyncio.Future[None]':
+        """
+        Send the M-SEARCH stages in order, escalating to the next stage only while the likely targets of the first
+        stage have gone unanswered. The search stops when the returned future is cancelled or the protocol is
+        disconnected.
+        """
+        staged: 'asyncio.Future[None]' = self.loop.create_task(
+            self._send_staged_m_searches(address, stages, timeout, devices)
+        )
+        self._staged_searches.add(staged)
+        staged.add_done_callback(self._staged_searches.discard)
+        return staged
+
+    async def _send_staged_m_searches(self, address: str,
+                                      stages: List[List[Dict[str, typing.Union[str, int]]]], timeout: float,
+                                      devices: Optional['asyncio.Queue[SSDPDatagram]'] = None) -> None:
+        deadline = self.loop.time() + timeout
+        interval = STAGE_INTERVAL
+        likely_replied: Optional['asyncio.Future[SSDPDatagram]'] = None
+        for i, stage in enumerate(stages):
+            sent_at = self.loop.time()
+            stage_fut = self.send_m_searches(address, stage, devices)
+            likely_replied = likely_replied or stage_fut
+            if i == len(stages) - 1:
+                break
+            # leave time in the search for the stages still to be sent
+            wait = max(0.0, min(interval, (deadline - sent_at) / (len(stages) - i)))
+            await asyncio.wait([stage_fut], timeout=wait, loop=self.loop)
+            if stage_fut.done() and not stage_fut.cancelled():
+                # something answered, pace the next stage by how quickly it did
+                interval = min(interval, max(MIN_STAGE_INTERVAL, 2 * (self.loop.time() - sent_at)))
+                await asyncio.sleep(max(0.0, sent_at + interval - self.loop.time()), loop=self.loop)
+            else:
+                interval *= 2
+            if likely_replied.done() and not likely_replied.cancelled():
+                log.debug("likely gateway replied to %s, holding off on further M-SEARCHes", address)
+                await asyncio.sleep(min(LIKELY_REPLY_GRACE, max(0.0, deadline - self.loop.time())), loop=self.loop)
+            log.debug("escalating M-SEARCH for %s to stage %i", address, i + 2)
+        return None
+
     async def m_search(self, address: str, timeout: float,
                        datagrams: List[Dict[str, typing.Union[str, int]]]) -> SSDPDatagram:
         fut = self.send_m_searches(address, datagrams)
@@ -166,13 +264,13 @@ async def m_search(lan_address: str, gateway_address: str, datagram_args: Dict[s
 
 
 async def multi_m_search(lan_address: str, gateway_address: str, timeout: int = 3,
-                         loop: Optional[asyncio.AbstractEventLoop] = None) -> SSDPProtocol:
+                         loop: Optional[asyncio.AbstractEventLoop] = None,
+                         preferred_m_search_args: Optional[List[Dict[str, typing.Union[str, int]]]] = None
+                         ) -> SSDPProtocol:
     loop = loop or asyncio.get_event_loop()
     protocol, gateway_address, lan_address = await listen_ssdp(
         lan_address, gateway_address, loop
     )
-    fut = protocol.send_m_searches(
-        address=gateway_address, datagrams=list(packet_generator())
-    )
-    loop.call_later(timeout, lambda: None if not fut or fut.done() else fut.cancel())
+    staged = protocol.send_staged_m_searches(gateway_address, packet_stages(preferred_m_search_args), timeout)
+    loop.call_later(timeout, lambda: None if staged.done() else staged.cancel())
     return protocol
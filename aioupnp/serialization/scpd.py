@@ -1,23 +1,17 @@
 import re
-from typing import Dict, Any, List, Tuple
+import hashlib
+from typing import Dict, Any, List, Tuple, Optional
 from aioupnp.fault import UPnPError
-from aioupnp.constants import XML_VERSION_PREFIX
-from aioupnp.serialization.xml import xml_to_dict
+from aioupnp.constants import XML_VERSION_PREFIX, DEVICE, SERVICE, UPNP_NAMESPACES
+from aioupnp.serialization.xml import xml_to_local_dict, XMLStreamParser
+from aioupnp.cache import ParseCache, PARSE_CACHE
 from aioupnp.util import flatten_keys
 
 
-CONTENT_PATTERN = re.compile(
-    "(\<\?xml version=\"1\.0\"[^>]*\?\>(\s*.)*|\>)"
-)
-
 XML_ROOT_SANITY_PATTERN = re.compile(
     "(?i)(\{|(urn:schemas-[\w|\d]*-(com|org|net))[:|-](device|service)[:|-]([\w|\d|\:|\-|\_]*)|\}([\w|\d|\:|\-|\_]*))"
 )
 
-XML_OTHER_KEYS = re.compile(
-    "{[\w|\:\/\.]*}|(\w*)"
-)
-
 
 def serialize_scpd_get(path: str, address: str) -> bytes:
     if "http://" in address:
@@ -37,22 +31,116 @@ def serialize_scpd_get(path: str, address: str) -> bytes:
     ).encode()
 
 
-def deserialize_scpd_get_response(content: bytes) -> Dict[str, Any]:
+def find_xml_content(content: bytes) -> bytes:
+    """
+    Locate the xml document in a response body: from the xml declaration to the end of the body, less any
+    trailing newlines. If a '>' comes before the declaration, or the declaration is not closed by the first '>'
+    after it, only that '>' is returned.
+
+    Only prefix and suffix searches are used, so this is linear in the size of the body even when it is malformed.
+    """
+    start = content.find(XML_VERSION_PREFIX.encode())
+    first_gt = content.find(b'>')
+    if first_gt < 0:
+        return b''
+    if start < 0 or first_gt < start or content[first_gt - 1:first_gt] != b'?':
+        return b'>'
+    return content[start:].rstrip(b'\n')
+
+
+def deserialize_scpd_get_response(content: bytes, cache: ParseCache = PARSE_CACHE) -> Dict[str, Any]:
     if XML_VERSION_PREFIX.encode() in content:
-        parsed: List[Tuple[str, str]] = CONTENT_PATTERN.findall(content.decode())
-        xml_dict = xml_to_dict('' if not parsed else parsed[0][0])
+        xml_dict = cache.get(content)
+        if xml_dict is None:
+            xml_dict = xml_to_local_dict(find_xml_content(content).decode(), UPNP_NAMESPACES)
+            cache.set(content, xml_dict)
         return parse_device_dict(xml_dict)
     return {}
 
 
+class DescriptorStreamParser(XMLStreamParser):
+    """
+    Parse a descriptor body as it arrives, unless it starts like a document in the parse cache. Those are only hashed
+    as they arrive and looked up by their hash when complete, and are parsed from the body given to close if they
+    turn out not to be cached after all. Apart from its first prefix_size bytes the body is not kept.
+    """
+
+    def __init__(self, cache: ParseCache = PARSE_CACHE) -> None:
+        super().__init__(UPNP_NAMESPACES)
+        self._cache = cache
+        self._hash = hashlib.sha256()
+        self._head = b''
+        self._streaming: Optional[bool] = None  # undecided until the first prefix_size bytes have arrived
+
+    def _decide(self) -> None:
+        self._streaming = not self._cache.may_contain(self._head)
+        head, self._head = self._head, self._head[:self._cache.prefix_size]
+        if self._streaming:
+            super().feed(head)
+        return None
+
+    def feed(self, data: bytes) -> None:
+        self._hash.update(data)
+        if self._streaming:
+            super().feed(data)
+        elif self._streaming is None:
+            self._head += data
+            if len(self._head) >= self._cache.prefix_size:
+                self._decide()
+        return None
+
+    @property
+    def held_back(self) -> bool:
+        """
+        Whether the body was held back for a cache lookup, and has to be given to close in case it misses
+        """
+        return not self._streaming
+
+    def close(self, document: Optional[bytes] = None) -> Optional[Dict[str, Any]]:
+        """
+        Finish parsing and return the parsed document, or None if no xml document was found
+
+        :param document: the complete body, parsed if the body was held back for a cache lookup that missed
+        """
+        if self._streaming is None:  # the body is shorter than prefix_size
+            self._decide()
+        key = self._hash.digest()
+        xml_dict = self._cache.get_by_key(key)
+        if xml_dict is None:
+            if not self._streaming and document is not None:
+                super().feed(document)
+            xml_dict = super().close()
+            if xml_dict is not None:
+                self._cache.set_by_key(key, self._head, xml_dict)
+        return xml_dict
+
+
+def deserialize_scpd_get_dict(xml_dict: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Like deserialize_scpd_get_response, for a body already parsed by a XMLStreamParser
+    """
+    if xml_dict is None:
+        return {}
+    return parse_device_dict(xml_dict)
+
+
 def parse_device_dict(xml_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get the root element of a device or service descriptor parsed with the upnp namespaces stripped, falling back
+    to stripping other device and service schemas (such as urn:schemas-microsoft-com:service-1-0) here
+    """
     keys = list(xml_dict.keys())
     found = False
     for k in keys:
+        namespace, _, root = k[1:].partition('}')
+        if k.startswith('{') and namespace in (DEVICE, SERVICE):
+            xml_dict = xml_dict[k]
+            found = True
+            break
         m: List[Tuple[str, str, str, str, str, str]] = XML_ROOT_SANITY_PATTERN.findall(k)
         if len(m) == 3 and m[1][0] and m[2][5]:
             schema_key: str = m[1][0]
-            root: str = m[2][5]
+            root = m[2][5]
             flattened = flatten_keys(xml_dict, "{%s}" % schema_key)
             if root not in flattened:
                 raise UPnPError("root device not found")
@@ -64,15 +152,8 @@ def parse_device_dict(xml_dict: Dict[str, Any]) -> Dict[str, Any]:
     result = {}
     for k, v in xml_dict.items():
         if isinstance(xml_dict[k], dict):
-            inner_d = {}
-            for inner_k, inner_v in xml_dict[k].items():
-                parsed_k = XML_OTHER_KEYS.findall(inner_k)
-                if len(parsed_k) == 2:
-                    inner_d[parsed_k[0]] = inner_v
-                else:
-                    assert len(parsed_k) == 3, f"expected len=3, got {len(parsed_k)}"
-                    inner_d[parsed_k[1]] = inner_v
-            result[k] = inner_d
+            # keys in namespaces other than the root's
+            result[k] = {inner_k.rpartition('}')[2]: inner_v for inner_k, inner_v in xml_dict[k].items()}
         else:
             result[k] = v
     return result
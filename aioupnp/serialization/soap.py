@@ -1,63 +1,108 @@
 import re
 import typing
 import json
-from aioupnp.util import flatten_keys
+from xml.sax.saxutils import escape
 from aioupnp.fault import UPnPError
-from aioupnp.constants import XML_VERSION, ENVELOPE, BODY, FAULT, CONTROL
-from aioupnp.serialization.xml import xml_to_dict
+from aioupnp.constants import XML_VERSION, ENVELOPE, BODY, FAULT, SOAP_ENVELOPE, UPNP_NAMESPACES
+from aioupnp.serialization.xml import xml_to_local_dict, make_xml_parser
 
-CONTENT_NO_XML_VERSION_PATTERN = re.compile(
-    b"(\<([^:>]*)\:Envelope xmlns\:[^:>]*=\"http\:\/\/schemas\.xmlsoap\.org\/soap\/envelope\/\"(\s*.)*\>)"
+BODY_TAG = "{%s}%s" % (SOAP_ENVELOPE, BODY)
+FAULT_TAG = "{%s}%s" % (SOAP_ENVELOPE, FAULT)
+# the start tag of the envelope, the prefixes are bounded so that searching for it is linear in the response size
+ENVELOPE_START_PATTERN = re.compile(
+    b'<[^:<>\\s]{0,64}:Envelope xmlns:[^:<>\\s]{0,64}="http://schemas\\.xmlsoap\\.org/soap/envelope/"'
 )
 
 
+def find_envelope(response: bytes) -> bytes:
+    """
+    Locate the soap envelope in a response: from the first `<prefix:Envelope xmlns:prefix="<soap envelope ns>"`
+    to the last '>'. Whether it is well formed is left to the xml parser.
+    """
+    match = ENVELOPE_START_PATTERN.search(response)
+    if match is None:
+        return b''
+    end = response.rfind(b'>')
+    if end < match.end():
+        return b''
+    return response[match.start():end + 1]
+
+
+class SOAPRequestTemplate:
+    """
+    The encoded fragments of the soap requests for an action of a service, so that a request only needs its escaped
+    argument values and Content-Length filled in
+    """
+
+    def __init__(self, method: str, param_names: typing.List[str], service_id: bytes, gateway_address: bytes,
+                 control_url: bytes) -> None:
+        if b"http://" in gateway_address:
+            host = gateway_address.split(b"http://")[1]
+        else:
+            host = gateway_address
+        self._head = (
+            b'POST ' + control_url + b' HTTP/1.1\r\n'  # could be just / even if it shouldn't be
+            b'Host: ' + host + b'\r\n'
+            b'User-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\n'
+            b'Content-Length: '
+        )
+        headers = (
+            b'\r\nContent-Type: text/xml\r\n'
+            b'SOAPAction: "' + service_id + b'#' + method.encode() + b'"\r\n'
+        )
+        cache_headers = b'Cache-Control: no-cache\r\nPragma: no-cache\r\n'
+        self._headers = headers + b'Connection: Close\r\n' + cache_headers
+        self._keep_alive_headers = headers + b'Connection: keep-alive\r\n' + cache_headers
+        self._body_head = (
+            f'\r\n{XML_VERSION}\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+            f's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+            f'<u:{method} xmlns:u="'
+        ).encode() + service_id + b'">'
+        self._body_tail = f'</u:{method}></s:Body></s:Envelope>'.encode()
+        self._params = [
+            (param_name, f'<{param_name}>'.encode(), f'</{param_name}>'.encode()) for param_name in param_names
+        ]
+
+    def serialize(self, keep_alive: bool = False, **kwargs: typing.Any) -> bytes:
+        body = [self._body_head]
+        for param_name, open_tag, close_tag in self._params:
+            body.extend((open_tag, escape(f"{kwargs.get(param_name, '')}").encode(), close_tag))
+        body.append(self._body_tail)
+        soap_body = b''.join(body)
+        return b''.join((
+            self._head, str(len(soap_body)).encode(), self._keep_alive_headers if keep_alive else self._headers,
+            soap_body, b'\r\n'
+        ))
+
+
 def serialize_soap_post(method: str, param_names: typing.List[str], service_id: bytes, gateway_address: bytes,
-                        control_url: bytes, **kwargs: typing.Dict[str, str]) -> bytes:
-    args = "".join(f"<{param_name}>{kwargs.get(param_name, '')}</{param_name}>" for param_name in param_names)
-    soap_body = (f'\r\n{XML_VERSION}\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
-                 f's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
-                 f'<u:{method} xmlns:u="{service_id.decode()}">{args}</u:{method}></s:Body></s:Envelope>')
-    if "http://" in gateway_address.decode():
-        host = gateway_address.decode().split("http://")[1]
-    else:
-        host = gateway_address.decode()
-    return (
-        f'POST {control_url.decode()} HTTP/1.1\r\n'  # could be just / even if it shouldn't be
-        f'Host: {host}\r\n'
-        f'User-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\n'
-        f'Content-Length: {len(soap_body)}\r\n'
-        f'Content-Type: text/xml\r\n'
-        f'SOAPAction: \"{service_id.decode()}#{method}\"\r\n'
-        f'Connection: Close\r\n'
-        f'Cache-Control: no-cache\r\n'
-        f'Pragma: no-cache\r\n'
-        f'{soap_body}'
-        f'\r\n'
-    ).encode()
+                        control_url: bytes, keep_alive: bool = False, **kwargs: typing.Dict[str, str]) -> bytes:
+    return SOAPRequestTemplate(method, param_names, service_id, gateway_address, control_url).serialize(
+        keep_alive, **kwargs
+    )
 
 
 def deserialize_soap_post_response(response: bytes, method: str,
                                    service_id: str) -> typing.Dict[str, typing.Dict[str, str]]:
-    parsed: typing.List[typing.List[bytes]] = CONTENT_NO_XML_VERSION_PATTERN.findall(response)
-    content = b'' if not parsed else parsed[0][0]
-    content_dict = xml_to_dict(content.decode())
+    content = find_envelope(response)
+    content_dict = xml_to_local_dict(content.decode(), UPNP_NAMESPACES + (service_id,))
     envelope = content_dict[ENVELOPE]
     if not isinstance(envelope[BODY], dict):
         # raise UPnPError('blank response')
         return {}  # TODO: raise
-    response_body: typing.Dict[str, typing.Dict[str, typing.Dict[str, str]]] = flatten_keys(
-        envelope[BODY], f"{'{' + service_id + '}'}"
-    )
+    response_body: typing.Dict[str, typing.Any] = envelope[BODY]
     if not response_body:
         # raise UPnPError('blank response')
         return {}  # TODO: raise
     if FAULT in response_body:
-        fault: typing.Dict[str, typing.Dict[str, typing.Dict[str, str]]] = flatten_keys(
-            response_body[FAULT], "{%s}" % CONTROL
-        )
+        fault: typing.Dict[str, typing.Dict[str, typing.Dict[str, str]]] = response_body[FAULT]
         try:
-            raise UPnPError(fault['detail']['UPnPError']['errorDescription'])
-        except (KeyError, TypeError, ValueError):
+            error = fault['detail']['UPnPError']
+            error_code = error.get('errorCode')
+            raise UPnPError(
+                error['errorDescription'], error_code=int(error_code) if error_code is not None else None
+            )
+        except (KeyError, TypeError, ValueError, AttributeError):
             raise UPnPError(f"Failed to decode error response: {json.dumps(fault)}")
     response_key = None
     for key in response_body:
@@ -67,3 +112,160 @@ def deserialize_soap_post_response(response: bytes, method: str,
     if not response_key:
         raise UPnPError(f"unknown response fields for {method}: {response_body}")
     return response_body[response_key]
+
+
+class _ResponseFieldsTarget:
+    """
+    XMLParser target collecting the text of the output arguments of a soap response, by field index
+    """
+
+    def __init__(self, method: str, fields: typing.Dict[str, int], field_count: int) -> None:
+        self.method = method
+        self.fields = fields
+        self.values: typing.List[typing.Optional[str]] = [None] * field_count
+        self.decodable = True
+        self._depth = 0
+        self._bodies = 0
+        self._responses = 0
+        self._in_body = False
+        self._in_response = False
+        self._field: typing.Optional[int] = None
+        self._text: typing.List[str] = []
+        self._seen: typing.Set[int] = set()
+
+    def start(self, tag: str, attrib: typing.Dict[str, str]) -> None:
+        self._depth += 1
+        if self._depth == 1:
+            if tag != ENVELOPE:
+                self.decodable = False
+        elif self._depth == 2:
+            self._in_body = tag == BODY_TAG
+            self._bodies += self._in_body
+        elif self._depth == 3 and self._in_body:
+            if tag == FAULT_TAG:
+                self.decodable = False
+            else:
+                self._in_response = self.method in tag
+                self._responses += self._in_response
+        elif self._depth == 4 and self._in_body and self._in_response:
+            name = tag.rpartition('}')[2]
+            field = self.fields.get(name)
+            if field is None:
+                field = self.fields.get(name.lower())
+            if field is not None:
+                if field in self._seen:
+                    self.decodable = False
+                self._seen.add(field)
+                self._field = field
+                self._text = []
+        elif self._field is not None:
+            # the value of an argument is never a tree
+            self.decodable = False
+        return None
+
+    def data(self, data: str) -> None:
+        if self._depth == 4 and self._field is not None:
+            self._text.append(data)
+        return None
+
+    def end(self, tag: str) -> None:
+        if self._depth == 4 and self._field is not None:
+            text = "".join(self._text)
+            self.values[self._field] = text.strip() if text else None
+            self._field = None
+        self._depth -= 1
+        return None
+
+    def close(self) -> typing.Optional[typing.List[typing.Optional[str]]]:
+        if not self.decodable or self._bodies != 1 or self._responses != 1:
+            return None
+        if len(self.values) == 1 and self.values[0] is None:
+            # a lone output argument is required, and may not be wrapped in an element at all
+            return None
+        return self.values
+
+
+def decode_soap_post_response_fields(response: bytes, method: str, fields: typing.Dict[str, int]
+                                     ) -> typing.Optional[typing.List[typing.Optional[str]]]:
+    """
+    Decode the output arguments of a successful soap response straight into a list, placing the text of each
+    argument at the index given for its name in fields (checked as is, then lower cased).
+
+    Returns None for anything else, such as faults, blank or malformed responses, for which
+    deserialize_soap_post_response should be used to get the error.
+    """
+    content = find_envelope(response)
+    if not content:
+        return None
+    target = _ResponseFieldsTarget(method, fields, max(fields.values()) + 1 if fields else 0)
+    parser = make_xml_parser(target)
+    try:
+        parser.feed(content)
+        result: typing.Optional[typing.List[typing.Optional[str]]] = parser.close()
+    except Exception:
+        return None
+    return result
+
+
+class _PortMappingListTarget:
+    """
+    XMLParser target collecting the fields of each PortMappingEntry of a PortMappingList document, by field index
+    """
+
+    def __init__(self, fields: typing.Dict[str, int], field_count: int) -> None:
+        self.fields = fields
+        self.field_count = field_count
+        self.entries: typing.List[typing.List[typing.Optional[str]]] = []
+        self._depth = 0
+        self._entry: typing.Optional[typing.List[typing.Optional[str]]] = None
+        self._field: typing.Optional[int] = None
+        self._text: typing.List[str] = []
+        self._field_indexes: typing.Dict[str, typing.Optional[int]] = {}  # tag -> field index memo
+
+    def start(self, tag: str, attrib: typing.Dict[str, str]) -> None:
+        self._depth += 1
+        if self._depth == 2:
+            if tag.rpartition('}')[2] == 'PortMappingEntry':
+                self._entry = [None] * self.field_count
+        elif self._depth == 3 and self._entry is not None:
+            if tag not in self._field_indexes:
+                self._field_indexes[tag] = self.fields.get(tag.rpartition('}')[2])
+            self._field = self._field_indexes[tag]
+            self._text = []
+        return None
+
+    def data(self, data: str) -> None:
+        if self._field is not None:
+            self._text.append(data)
+        return None
+
+    def end(self, tag: str) -> None:
+        if self._depth == 3 and self._entry is not None and self._field is not None:
+            self._entry[self._field] = "".join(self._text).strip() or None
+            self._field = None
+        elif self._depth == 2 and self._entry is not None:
+            self.entries.append(self._entry)
+            self._entry = None
+        self._depth -= 1
+        return None
+
+    def close(self) -> typing.List[typing.List[typing.Optional[str]]]:
+        return self.entries
+
+
+def decode_port_mapping_list(listing: str,
+                             fields: typing.Dict[str, int]) -> typing.List[typing.List[typing.Optional[str]]]:
+    """
+    Decode the PortMappingList document returned by the IGDv2 GetListOfPortMappings action (in its NewPortListing
+    argument) into a list for each PortMappingEntry, placing the text of each field at the index given for its name
+    in fields. The entries are collected as the document is parsed, without building a tree.
+
+    Raises ValueError (or the parser's error) for malformed documents.
+    """
+    if not listing.strip():
+        return []
+    target = _PortMappingListTarget(fields, max(fields.values()) + 1 if fields else 0)
+    parser = make_xml_parser(target)
+    parser.feed(listing.strip().encode())
+    entries: typing.List[typing.List[typing.Optional[str]]] = parser.close()
+    return entries
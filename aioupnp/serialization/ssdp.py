@@ -1,45 +1,39 @@
-import re
 import logging
 import binascii
 import json
 from collections import OrderedDict
-from typing import List, Optional, Dict, Union, Callable
+from typing import List, Optional, Dict, Union, Set
 from aioupnp.fault import UPnPError
 from aioupnp.constants import line_separator
 
 log = logging.getLogger(__name__)
 
-_template = "(?i)^(%s):[ ]*(.*)$"
-
-
-def compile_find(pattern: str) -> Callable[[str], Optional[str]]:
-    p = re.compile(pattern)
-
-    def find(line: str) -> Optional[str]:
-        result: List[List[str]] = []
-        for outer in p.findall(line):
-            result.append([])
-            for inner in outer:
-                result[-1].append(inner)
-        if result:
-            return result[-1][-1].lstrip(" ").rstrip(" ")
-        return None
+# normalized header name -> SSDPDatagram field
+ssdp_datagram_fields: Dict[str, str] = {
+    'host': 'host',
+    'st': 'st',
+    'man': 'man',
+    'mx': 'mx',
+    'nt': 'nt',
+    'nts': 'nts',
+    'usn': 'usn',
+    'location': 'location',
+    'cache-control': 'cache_control',
+    'cache_control': 'cache_control',
+    'cache|control': 'cache_control',
+    'server': 'server',
+}
 
-    return find
+# non-ascii characters a case insensitive match treats as equal to an ascii letter
+_case_folds = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's', '\u212a': 'k'})
 
 
-ssdp_datagram_patterns: Dict[str, Callable[[str], Optional[str]]] = {
-    'host': compile_find("(?i)^(host):(.*)$"),
-    'st': compile_find(_template % 'st'),
-    'man': compile_find(_template % 'man'),
-    'mx': compile_find(_template % 'mx'),
-    'nt': compile_find(_template % 'nt'),
-    'nts': compile_find(_template % 'nts'),
-    'usn': compile_find(_template % 'usn'),
-    'location': compile_find(_template % 'location'),
-    'cache_control': compile_find(_template % 'cache[-|_]control'),
-    'server': compile_find(_template % 'server'),
-}
+def _normalize_header_name(name: str) -> str:
+    try:
+        name.encode('ascii')
+    except UnicodeEncodeError:
+        return name.translate(_case_folds).lower()
+    return name.lower()
 
 
 class SSDPDatagram:
@@ -163,29 +157,30 @@ class SSDPDatagram:
 
     @classmethod
     def _lines_to_content_dict(cls, lines: List[str]) -> Dict[str, Union[str, int]]:
+        """
+        Parse header lines, keeping the casing of the header names. Only the first occurrence of a header is kept,
+        unknown headers are dropped.
+        """
         result: Dict[str, Union[str, int]] = OrderedDict()
-        matched_keys: List[str] = []
+        matched_fields: Set[str] = set()
         for line in lines:
-            if not line:
+            name, sep, value = line.partition(":")
+            if not sep:
+                continue
+            field = ssdp_datagram_fields.get(_normalize_header_name(name))
+            if field is None or field in matched_fields:
                 continue
-            matched = False
-            for name, pattern in ssdp_datagram_patterns.items():
-                if name not in matched_keys:
-                    if name.lower() == 'mx':
-                        _matched_int = pattern(line)
-                        if _matched_int is not None:
-                            match_int = int(_matched_int)
-                            result[line[:len(name)]] = match_int
-                            matched = True
-                            matched_keys.append(name)
-                            break
-                    else:
-                        match = pattern(line)
-                        if match is not None:
-                            result[line[:len(name)]] = match
-                            matched = True
-                            matched_keys.append(name)
-                            break
+            if "\n" in value:
+                # a header value is a single line, a trailing newline is tolerated
+                if value.index("\n") != len(value) - 1:
+                    continue
+                value = value[:-1]
+            value = value.strip(" ")
+            matched_fields.add(field)
+            if field == 'mx':
+                result[name] = int(value)
+            else:
+                result[name] = value
         return result
 
     @classmethod
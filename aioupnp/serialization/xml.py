@@ -1,10 +1,78 @@
 import typing
 from collections import OrderedDict
-from defusedxml import ElementTree
+from defusedxml import ElementTree, DTDForbidden
+from aioupnp.constants import XML_VERSION_PREFIX
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # pragma: no cover
+    lxml_etree = None  # type: ignore
 
 str_any_dict = typing.Dict[str, typing.Any]
 
 
+# a parser with feed(data) and close() methods, returning what its target's close() returns
+XMLParser = typing.Any
+
+
+class _LxmlTarget:
+    """
+    Forwards the events of a lxml parser to a target, refusing documents with a DTD. Entity declarations can only
+    be made in a DTD, so this covers what defusedxml forbids and more; upnp documents never have one.
+    """
+
+    def __init__(self, target: typing.Any) -> None:
+        self.start = target.start
+        self.data = target.data
+        self.end = target.end
+        self.close = target.close
+
+    def doctype(self, name: typing.Optional[str], pubid: typing.Optional[str], system: typing.Optional[str]) -> None:
+        raise DTDForbidden(name, system, pubid)
+
+
+def _defusedxml_parser(target: typing.Any) -> XMLParser:
+    parser: XMLParser = ElementTree.DefusedXMLParser(target=target)
+    return parser
+
+
+def _lxml_parser(target: typing.Any) -> XMLParser:
+    parser: XMLParser = lxml_etree.XMLParser(
+        target=_LxmlTarget(target), resolve_entities=False, no_network=True, load_dtd=False, huge_tree=False
+    )
+    return parser
+
+
+XML_BACKENDS: typing.Dict[str, typing.Callable[[typing.Any], XMLParser]] = {'defusedxml': _defusedxml_parser}
+if lxml_etree is not None:
+    XML_BACKENDS['lxml'] = _lxml_parser
+# lxml calls back into python for every parser event, which leaves it no faster than defusedxml on upnp documents
+_xml_backend = 'defusedxml'
+
+
+def get_xml_backend() -> str:
+    return _xml_backend
+
+
+def set_xml_backend(name: str) -> None:
+    """
+    Choose the parser used by xml_to_local_dict, XMLStreamParser and the soap response decoder: 'defusedxml' (the
+    default) or 'lxml' when it is installed
+    """
+    global _xml_backend
+    if name not in XML_BACKENDS:
+        raise ValueError(f"unavailable xml backend: {name}")
+    _xml_backend = name
+    return None
+
+
+def make_xml_parser(target: typing.Any) -> XMLParser:
+    """
+    Create a hardened parser with the current backend, feeding its events to the given parser target
+    """
+    return XML_BACKENDS[_xml_backend](target)
+
+
 def parse_xml(xml_str: str) -> ElementTree:
     element: ElementTree = ElementTree.fromstring(xml_str)
     return element
@@ -79,3 +147,120 @@ def _recursive_element_to_dict(element_tree: ElementTree) -> typing.Dict[str, ty
 
 def xml_to_dict(xml_str: str) -> typing.Dict[str, typing.Any]:
     return _recursive_element_to_dict(parse_xml(xml_str))
+
+
+class _DictBuilder:
+    """
+    XMLParser target building the same nested dicts as xml_to_dict, without building an element tree first.
+
+    Tags of elements below the document element that are in one of the given namespaces are stored by their local
+    name. The document element keeps its qualified name so that callers can still tell what kind of document it is.
+    """
+
+    def __init__(self, namespaces: typing.Collection[str] = ()) -> None:
+        self._namespaces = frozenset(namespaces)
+        self._local_names: typing.Dict[str, str] = {}
+        # [tag, children by tag (None until the first child), text before the first child] for each open element
+        self._stack: typing.List[typing.List[typing.Any]] = []
+        self._result: typing.Dict[str, typing.Any] = OrderedDict()
+
+    def _local_name(self, tag: str) -> str:
+        local_name = tag
+        if tag.startswith('{'):
+            namespace, _, name = tag[1:].partition('}')
+            if namespace in self._namespaces:
+                local_name = name
+        self._local_names[tag] = local_name
+        return local_name
+
+    def start(self, tag: str, attrib: typing.Dict[str, str]) -> None:
+        stack = self._stack
+        if stack:
+            parent = stack[-1]
+            if parent[1] is None:
+                parent[1] = OrderedDict()
+            tag = self._local_names.get(tag) or self._local_name(tag)
+        stack.append([tag, None, []])
+        return None
+
+    def data(self, data: str) -> None:
+        if self._stack and self._stack[-1][1] is None:
+            self._stack[-1][2].append(data)
+        return None
+
+    def end(self, tag: str) -> None:
+        tag, children, text = self._stack.pop()
+        value: typing.Any
+        if children is not None:
+            value = OrderedDict()
+            for k, v in children.items():
+                value[k] = v[0] if len(v) == 1 else v
+        else:
+            value = "".join(text)
+            if value:
+                value = value.strip()
+            else:
+                value = None
+        if self._stack:
+            if value is not None:
+                self._stack[-1][1].setdefault(tag, []).append(value)
+        elif value is not None:
+            self._result = OrderedDict([(tag, value)])
+        return None
+
+    def close(self) -> typing.Dict[str, typing.Any]:
+        return self._result
+
+
+def xml_to_local_dict(xml_str: str, namespaces: typing.Collection[str]) -> typing.Dict[str, typing.Any]:
+    """
+    Parse a XML document into the nested dicts xml_to_dict would return in a single pass, with the given namespaces
+    stripped from the tags of every element below the document element
+    """
+    parser = make_xml_parser(_DictBuilder(namespaces))
+    parser.feed(xml_str)
+    result: typing.Dict[str, typing.Any] = parser.close()
+    return result
+
+
+class XMLStreamParser:
+    """
+    Incrementally parse a XML document into the nested dicts xml_to_local_dict would return, as its bytes arrive.
+    Anything before the xml declaration is skipped.
+    """
+
+    def __init__(self, namespaces: typing.Collection[str] = ()) -> None:
+        self._parser = make_xml_parser(_DictBuilder(namespaces))
+        self._prefix = XML_VERSION_PREFIX.encode()
+        self._pending = b''
+        self._started = False
+        self._error: typing.Optional[Exception] = None
+
+    def feed(self, data: bytes) -> None:
+        if self._error is not None:
+            return None
+        if not self._started:
+            self._pending += data
+            idx = self._pending.find(self._prefix)
+            if idx < 0:
+                # keep enough to match a prefix split between chunks
+                self._pending = self._pending[-(len(self._prefix) - 1):]
+                return None
+            self._started = True
+            data, self._pending = self._pending[idx:], b''
+        try:
+            self._parser.feed(data)
+        except Exception as err:
+            self._error = err
+        return None
+
+    def close(self) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        """
+        Finish parsing and return the parsed document, or None if no xml document was found
+        """
+        if not self._started:
+            return None
+        if self._error is not None:
+            raise self._error
+        result: typing.Dict[str, typing.Any] = self._parser.close()
+        return result
@@ -1,23 +1,34 @@
 import zlib
+import functools
+import itertools
 import base64
 import logging
 import json
 import asyncio
-from typing import Tuple, Dict, List, Union, Optional, Any
+from typing import Tuple, Dict, List, Union, Optional, Any, Callable, Awaitable
 from aioupnp.fault import UPnPError
 from aioupnp.gateway import Gateway
+from aioupnp.cache import DiscoveryCache
+from aioupnp.mappings import PortMappingTable, PortMappingSpec, FetchWindow, walk_mapping_table, port_probe_sequence
+from aioupnp.mappings import EMPTY_RANGE_ERRORS, CONFLICT_ERROR_CODES
 from aioupnp.interfaces import get_gateway_and_lan_addresses
 from aioupnp.commands import GetGenericPortMappingEntryResponse, GetSpecificPortMappingEntryResponse
 
 
 log = logging.getLogger(__name__)
 
+# how many entries to ask for per GetListOfPortMappings request
+PORT_MAPPING_LIST_PAGE_SIZE = 1000
+
 
 class UPnP:
-    def __init__(self, lan_address: str, gateway_address: str, gateway: Gateway) -> None:
+    def __init__(self, lan_address: str, gateway_address: str, gateway: Gateway,
+                 port_mapping_ttl: float = 60.0) -> None:
         self.lan_address = lan_address
         self.gateway_address = gateway_address
         self.gateway = gateway
+        self.port_mappings = PortMappingTable(port_mapping_ttl)
+        self.mapping_fetch_window = FetchWindow()
 
     @classmethod
     def get_annotations(cls, command: str) -> Tuple[Dict[str, Any], Optional[str]]:
@@ -37,6 +48,8 @@ class UPnP:
             return cls.delete_port_mapping.__annotations__, cls.delete_port_mapping.__doc__
         if command == "get_next_mapping":
             return cls.get_next_mapping.__annotations__, cls.get_next_mapping.__doc__
+        if command == "allocate_port_mapping":
+            return cls.allocate_port_mapping.__annotations__, cls.allocate_port_mapping.__doc__
         raise AttributeError(command)  # pragma: no cover
 
     @staticmethod
@@ -51,12 +64,37 @@ class UPnP:
     @classmethod
     async def discover(cls, lan_address: str = '', gateway_address: str = '', timeout: int = 3,
                        igd_args: Optional[Dict[str, Union[str, int]]] = None, interface_name: str = 'default',
-                       loop: Optional[asyncio.AbstractEventLoop] = None) -> 'UPnP':
+                       loop: Optional[asyncio.AbstractEventLoop] = None, soap_pool_size: int = 4,
+                       soap_idle_timeout: float = 5.0, max_concurrent_probes: int = 4,
+                       cache_path: Optional[str] = None, port_mapping_ttl: float = 60.0) -> 'UPnP':
         lan_address, gateway_address = cls.get_lan_and_gateway(lan_address, gateway_address, interface_name)
+        cache = DiscoveryCache(cache_path) if cache_path else None
+        if cache and not igd_args:
+            entry = cache.get(interface_name, lan_address, gateway_address)
+            if entry:
+                try:
+                    gateway = await Gateway.from_cache_entry(
+                        entry, lan_address, gateway_address, loop, soap_pool_size, soap_idle_timeout
+                    )
+                    log.debug("using cached gateway %s", gateway.manufacturer_string)
+                    return cls(lan_address, gateway_address, gateway, port_mapping_ttl)
+                except (UPnPError, OSError, asyncio.TimeoutError) as err:
+                    log.debug("cached gateway is no longer valid (%s), discovering it again", str(err))
+                    cache.remove(interface_name, lan_address, gateway_address)
+        preferred_m_search_args: List[Dict[str, Union[str, int]]] = []
+        if cache:
+            for m_search_args in cache.get_m_search_preferences().values():
+                if m_search_args not in preferred_m_search_args:
+                    preferred_m_search_args.append(m_search_args)
         gateway = await Gateway.discover_gateway(
-            lan_address, gateway_address, timeout, igd_args, loop
+            lan_address, gateway_address, timeout, igd_args, loop, soap_pool_size, soap_idle_timeout,
+            max_concurrent_probes, preferred_m_search_args
         )
-        return cls(lan_address, gateway_address, gateway)
+        if cache:
+            cache.set(interface_name, lan_address, gateway_address, gateway.get_cache_entry())
+            if gateway.m_search_args:
+                cache.add_m_search_preference(gateway.fingerprint, gateway.m_search_args)
+        return cls(lan_address, gateway_address, gateway, port_mapping_ttl)
 
     @classmethod
     async def m_search(cls, lan_address: str = '', gateway_address: str = '', timeout: int = 1,
@@ -119,13 +157,58 @@ class UPnP:
         :param lease_time: (int) lease time in seconds
         :return: None
         """
-        await self.gateway.commands.AddPortMapping(
-            NewRemoteHost='', NewExternalPort=external_port, NewProtocol=protocol,
-            NewInternalPort=internal_port, NewInternalClient=lan_address,
-            NewEnabled=1, NewPortMappingDescription=description, NewLeaseDuration=str(lease_time)
-        )
+        try:
+            await self.gateway.commands.AddPortMapping(
+                NewRemoteHost='', NewExternalPort=external_port, NewProtocol=protocol,
+                NewInternalPort=internal_port, NewInternalClient=lan_address,
+                NewEnabled=1, NewPortMappingDescription=description, NewLeaseDuration=str(lease_time)
+            )
+        except UPnPError:
+            self.port_mappings.invalidate()
+            raise
+        self.port_mappings.add(GetGenericPortMappingEntryResponse(
+            '', external_port, protocol, internal_port, lan_address, True, description, lease_time
+        ))
         return None
 
+    async def _run_batch(self, requests: List[Callable[[], Awaitable[None]]]) -> List[Optional[UPnPError]]:
+        async def run(request: Callable[[], Awaitable[None]]) -> Optional[UPnPError]:
+            async with self.gateway.soap_request_limit:
+                try:
+                    await request()
+                except UPnPError as err:
+                    return err
+            return None
+
+        results: List[Optional[UPnPError]] = await asyncio.gather(
+            *(run(request) for request in requests), loop=self.gateway._loop
+        )
+        return results
+
+    async def add_port_mappings(self, mappings: List[PortMappingSpec]) -> List[Optional[UPnPError]]:
+        """
+        Add several port mappings, sending as many requests at once as the gateway's soap connection pool holds
+
+        :param mappings: (list) PortMappingSpec(external_port, protocol, internal_port, lan_address, description,
+                                                lease_time)
+        :return: (list) None for each mapping added, or the UPnPError it failed with, in the order of mappings
+        """
+        return await self._run_batch([
+            functools.partial(self.add_port_mapping, *PortMappingSpec(*mapping)) for mapping in mappings
+        ])
+
+    async def delete_port_mappings(self, mappings: List[Tuple[int, str]]) -> List[Optional[UPnPError]]:
+        """
+        Delete several port mappings, sending as many requests at once as the gateway's soap connection pool holds
+
+        :param mappings: (list) (external_port, protocol) of the mappings to delete
+        :return: (list) None for each mapping deleted, or the UPnPError it failed with, in the order of mappings
+        """
+        return await self._run_batch([
+            functools.partial(self.delete_port_mapping, external_port, protocol)
+            for external_port, protocol in mappings
+        ])
+
     async def get_port_mapping_by_index(self, index: int) -> GetGenericPortMappingEntryResponse:
         """
         Get information about a port mapping by index number
@@ -161,21 +244,59 @@ class UPnP:
             ]
         ]
         """
-        redirects: List[GetGenericPortMappingEntryResponse] = []
-        cnt = 0
-        try:
-            redirect = await self.get_port_mapping_by_index(cnt)
-        except UPnPError:
-            return redirects
-        while redirect is not None:
-            redirects.append(redirect)
-            cnt += 1
+        redirects: Optional[List[GetGenericPortMappingEntryResponse]] = None
+        if self.gateway.commands.is_registered('GetListOfPortMappings'):
             try:
-                redirect = await self.get_port_mapping_by_index(cnt)
-            except UPnPError:
-                break
+                redirects = await self._list_port_mappings()
+            except UPnPError as err:
+                log.debug("failed to list the port mappings (%s), walking the mapping table instead", str(err))
+        if redirects is None:
+            redirects = await walk_mapping_table(
+                self.get_port_mapping_by_index, self.mapping_fetch_window, self.gateway._loop
+            )
+        self.port_mappings.load(redirects)
+        return redirects
+
+    async def _list_port_mappings(self) -> List[GetGenericPortMappingEntryResponse]:
+        """
+        Get the mappings of each protocol with IGDv2 GetListOfPortMappings, a page of PORT_MAPPING_LIST_PAGE_SIZE
+        entries at a time, until a page comes back short or the rest of the range has no mappings
+        """
+        redirects: List[GetGenericPortMappingEntryResponse] = []
+        for protocol in ('TCP', 'UDP'):
+            start_port = 0
+            while start_port <= 65535:
+                try:
+                    page = await self.gateway.commands.GetListOfPortMappings(
+                        NewStartPort=start_port, NewEndPort=65535, NewProtocol=protocol, NewManage=1,
+                        NewNumberOfPorts=PORT_MAPPING_LIST_PAGE_SIZE
+                    )
+                except UPnPError as err:
+                    if str(err) in EMPTY_RANGE_ERRORS:  # there are no mappings in the range
+                        break
+                    raise
+                last_page = len(page) < PORT_MAPPING_LIST_PAGE_SIZE
+                # only count entries in the requested range, so that the start port always moves forward
+                page = [r for r in page if r.external_port is not None and r.external_port >= start_port]
+                if not page:
+                    break
+                redirects.extend(page)
+                if last_page:
+                    break
+                start_port = max(r.external_port for r in page) + 1
         return redirects
 
+    async def get_port_mapping_table(self, refresh: bool = False) -> PortMappingTable:
+        """
+        Get the cached port mapping table, walking the gateway's mappings again if it is stale or refresh is set
+
+        :param refresh: (bool) reload the table even if it is still fresh
+        :return: PortMappingTable
+        """
+        if refresh or not self.port_mappings.is_fresh:
+            await self.get_redirects()
+        return self.port_mappings
+
     async def get_specific_port_mapping(self, external_port: int, protocol: str) -> GetSpecificPortMappingEntryResponse:
         """
         Get information about a port mapping by port number and protocol
@@ -202,10 +323,14 @@ class UPnP:
         :param protocol: (str) TCP | UDP
         :return: None
         """
-        await self.gateway.commands.DeletePortMapping(
-            NewRemoteHost="", NewExternalPort=external_port, NewProtocol=protocol
-        )
-
+        try:
+            await self.gateway.commands.DeletePortMapping(
+                NewRemoteHost="", NewExternalPort=external_port, NewProtocol=protocol
+            )
+        except UPnPError:
+            self.port_mappings.invalidate()
+            raise
+        self.port_mappings.remove(external_port, protocol)
         return None
 
     async def get_next_mapping(self, port: int, protocol: str, description: str,
@@ -225,20 +350,93 @@ class UPnP:
         _internal_port = int(internal_port or port)
         requested_port = int(_internal_port)
         port = int(port)
-        redirect_tups = await self.get_redirects()
+        mappings = await self.get_port_mapping_table()
+        refreshed = False
+        while True:
+            mapping = mappings.get(port, protocol)
+            while mapping is not None:
+                if mapping.lan_address == self.lan_address and mapping.internal_port == requested_port and \
+                        mapping.description == description:
+                    return port
+                port += 1
+                mapping = mappings.get(port, protocol)
+            try:
+                await self.add_port_mapping(port, protocol, _internal_port, self.lan_address, description, lease_time)
+                return port
+            except UPnPError as err:
+                if err.error_code not in CONFLICT_ERROR_CODES or port >= 65535:
+                    raise
+            if refreshed:
+                # the gateway doesn't list the mapping in the way, step past it
+                port += 1
+            else:
+                # the cached table was out of date, reload it and look again from this port
+                mappings = await self.get_port_mapping_table(refresh=True)
+                refreshed = True
 
-        redirects: Dict[Tuple[int, str], Tuple[str, int, str]] = {
-            (ext_port, proto): (int_host, int_port, desc)
-            for (ext_host, ext_port, proto, int_port, int_host, enabled, desc, _) in redirect_tups
-        }
+    async def allocate_port_mapping(self, port: int, protocol: str, description: str,
+                                    internal_port: Optional[int] = None, lease_time: int = 0,
+                                    max_attempts: int = 16) -> int:
+        """
+        Map a free external port, preferring the requested one. Uses AddAnyPortMapping if the gateway supports it,
+        otherwise tries AddPortMapping on the requested port and then on a hashed sequence of other ports while
+        they are taken, without listing the mappings. Ports already mapped, including to other mappings of this
+        host that AddPortMapping would silently replace, are skipped.
 
-        while (port, protocol) in redirects:
-            int_host, int_port, desc = redirects[(port, protocol)]
-            if int_host == self.lan_address and int_port == requested_port and desc == description:
-                return port
-            port += 1
-        await self.add_port_mapping(port, protocol, _internal_port, self.lan_address, description, lease_time)
-        return port
+        :param port: (int) preferred external port
+        :param protocol: (str) UDP | TCP
+        :param description: (str) mapping description
+        :param internal_port: (int) internal port
+        :param lease_time: (int) lease time in seconds
+        :param max_attempts: (int) how many ports to try before giving up
+
+        :return: (int) mapped port
+        """
+
+        _internal_port = int(internal_port or port)
+        port = int(port)
+        if self.gateway.commands.is_registered('AddAnyPortMapping'):
+            try:
+                reserved_port = await self.gateway.commands.AddAnyPortMapping(
+                    NewRemoteHost='', NewExternalPort=port, NewProtocol=protocol, NewInternalPort=_internal_port,
+                    NewInternalClient=self.lan_address, NewEnabled=1, NewPortMappingDescription=description,
+                    NewLeaseDuration=str(lease_time)
+                )
+            except UPnPError as err:
+                self.port_mappings.invalidate()
+                log.debug("AddAnyPortMapping failed (%s), trying AddPortMapping", str(err))
+            else:
+                if reserved_port is not None:
+                    self.port_mappings.add(GetGenericPortMappingEntryResponse(
+                        '', reserved_port, protocol, _internal_port, self.lan_address, True, description, lease_time
+                    ))
+                    return reserved_port
+        seed = f"{self.lan_address}|{protocol}|{_internal_port}|{description}"
+        for candidate in itertools.islice(port_probe_sequence(port, seed), max_attempts):
+            existing: Optional[Tuple[Optional[str], Optional[int], Optional[str]]] = None
+            if self.port_mappings.is_fresh:
+                mapping = self.port_mappings.get(candidate, protocol)
+                if mapping is not None:
+                    existing = mapping.lan_address, mapping.internal_port, mapping.description
+            else:
+                try:
+                    specific = await self.get_specific_port_mapping(candidate, protocol)
+                    existing = specific.lan_address, specific.internal_port, specific.description
+                except UPnPError:
+                    pass  # not mapped, or the gateway can't tell and AddPortMapping has to
+            if existing is not None and existing != (self.lan_address, _internal_port, description):
+                continue  # taken, or one of our other mappings that would be replaced
+            try:
+                await self.add_port_mapping(
+                    candidate, protocol, _internal_port, self.lan_address, description, lease_time
+                )
+            except UPnPError as err:
+                if err.error_code not in CONFLICT_ERROR_CODES:
+                    raise
+                log.debug("external port %i/%s is taken, trying another", candidate, protocol)
+                continue
+            return candidate
+        raise UPnPError(f"failed to map a free {protocol} port after {max_attempts} attempts")
 
     async def gather_debug_info(self) -> str:  # pragma: no cover
         """
@@ -388,6 +586,7 @@ cli_commands = [
     'get_specific_port_mapping',
     'delete_port_mapping',
     'get_next_mapping',
+    'allocate_port_mapping',
     'gather_debug_info'
 ]
 
@@ -38,17 +38,48 @@ def flatten_keys(to_flatten: str_any_dict, strip: str) -> str_any_dict:
     return copy
 
 
-def get_dict_val_case_insensitive(source: typing.Dict[typing.AnyStr, typing.AnyStr],
-                                  key: typing.AnyStr) -> typing.Optional[typing.AnyStr]:
-    match: typing.List[typing.AnyStr] = list(filter(lambda x: x.lower() == key.lower(), source.keys()))
-    if not len(match):
-        return None
-    if len(match) > 1:
-        raise KeyError("overlapping keys")
-    if len(match) == 1:
-        matched_key: typing.AnyStr = match[0]
-        return source[matched_key]
-    raise KeyError("overlapping keys")
+_V = typing.TypeVar('_V')
+
+
+class CaseInsensitiveDict(typing.MutableMapping[typing.AnyStr, _V]):
+    """
+    Mapping with str or bytes keys that are looked up regardless of case. The keys keep the casing they were
+    inserted with, and inserting a key that differs from an existing one only by case raises KeyError.
+    """
+
+    __slots__ = ('_store',)
+
+    def __init__(self, items: typing.Optional[typing.Union[typing.Mapping[typing.AnyStr, _V],
+                                                           typing.Iterable[typing.Tuple[typing.AnyStr, _V]]]] = None
+                 ) -> None:
+        self._store: typing.Dict[typing.AnyStr, typing.Tuple[typing.AnyStr, _V]] = {}
+        if items is not None:
+            self.update(items)
+
+    def __getitem__(self, key: typing.AnyStr) -> _V:
+        return self._store[key.lower()][1]
+
+    def __setitem__(self, key: typing.AnyStr, value: _V) -> None:
+        lowered = key.lower()
+        existing = self._store.get(lowered)
+        if existing is not None and existing[0] != key:
+            raise KeyError("overlapping keys")
+        self._store[lowered] = (key, value)
+
+    def __delitem__(self, key: typing.AnyStr) -> None:
+        del self._store[key.lower()]
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, (str, bytes)) and key.lower() in self._store
+
+    def __iter__(self) -> typing.Iterator[typing.AnyStr]:
+        return (key for key, _ in self._store.values())
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({dict(self.items())!r})"
 
 
 # the ipaddress module does not show these subnets as reserved
@@ -0,0 +1,39 @@
+"""
+Benchmark of walking a gateway's port mapping table
+
+Walks a simulated 300 entry mapping table, with a fixed round trip time per GetGenericPortMappingEntry request,
+one request at a time (as get_redirects used to) and with the adaptive window of speculative requests it uses now.
+
+usage: python benchmarks/get_redirects.py
+"""
+
+import time
+import asyncio
+from aioupnp.fault import UPnPError
+from aioupnp.commands import GetGenericPortMappingEntryResponse
+from aioupnp.mappings import FetchWindow, walk_mapping_table
+
+ENTRIES = 300
+ROUND_TRIP = 0.005
+
+
+async def fetch(index: int) -> GetGenericPortMappingEntryResponse:
+    await asyncio.sleep(ROUND_TRIP)
+    if index >= ENTRIES:
+        raise UPnPError("SpecifiedArrayIndexInvalid")
+    return GetGenericPortMappingEntryResponse('', 1024 + index, 'UDP', 1024 + index, '10.0.0.2', True, 'test', 0)
+
+
+def main() -> None:
+    loop = asyncio.get_event_loop()
+    print(f"{ENTRIES} entries, {ROUND_TRIP * 1000:.0f}ms round trip")
+    for label, window in (("serial", FetchWindow(1, 1)), ("windowed", FetchWindow())):
+        for walk in ("first walk", "second walk"):
+            start = time.perf_counter()
+            entries = loop.run_until_complete(walk_mapping_table(fetch, window, loop))
+            assert len(entries) == ENTRIES
+            print(f"  {label:<9} {walk:<12} {time.perf_counter() - start:.3f}s (window {window.size})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Microbenchmark for SCPDHTTPClientProtocol response parsing
+
+Feeds the recorded device and service descriptor responses from tests/replays into the protocol in small chunks
+and reports the parse throughput for each chunk size. With a linear parser the throughput should not collapse as
+the chunk size shrinks.
+
+usage: python benchmarks/scpd_http_parser.py
+"""
+
+import os
+import json
+import time
+import asyncio
+import typing
+from aioupnp.protocols.scpd import SCPDHTTPClientProtocol
+
+REPLAYS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "replays")
+CHUNK_SIZES = [64, 256, 1450]
+ROUNDS = 200
+
+
+def load_responses() -> typing.List[bytes]:
+    responses: typing.List[bytes] = []
+    for name in sorted(os.listdir(REPLAYS_DIR)):
+        with open(os.path.join(REPLAYS_DIR, name), 'r') as f:
+            gateway_info = json.loads(f.read())['gateway']
+        responses.append(gateway_info['gateway_xml'].encode())
+        responses.extend(xml.encode() for xml in gateway_info['service_descriptors'].values())
+    return responses
+
+
+def feed(loop: asyncio.AbstractEventLoop, response: bytes, chunk_size: int) -> None:
+    protocol = SCPDHTTPClientProtocol(b'', loop.create_future())
+    for i in range(0, len(response), chunk_size):
+        protocol.data_received(response[i:i + chunk_size])
+    assert protocol.finished.done() and not protocol.finished.exception()
+
+
+def main() -> None:
+    loop = asyncio.new_event_loop()
+    responses = load_responses()
+    total_bytes = sum(len(r) for r in responses)
+    print(f"{len(responses)} responses, {total_bytes} bytes, {ROUNDS} rounds")
+    for chunk_size in CHUNK_SIZES:
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for response in responses:
+                feed(loop, response, chunk_size)
+        elapsed = time.perf_counter() - start
+        print(f"chunk size {chunk_size:>5}: {elapsed:.3f}s, "
+              f"{total_bytes * ROUNDS / elapsed / 1024 / 1024:.1f} MiB/s")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
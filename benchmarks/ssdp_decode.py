@@ -0,0 +1,53 @@
+"""
+Microbenchmark for SSDP datagram decoding
+
+Decodes the recorded M-SEARCH replies from tests/replays along with every M-SEARCH variant aioupnp sends, and
+reports the decode rate in datagrams per second, both for SSDPDatagram.decode (the receive path) and for
+SSDPDatagram.as_dict (used when sending and logging).
+
+usage: python benchmarks/ssdp_decode.py
+"""
+
+import os
+import json
+import time
+import typing
+from aioupnp.serialization.ssdp import SSDPDatagram
+from aioupnp.protocols.m_search_patterns import packet_generator
+
+REPLAYS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "replays")
+ROUNDS = 2000
+
+
+def load_datagrams() -> typing.List[bytes]:
+    datagrams: typing.List[bytes] = []
+    for name in sorted(os.listdir(REPLAYS_DIR)):
+        with open(os.path.join(REPLAYS_DIR, name), 'r') as f:
+            gateway_info = json.loads(f.read())['gateway']
+        datagrams.append(SSDPDatagram("OK", gateway_info['reply']).encode().encode())
+    datagrams.extend(SSDPDatagram("M-SEARCH", args).encode().encode() for args in packet_generator())
+    return datagrams
+
+
+def main() -> None:
+    datagrams = load_datagrams()
+    print(f"{len(datagrams)} datagrams, {ROUNDS} rounds")
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for datagram in datagrams:
+            SSDPDatagram.decode(datagram)
+    elapsed = time.perf_counter() - start
+    print(f"decode:  {elapsed:.3f}s, {len(datagrams) * ROUNDS / elapsed:,.0f} datagrams/s")
+
+    packets = [SSDPDatagram.decode(datagram) for datagram in datagrams]
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for packet in packets:
+            packet.as_dict()
+    elapsed = time.perf_counter() - start
+    print(f"as_dict: {elapsed:.3f}s, {len(packets) * ROUNDS / elapsed:,.0f} datagrams/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark of the xml parser backends
+
+Parses the replayed descriptors (into dicts, as discovery does) and soap responses (into output argument values, as
+the command wrappers do) with each available backend, and reports the speedup over defusedxml.
+
+usage: python benchmarks/xml_backends.py
+"""
+
+import os
+import json
+import time
+import typing
+from aioupnp.constants import UPNP_NAMESPACES
+from aioupnp.serialization.scpd import find_xml_content
+from aioupnp.serialization.soap import decode_soap_post_response_fields
+from aioupnp.serialization.xml import XML_BACKENDS, set_xml_backend, xml_to_local_dict
+
+REPLAYS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "replays")
+ROUNDS = 500
+FIELDS = {'NewRemoteHost': 0, 'NewExternalPort': 1, 'NewProtocol': 2, 'NewInternalPort': 3, 'NewInternalClient': 4,
+          'NewEnabled': 5, 'NewPortMappingDescription': 6, 'NewLeaseDuration': 7, 'NewExternalIPAddress': 0}
+
+
+def load_replays() -> typing.Tuple[typing.List[str], typing.List[typing.Tuple[bytes, str]]]:
+    descriptors: typing.List[str] = []
+    soap_responses: typing.List[typing.Tuple[bytes, str]] = []
+    for name in sorted(os.listdir(REPLAYS_DIR)):
+        with open(os.path.join(REPLAYS_DIR, name), 'r') as f:
+            gateway_info = json.loads(f.read())['gateway']
+        for response in [gateway_info['gateway_xml']] + list(gateway_info['service_descriptors'].values()):
+            descriptors.append(find_xml_content(response.split('\r\n\r\n', 1)[1].encode()).decode())
+        for method, requests in gateway_info['soap_requests'].items():
+            soap_responses.extend((response.encode(), method) for _, response in requests)
+    return descriptors, soap_responses
+
+
+def timed(fn: typing.Callable[[], typing.Any]) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    descriptors, soap_responses = load_replays()
+    print(f"{len(descriptors)} descriptors, {len(soap_responses)} soap responses, {ROUNDS} rounds")
+    elapsed: typing.Dict[str, typing.Tuple[float, float]] = {}
+    for name in XML_BACKENDS:
+        set_xml_backend(name)
+        elapsed[name] = (
+            timed(lambda: [xml_to_local_dict(body, UPNP_NAMESPACES) for body in descriptors]),
+            timed(lambda: [decode_soap_post_response_fields(r, method, FIELDS) for r, method in soap_responses]),
+        )
+    base_descriptors, base_soap = elapsed['defusedxml']
+    for name, (descriptors_elapsed, soap_elapsed) in elapsed.items():
+        print(f"{name:<12} descriptors {len(descriptors) * ROUNDS / descriptors_elapsed:10,.0f}/s "
+              f"({base_descriptors / descriptors_elapsed:.2f}x)   "
+              f"soap responses {len(soap_responses) * ROUNDS / soap_elapsed:10,.0f}/s "
+              f"({base_soap / soap_elapsed:.2f}x)")
+    if 'lxml' not in XML_BACKENDS:
+        print("lxml is not installed")
+
+
+if __name__ == "__main__":
+    main()
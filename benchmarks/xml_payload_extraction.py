@@ -0,0 +1,76 @@
+"""
+Pathological input benchmark for locating the xml payload of scpd and soap responses
+
+Times find_xml_content and find_envelope on 1 MB adversarial bodies, the kind that made the regular expressions
+they replaced backtrack: repeated unclosed xml declarations (quadratic for the old scpd pattern) and long runs of
+whitespace after an envelope head with no closing '>' (exponential for the old soap pattern). For comparison the
+old patterns are timed on much smaller versions of the same inputs.
+
+usage: python benchmarks/xml_payload_extraction.py
+"""
+
+import re
+import time
+import typing
+from aioupnp.constants import XML_VERSION_PREFIX
+from aioupnp.serialization.scpd import find_xml_content
+from aioupnp.serialization.soap import find_envelope
+
+SIZE = 1024 * 1024
+
+OLD_CONTENT_PATTERN = re.compile(
+    "(\\<\\?xml version=\"1\\.0\"[^>]*\\?\\>(\\s*.)*|\\>)"
+)
+OLD_CONTENT_NO_XML_VERSION_PATTERN = re.compile(
+    b"(\\<([^:>]*)\\:Envelope xmlns\\:[^:>]*=\"http\\:\\/\\/schemas\\.xmlsoap\\.org\\/soap\\/envelope\\/\"(\\s*.)*\\>)"
+)
+ENVELOPE_HEAD = b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"'
+
+
+def fill(unit: bytes, size: int, head: bytes = b'', tail: bytes = b'') -> bytes:
+    return head + unit * ((size - len(head) - len(tail)) // len(unit)) + tail
+
+
+def scpd_bodies(size: int) -> typing.Dict[str, bytes]:
+    prefix = XML_VERSION_PREFIX.encode()
+    return {
+        'unclosed declarations': fill(prefix, size),
+        'declaration then newlines': fill(b'\n', size, prefix + b'?>'),
+        'declaration then whitespace': fill(b' \n', size, prefix + b'?>', b'<root/>'),
+    }
+
+
+def soap_bodies(size: int) -> typing.Dict[str, bytes]:
+    return {
+        'whitespace without a closing >': fill(b' ', size, ENVELOPE_HEAD),
+        'newline before every >': fill(b'\n>', size, ENVELOPE_HEAD),
+        'repeated envelope heads': fill(b'<s:Envelope xmlns:', size),
+    }
+
+
+def timed(fn: typing.Callable[[], typing.Any]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    print(f"linear search on {SIZE} byte bodies")
+    for name, body in scpd_bodies(SIZE).items():
+        print(f"  find_xml_content  {name:<32} {timed(lambda: find_xml_content(body)) * 1000:8.2f}ms")
+    for name, body in soap_bodies(SIZE).items():
+        print(f"  find_envelope     {name:<32} {timed(lambda: find_envelope(body)) * 1000:8.2f}ms")
+
+    print("old regular expressions on small bodies")
+    for size in (20000, 40000, 80000):
+        body = scpd_bodies(size)['unclosed declarations']
+        elapsed = timed(lambda: OLD_CONTENT_PATTERN.findall(body.decode()))
+        print(f"  CONTENT_PATTERN   unclosed declarations, {size:>6} bytes   {elapsed * 1000:8.2f}ms")
+    for spaces in (16, 18, 20, 22):
+        body = ENVELOPE_HEAD + b' ' * spaces
+        elapsed = timed(lambda: OLD_CONTENT_NO_XML_VERSION_PATTERN.findall(body))
+        print(f"  CONTENT_NO_XML_VERSION_PATTERN  {spaces} trailing spaces        {elapsed * 1000:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark for turning the replayed descriptors and soap responses into dicts
+
+Compares parsing with the upnp namespaces stripped while the tree is walked (xml_to_local_dict, used by
+deserialize_scpd_get_response and deserialize_soap_post_response) with building the namespaced tree and then
+stripping each namespace with a copy of the tree from flatten_keys, as was done before. Descriptors are parsed
+without the parse cache, and soap faults are left out as they raise.
+
+usage: python benchmarks/xml_to_dict.py
+"""
+
+import os
+import json
+import time
+import typing
+from aioupnp.cache import ParseCache
+from aioupnp.constants import SERVICE, CONTROL, ENVELOPE
+from aioupnp.gateway import get_action_list
+from aioupnp.serialization.scpd import find_xml_content, deserialize_scpd_get_response, XML_ROOT_SANITY_PATTERN
+from aioupnp.serialization.soap import find_envelope, deserialize_soap_post_response
+from aioupnp.serialization.xml import xml_to_dict
+from aioupnp.util import flatten_keys
+
+REPLAYS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "replays")
+ROUNDS = 200
+SOAP_BODY = "{http://schemas.xmlsoap.org/soap/envelope/}Body"
+SOAP_FAULT = "{http://schemas.xmlsoap.org/soap/envelope/}Fault"
+NO_CACHE = ParseCache(0)
+
+
+def load_replays() -> typing.Tuple[typing.List[bytes], typing.List[typing.Tuple[bytes, str, str]]]:
+    descriptors: typing.List[bytes] = []
+    soap_responses: typing.List[typing.Tuple[bytes, str, str]] = []
+    for name in sorted(os.listdir(REPLAYS_DIR)):
+        with open(os.path.join(REPLAYS_DIR, name), 'r') as f:
+            gateway_info = json.loads(f.read())['gateway']
+        for response in [gateway_info['gateway_xml']] + list(gateway_info['service_descriptors'].values()):
+            descriptors.append(response.split('\r\n\r\n', 1)[1].encode())
+        for method, requests in gateway_info['soap_requests'].items():
+            for _, response in requests:
+                if find_envelope(response.encode()) and b':Fault>' not in response.encode():
+                    soap_responses.append((response.encode(), method, gateway_info['registered_soap_commands'][method]))
+    return descriptors, soap_responses
+
+
+def flatten_descriptor(body: bytes) -> typing.List[typing.Tuple[str, typing.List[str], typing.List[str]]]:
+    xml_dict = xml_to_dict(find_xml_content(body).decode())
+    for k in list(xml_dict.keys()):
+        m = XML_ROOT_SANITY_PATTERN.findall(k)
+        if len(m) == 3 and m[1][0] and m[2][5]:
+            xml_dict = flatten_keys(xml_dict, "{%s}" % m[1][0])[m[2][5]]
+            break
+    return get_action_list(flatten_keys(xml_dict, "{%s}" % SERVICE))
+
+
+def flatten_soap_response(response: bytes, method: str, service_id: str) -> typing.Dict[str, typing.Any]:
+    envelope = xml_to_dict(find_envelope(response).decode())[ENVELOPE]
+    body = flatten_keys(envelope[SOAP_BODY], "{%s}" % service_id)
+    if SOAP_FAULT in body:
+        return flatten_keys(body[SOAP_FAULT], "{%s}" % CONTROL)
+    result: typing.Dict[str, typing.Any] = body[f"{method}Response"]
+    return result
+
+
+def timed(label: str, count: int, fn: typing.Callable[[], typing.Any]) -> None:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed:.3f}s, {count * ROUNDS / elapsed:,.0f}/s")
+
+
+def parse_descriptors(descriptors: typing.List[bytes]) -> None:
+    for body in descriptors:
+        get_action_list(deserialize_scpd_get_response(body, NO_CACHE))
+
+
+def parse_soap_responses(soap_responses: typing.List[typing.Tuple[bytes, str, str]]) -> None:
+    for response, method, service_id in soap_responses:
+        deserialize_soap_post_response(response, method, service_id)
+
+
+def main() -> None:
+    descriptors, soap_responses = load_replays()
+    print(f"{len(descriptors)} descriptors, {len(soap_responses)} soap responses, {ROUNDS} rounds")
+    print("descriptors")
+    timed("stripped while parsing", len(descriptors), lambda: parse_descriptors(descriptors))
+    timed("xml_to_dict + flatten_keys", len(descriptors), lambda: [flatten_descriptor(b) for b in descriptors])
+    print("soap responses")
+    timed("stripped while parsing", len(soap_responses), lambda: parse_soap_responses(soap_responses))
+    timed("xml_to_dict + flatten_keys", len(soap_responses),
+          lambda: [flatten_soap_response(*r) for r in soap_responses])
+
+
+if __name__ == "__main__":
+    main()
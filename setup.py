@@ -38,5 +38,8 @@ setup(
     install_requires=[
         'netifaces',
         'defusedxml'
-    ]
+    ],
+    extras_require={
+        'lxml': ['lxml'],
+    }
 )
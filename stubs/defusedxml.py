@@ -21,3 +21,18 @@ class ElementTree:
     @classmethod
     def fromstring(cls, xml_str: str) -> 'ElementTree':
         raise NotImplementedError()
+
+    class DefusedXMLParser:
+        def __init__(self, target: typing.Optional[typing.Any] = None) -> None:
+            raise NotImplementedError()
+
+        def feed(self, data: typing.Union[str, bytes]) -> None:
+            raise NotImplementedError()
+
+        def close(self) -> typing.Any:
+            raise NotImplementedError()
+
+
+class DTDForbidden(ValueError):
+    def __init__(self, name: typing.Optional[str], sysid: typing.Optional[str], pubid: typing.Optional[str]) -> None:
+        raise NotImplementedError()
@@ -0,0 +1,13 @@
+import typing
+
+
+class XMLParser:
+    def __init__(self, target: typing.Optional[typing.Any] = None, resolve_entities: bool = True,
+                 no_network: bool = True, load_dtd: bool = False, huge_tree: bool = False) -> None:
+        raise NotImplementedError()
+
+    def feed(self, data: typing.Union[str, bytes]) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> typing.Any:
+        raise NotImplementedError()
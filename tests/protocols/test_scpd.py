@@ -1,7 +1,17 @@
+import asyncio
 from aioupnp.fault import UPnPError
-from aioupnp.protocols.scpd import scpd_post, scpd_get
+from aioupnp.cache import ParseCache
+from aioupnp.protocols.scpd import scpd_post, scpd_get, SCPDConnectionPool, SCPDHTTPClientProtocol, parse_headers
+from aioupnp.serialization.scpd import DescriptorStreamParser, deserialize_scpd_get_dict
+from aioupnp.serialization.xml import get_xml_backend
 from tests import AsyncioTestCase, mock_tcp_and_udp
 
+# what each xml backend says about a truncated or empty document
+TRUNCATED_XML_ERRORS = {
+    'defusedxml': ('no element found',),
+    'lxml': ('Premature end of data', 'Document is empty'),
+}
+
 
 class TestSCPDGet(AsyncioTestCase):
     path, lan_address, port = '/IGDdevicedesc_brlan0.xml', '10.1.10.1', 49152
@@ -133,6 +143,28 @@ class TestSCPDGet(AsyncioTestCase):
             self.assertIsNone(err)
             self.assertDictEqual(self.expected_parsed, result)
 
+    async def test_scpd_get_small_chunks(self):
+        sent = []
+        replies = {self.get_request: self.response}
+        for chunk_size in (1, 3, 1450):
+            with mock_tcp_and_udp(self.loop, tcp_replies=replies, sent_tcp_packets=sent, tcp_chunk_size=chunk_size):
+                result, raw, err = await scpd_get(self.path, self.lan_address, self.port, self.loop)
+                self.assertIsNone(err)
+                self.assertEqual(self.response, raw)
+                self.assertDictEqual(self.expected_parsed, result)
+
+    async def test_streamed_body_is_not_buffered(self):
+        finished = self.loop.create_future()
+        xml_parser = DescriptorStreamParser(ParseCache())
+        protocol = SCPDHTTPClientProtocol(self.get_request, finished, xml_parser=xml_parser)
+        for i in range(0, len(self.response), 100):
+            protocol.data_received(self.response[i:i + 100])
+        raw, body, code, _ = finished.result()
+        self.assertEqual(self.response, raw)
+        self.assertEqual(b'', body)
+        self.assertEqual(self.response.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n', protocol._buffer)
+        self.assertDictEqual(self.expected_parsed, deserialize_scpd_get_dict(xml_parser.close()))
+
     async def test_scpd_get_timeout(self):
         sent = []
         replies = {}
@@ -150,7 +182,7 @@ class TestSCPDGet(AsyncioTestCase):
             self.assertDictEqual({}, result)
             self.assertEqual(self.bad_response, raw)
             self.assertIsInstance(err, UPnPError)
-            self.assertTrue(str(err).startswith('no element found'))
+            self.assertTrue(str(err).startswith(TRUNCATED_XML_ERRORS[get_xml_backend()]), str(err))
 
     async def test_scpd_get_overrun_content_length(self):
         sent = []
@@ -182,6 +214,19 @@ class TestSCPDGet(AsyncioTestCase):
             self.assertIsInstance(err, UPnPError)
             self.assertEqual("duplicate headers", str(err))
 
+    def test_parse_headers(self):
+        headers, code, message = parse_headers(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\nServer: a: b \r\nEXT:"
+        )
+        self.assertEqual(200, code)
+        self.assertEqual(b" OK", message)
+        self.assertEqual([b'Content-Length', b'Server', b'EXT'], list(headers))
+        self.assertEqual(b'10', headers[b'CONTENT-LENGTH'])
+        self.assertEqual(b'a: b', headers[b'server'])
+        self.assertEqual(b'', headers[b'ext'])
+        with self.assertRaises(ValueError):
+            parse_headers(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\ncontent-length: 10")
+
 
 class TestSCPDPost(AsyncioTestCase):
     param_names: list = []
@@ -272,7 +317,7 @@ class TestSCPDPost(AsyncioTestCase):
                 self.path, self.gateway_address, self.port, self.method, self.param_names, self.st, self.loop
             )
             self.assertIsInstance(err, UPnPError)
-            self.assertTrue(str(err).startswith('no element found'))
+            self.assertTrue(str(err).startswith(TRUNCATED_XML_ERRORS[get_xml_backend()]), str(err))
             self.assertEqual(self.bad_envelope_response, raw)
             self.assertDictEqual({}, result)
 
@@ -287,3 +332,120 @@ class TestSCPDPost(AsyncioTestCase):
             self.assertTrue(str(err).startswith('too many bytes written'))
             self.assertEqual(self.post_response + b'\r\n', raw)
             self.assertDictEqual({}, result)
+
+
+class TestSCPDConnectionPool(AsyncioTestCase):
+    param_names, kwargs = TestSCPDPost.param_names, TestSCPDPost.kwargs
+    method, gateway_address, port = TestSCPDPost.method, TestSCPDPost.gateway_address, TestSCPDPost.port
+    st, path = TestSCPDPost.st, TestSCPDPost.path
+    post_response = TestSCPDPost.post_response
+    keep_alive_post_bytes = TestSCPDPost.post_bytes.replace(b'Connection: Close', b'Connection: keep-alive')
+
+    async def _post_twice(self, replies, connections):
+        with mock_tcp_and_udp(self.loop, tcp_replies=replies):
+            create_connection = self.loop.create_connection
+
+            async def counting_create_connection(*args, **kwargs):
+                connections.append(args)
+                return await create_connection(*args, **kwargs)
+
+            self.loop.create_connection = counting_create_connection
+            pool = SCPDConnectionPool(self.gateway_address, self.port, loop=self.loop)
+            for _ in range(2):
+                result, raw, err = await scpd_post(
+                    self.path, self.gateway_address, self.port, self.method, self.param_names, self.st, self.loop,
+                    pool
+                )
+                self.assertIsNone(err)
+                self.assertDictEqual({'NewExternalIPAddress': '11.22.33.44'}, result)
+            pool.close()
+            return pool
+
+    async def test_reuse_kept_alive_connection(self):
+        connections = []
+        await self._post_twice({self.keep_alive_post_bytes: self.post_response}, connections)
+        self.assertEqual(1, len(connections))
+
+    async def test_fall_back_when_gateway_closes(self):
+        connections = []
+        response = self.post_response.replace(b'EXT:\r\n', b'EXT:\r\nConnection: close\r\n')
+        await self._post_twice({self.keep_alive_post_bytes: response}, connections)
+        self.assertEqual(2, len(connections))
+
+    async def test_retry_closed_idle_connection(self):
+        with mock_tcp_and_udp(self.loop, tcp_replies={self.keep_alive_post_bytes: self.post_response}):
+            pool = SCPDConnectionPool(self.gateway_address, self.port, loop=self.loop)
+            first = await pool.request(self.keep_alive_post_bytes)
+            self.assertTrue(first.keep_alive)
+            first.connection_lost(None)
+            second = await pool.request(self.keep_alive_post_bytes)
+            self.assertIsNot(first, second)
+            self.assertEqual(self.post_response, second.finished.result()[0])
+            pool.close()
+
+    async def test_stop_reusing_after_unanswered_request(self):
+        connections = []
+        replies = {self.keep_alive_post_bytes: self.post_response, TestSCPDPost.post_bytes: self.post_response}
+        with mock_tcp_and_udp(self.loop, tcp_replies=replies):
+            create_connection = self.loop.create_connection
+
+            async def answer_once_create_connection(*args, **kwargs):
+                transport, protocol = await create_connection(*args, **kwargs)
+                connections.append(transport)
+                transport.write = lambda data: None  # only the request sent on connecting is answered
+                return transport, protocol
+
+            self.loop.create_connection = answer_once_create_connection
+            pool = SCPDConnectionPool(self.gateway_address, self.port, loop=self.loop)
+            for i in range(1 + pool.max_reuse_failures):
+                self.assertTrue(pool.keep_alive)
+                protocol = await pool.request(self.keep_alive_post_bytes, timeout=0.05)
+                self.assertEqual(self.post_response, protocol.finished.result()[0])
+                self.assertEqual(i + 1, len(connections))
+            self.assertFalse(pool.keep_alive)
+            result, raw, err = await scpd_post(
+                self.path, self.gateway_address, self.port, self.method, self.param_names, self.st, self.loop, pool
+            )
+            self.assertIsNone(err)
+            self.assertEqual(2 + pool.max_reuse_failures, len(connections))
+            pool.close()
+
+    async def test_keep_reusing_after_a_stale_connection(self):
+        connections = []
+        with mock_tcp_and_udp(self.loop, tcp_replies={self.keep_alive_post_bytes: self.post_response}):
+            create_connection = self.loop.create_connection
+
+            async def stale_first_create_connection(*args, **kwargs):
+                transport, protocol = await create_connection(*args, **kwargs)
+                if not connections:
+                    transport.write = lambda data: None  # the first connection goes stale after one request
+                connections.append(transport)
+                return transport, protocol
+
+            self.loop.create_connection = stale_first_create_connection
+            pool = SCPDConnectionPool(self.gateway_address, self.port, loop=self.loop)
+            for _ in range(4):
+                protocol = await pool.request(self.keep_alive_post_bytes, timeout=0.05)
+                self.assertEqual(self.post_response, protocol.finished.result()[0])
+            self.assertTrue(pool.keep_alive)
+            self.assertEqual(2, len(connections))
+            pool.close()
+
+    async def test_open_connections_are_capped(self):
+        connections = []
+        with mock_tcp_and_udp(self.loop, tcp_replies={self.keep_alive_post_bytes: self.post_response},
+                              tcp_delay_reply=0.01):
+            create_connection = self.loop.create_connection
+
+            async def counting_create_connection(*args, **kwargs):
+                connections.append(args)
+                return await create_connection(*args, **kwargs)
+
+            self.loop.create_connection = counting_create_connection
+            pool = SCPDConnectionPool(self.gateway_address, self.port, pool_size=2, loop=self.loop)
+            protocols = await asyncio.gather(
+                *(pool.request(self.keep_alive_post_bytes) for _ in range(6)), loop=self.loop
+            )
+            self.assertListEqual([self.post_response] * 6, [p.finished.result()[0] for p in protocols])
+            self.assertEqual(2, len(connections))
+            pool.close()
@@ -1,10 +1,12 @@
 import json
+import asyncio
+from unittest import mock
 from collections import OrderedDict
 from aioupnp.fault import UPnPError
-from aioupnp.protocols.m_search_patterns import packet_generator
+from aioupnp.protocols.m_search_patterns import packet_generator, packet_stages, LIKELY_SEARCH_TARGETS
 from aioupnp.serialization.ssdp import SSDPDatagram
 from aioupnp.constants import SSDP_IP_ADDRESS
-from aioupnp.protocols.ssdp import m_search, SSDPProtocol
+from aioupnp.protocols.ssdp import m_search, multi_m_search, listen_ssdp, encode_m_search, SSDPProtocol
 from tests import AsyncioTestCase, mock_tcp_and_udp
 
 
@@ -93,6 +95,104 @@ class TestSSDP(AsyncioTestCase):
             with mock_tcp_and_udp(self.loop, udp_replies=replies, udp_expected_addr="10.0.0.10"):
                 await m_search("10.0.0.2", "10.0.0.1", self.successful_args, timeout=1, loop=self.loop)
 
+    async def test_independent_searches(self):
+        igd_args = OrderedDict([
+            ("HOST", "239.255.255.250:1900"),
+            ("MAN", "ssdp:discover"),
+            ("MX", 1),
+            ("ST", "urn:schemas-upnp-org:device:InternetGatewayDevice:1")
+        ])
+        replies = {
+            (self.query_packet.encode().encode(), (SSDP_IP_ADDRESS, 1900)): self.reply_packet.encode().encode()
+        }
+        with mock_tcp_and_udp(self.loop, udp_replies=replies, udp_expected_addr="10.0.0.1"):
+            protocol, _, _ = await listen_ssdp("10.0.0.2", "10.0.0.1", self.loop)
+            wan_devices, igd_devices = asyncio.Queue(), asyncio.Queue()
+            igd_fut = protocol.send_m_searches("10.0.0.1", [igd_args], igd_devices)
+            wan_fut = protocol.send_m_searches("10.0.0.1", [self.successful_args, self.successful_args], wan_devices)
+            reply = await asyncio.wait_for(wan_fut, 1)
+            self.assertEqual(reply.encode(), self.reply_packet.encode())
+            self.assertEqual(1, wan_devices.qsize())
+            self.assertTrue(igd_devices.empty())
+            self.assertTrue(protocol.devices.empty())
+            self.assertFalse(igd_fut.done())
+            self.assertListEqual([("10.0.0.1", igd_args["ST"])], list(protocol._pending_searches.keys()))
+            protocol.disconnect()
+            self.assertTrue(igd_fut.cancelled())
+
+    def test_encoded_m_search_cache(self):
+        st, datagram = encode_m_search(self.successful_args)
+        self.assertEqual(self.successful_args['ST'], st)
+        self.assertEqual(self.query_packet.encode().encode(), datagram)
+        encoded = [encode_m_search(args) for args in self.packet_args]
+        with mock.patch('aioupnp.protocols.ssdp.SSDPDatagram') as datagram_class:
+            self.assertIs(datagram, encode_m_search(OrderedDict(self.successful_args))[1])
+            self.assertListEqual(encoded, [encode_m_search(OrderedDict(args)) for args in self.packet_args])
+            self.assertEqual(0, datagram_class.call_count)
+
+    def test_packet_stages(self):
+        stages = packet_stages()
+        self.assertListEqual(
+            sorted(self.byte_packets),
+            sorted(SSDPDatagram("M-SEARCH", p).encode().encode() for stage in stages for p in stage)
+        )
+        self.assertListEqual(LIKELY_SEARCH_TARGETS, [p['ST'] for p in stages[0]])
+
+    def test_packet_stages_lead_with_preferred(self):
+        preferred = self.packet_args[5]
+        stages = packet_stages([preferred])
+        self.assertListEqual([preferred], stages[0])
+        self.assertListEqual(
+            sorted(self.byte_packets),
+            sorted(SSDPDatagram("M-SEARCH", p).encode().encode() for stage in stages for p in stage)
+        )
+
+    async def test_staged_m_search_escalates(self):
+        sent = []
+        with mock_tcp_and_udp(self.loop, udp_expected_addr="10.0.0.1", sent_udp_packets=sent):
+            protocol = await multi_m_search("10.0.0.2", "10.0.0.1", 3, self.loop)
+            await asyncio.sleep(0)
+            self.assertEqual(len(packet_stages()[0]) * 2, len(sent))
+            await asyncio.sleep(1.0)
+            protocol.disconnect()
+        self.assertListEqual(sorted(self.byte_packets * 2), sorted(sent))
+
+    async def test_staged_m_search_holds_after_likely_reply(self):
+        igd_args = packet_stages()[0][0]
+        reply_args = OrderedDict(self.reply_args)
+        reply_args['ST'] = igd_args['ST']
+        replies = {
+            (SSDPDatagram("M-SEARCH", igd_args).encode().encode(), (SSDP_IP_ADDRESS, 1900)):
+                SSDPDatagram("OK", reply_args).encode().encode()
+        }
+        sent = []
+        with mock_tcp_and_udp(self.loop, udp_replies=replies, udp_expected_addr="10.0.0.1", sent_udp_packets=sent):
+            protocol = await multi_m_search("10.0.0.2", "10.0.0.1", 3, self.loop)
+            reply = await asyncio.wait_for(protocol.devices.get(), 1)
+            await asyncio.sleep(0.5)
+            protocol.disconnect()
+        self.assertEqual(igd_args['ST'], reply.st)
+        self.assertEqual(len(packet_stages()[0]) * 2, len(sent))
+        self.assertDictEqual({reply_args['SERVER']: igd_args}, protocol.replied_variants)
+
+    async def test_later_variant_is_credited(self):
+        stages = packet_stages()
+        answered = stages[2][0]
+        self.assertIn(answered['ST'], [args['ST'] for args in stages[1]])
+        self.assertNotEqual(answered, [args for args in stages[1] if args['ST'] == answered['ST']][0])
+        reply_args = OrderedDict(self.reply_args)
+        reply_args['ST'] = answered['ST']
+        replies = {
+            (SSDPDatagram("M-SEARCH", answered).encode().encode(), (SSDP_IP_ADDRESS, 1900)):
+                SSDPDatagram("OK", reply_args).encode().encode()
+        }
+        with mock_tcp_and_udp(self.loop, udp_replies=replies, udp_expected_addr="10.0.0.1"):
+            protocol = await multi_m_search("10.0.0.2", "10.0.0.1", 3, self.loop)
+            reply = await asyncio.wait_for(protocol.devices.get(), 3)
+            protocol.disconnect()
+        self.assertEqual(answered['ST'], reply.st)
+        self.assertDictEqual({reply_args['SERVER']: answered}, protocol.replied_variants)
+
     # async def test_packets_sent_fuzzy_m_search(self):
     #     sent = []
     #
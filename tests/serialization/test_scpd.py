@@ -1,9 +1,15 @@
+import os
+import re
+import json
+import random
 import unittest
 from aioupnp.fault import UPnPError
-from aioupnp.serialization.scpd import serialize_scpd_get, deserialize_scpd_get_response
-from aioupnp.serialization.xml import xml_to_dict
+from aioupnp.constants import XML_VERSION_PREFIX
+from aioupnp.serialization.scpd import serialize_scpd_get, deserialize_scpd_get_response, find_xml_content
+from aioupnp.serialization.xml import xml_to_dict, XMLStreamParser
 from aioupnp.device import Device
-from aioupnp.util import get_dict_val_case_insensitive
+from aioupnp.gateway import get_action_list
+from aioupnp.util import CaseInsensitiveDict, flatten_keys
 
 
 class TestSCPDSerialization(unittest.TestCase):
@@ -217,7 +223,7 @@ class TestSCPDSerialization(unittest.TestCase):
     def test_deserialize_to_device_object(self):
         devices = []
         services = []
-        device = Device(devices, services, **get_dict_val_case_insensitive(self.expected_parsed, "device"))
+        device = Device(devices, services, **CaseInsensitiveDict(self.expected_parsed)["device"])
         expected_result = {
             'deviceType': 'urn:schemas-upnp-org:device:InternetGatewayDevice:1',
             'friendlyName': 'CGA4131COM',
@@ -361,3 +367,121 @@ class TestSCPDSerialization(unittest.TestCase):
             }
         }
         self.assertDictEqual(expected_parsed, deserialize_scpd_get_response(xml_bytes))
+
+
+class TestXMLStreamParser(unittest.TestCase):
+    def assertStreamParsesLikeXMLToDict(self, body: bytes):
+        xml_str = body[body.index(XML_VERSION_PREFIX.encode()):].decode()
+        expected = xml_to_dict(xml_str)
+        for chunk_size in (1, 7, 64, len(body)):
+            parser = XMLStreamParser()
+            for i in range(0, len(body), chunk_size):
+                parser.feed(body[i:i + chunk_size])
+            self.assertEqual(expected, parser.close())
+
+    def test_replayed_descriptors(self):
+        replays_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replays")
+        for name in os.listdir(replays_dir):
+            with open(os.path.join(replays_dir, name), 'r') as f:
+                gateway_info = json.loads(f.read())['gateway']
+            for response in [gateway_info['gateway_xml']] + list(gateway_info['service_descriptors'].values()):
+                self.assertStreamParsesLikeXMLToDict(response.split('\r\n\r\n', 1)[1].encode())
+
+    def test_skip_leading_bytes_and_keep_text_semantics(self):
+        self.assertStreamParsesLikeXMLToDict(
+            b'junk <?xml version="1.0"?>\r\n<root xmlns="urn:a"><a> x </a><b></b><c> </c><d>1<e/>2</d>'
+            b'<a>y<!-- comment -->z</a></root>\r\n'
+        )
+
+    def test_no_document(self):
+        parser = XMLStreamParser()
+        parser.feed(b'<root></root>')
+        self.assertIsNone(parser.close())
+
+    def test_malformed_document(self):
+        parser = XMLStreamParser()
+        parser.feed(b'<?xml version="1.0"?><root><a></root>')
+        parser.feed(b'more')
+        with self.assertRaises(Exception):
+            parser.close()
+
+
+class TestLocalDictMatchesFlattenKeys(unittest.TestCase):
+    """
+    Differential test of parsing descriptors with the namespaces stripped while parsing against stripping them
+    afterwards with flatten_keys, as was done before
+    """
+    root_pattern = re.compile(
+        "(?i)(\\{|(urn:schemas-[\\w|\\d]*-(com|org|net))[:|-](device|service)[:|-]([\\w|\\d|\\:|\\-|\\_]*)|\\}([\\w|\\d|\\:|\\-|\\_]*))"
+    )
+    other_keys_pattern = re.compile("{[\\w|\\:\\/\\.]*}|(\\w*)")
+
+    def flattened_device_dict(self, body: bytes) -> dict:
+        xml_dict = xml_to_dict(find_xml_content(body).decode())
+        for k in list(xml_dict.keys()):
+            m = self.root_pattern.findall(k)
+            if len(m) == 3 and m[1][0] and m[2][5]:
+                xml_dict = flatten_keys(xml_dict, "{%s}" % m[1][0])[m[2][5]]
+                break
+        result = {}
+        for k, v in xml_dict.items():
+            if isinstance(v, dict):
+                inner_d = {}
+                for inner_k, inner_v in v.items():
+                    parsed_k = self.other_keys_pattern.findall(inner_k)
+                    inner_d[parsed_k[0] if len(parsed_k) == 2 else parsed_k[1]] = inner_v
+                result[k] = inner_d
+            else:
+                result[k] = v
+        return result
+
+    def assertParsesLikeFlattenKeys(self, body: bytes):
+        expected = self.flattened_device_dict(body)
+        parsed = deserialize_scpd_get_response(body)
+        self.assertEqual(expected, parsed)
+        self.assertEqual(get_action_list(flatten_keys(expected, "{urn:schemas-upnp-org:service-1-0}")),
+                         get_action_list(parsed))
+
+    def test_replayed_descriptors(self):
+        replays_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replays")
+        for name in os.listdir(replays_dir):
+            with open(os.path.join(replays_dir, name), 'r') as f:
+                gateway_info = json.loads(f.read())['gateway']
+            for response in [gateway_info['gateway_xml']] + list(gateway_info['service_descriptors'].values()):
+                self.assertParsesLikeFlattenKeys(response.split('\r\n\r\n', 1)[1].encode())
+        self.assertParsesLikeFlattenKeys(TestSCPDSerialization.response)
+
+    def test_other_schema_and_namespaces(self):
+        self.assertParsesLikeFlattenKeys(
+            b'<?xml version="1.0"?>\n<scpd xmlns="urn:schemas-microsoft-com:service-1-0" xmlns:x="urn:x">'
+            b'<specVersion><major>1</major><x:minor>0</x:minor></specVersion><actionList><action>'
+            b'<name>GetInfo</name><argumentList><argument><name>NewInfo</name><direction>out</direction>'
+            b'</argument></argumentList></action></actionList></scpd>\n'
+        )
+
+
+class TestFindXMLContentMatchesRegex(unittest.TestCase):
+    """
+    Differential test of find_xml_content against the regex it replaced
+    """
+    pattern = re.compile("(\\<\\?xml version=\\\"1\\.0\\\"[^>]*\\?\\>(\\s*.)*|\\>)")
+
+    def assertFindsLikeRegex(self, content: bytes):
+        parsed = self.pattern.findall(content.decode())
+        self.assertEqual('' if not parsed else parsed[0][0], find_xml_content(content).decode(), content)
+
+    def test_replayed_descriptors(self):
+        replays_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replays")
+        for name in os.listdir(replays_dir):
+            with open(os.path.join(replays_dir, name), 'r') as f:
+                gateway_info = json.loads(f.read())['gateway']
+            for response in [gateway_info['gateway_xml']] + list(gateway_info['service_descriptors'].values()):
+                self.assertFindsLikeRegex(response.encode())
+                self.assertFindsLikeRegex(response.split('\r\n\r\n', 1)[1].encode())
+
+    def test_fuzzed_content(self):
+        rand = random.Random(11)
+        tokens = [b'<', b'>', b'?', b'?>', b'\n', b' ', b'\r\n', b'a', b'"', XML_VERSION_PREFIX.encode(),
+                  XML_VERSION_PREFIX.encode() + b'?>', b'<root/>', b'\n\n']
+        for _ in range(5000):
+            self.assertFindsLikeRegex(b''.join(rand.choice(tokens) for _ in range(rand.randint(0, 12))))
@@ -1,6 +1,19 @@
+import os
+import re
+import json
+import time
+import typing
 import unittest
 from aioupnp.fault import UPnPError
-from aioupnp.serialization.soap import serialize_soap_post, deserialize_soap_post_response
+from aioupnp.serialization.soap import serialize_soap_post, deserialize_soap_post_response, find_envelope
+from aioupnp.serialization.soap import decode_soap_post_response_fields, SOAPRequestTemplate
+from aioupnp.serialization.soap import decode_port_mapping_list
+from aioupnp.serialization.scpd import deserialize_scpd_get_response
+from aioupnp.commands import SOAPCommands, ResponseFieldMap, recast_return, soap_port_mapping_list
+from aioupnp.commands import GetGenericPortMappingEntryResponse, PORT_MAPPING_LIST_FIELDS
+from aioupnp.gateway import get_action_list
+from aioupnp.serialization.xml import xml_to_dict
+from aioupnp.util import flatten_keys
 
 
 class TestSOAPSerialization(unittest.TestCase):
@@ -78,6 +91,29 @@ class TestSOAPSerialization(unittest.TestCase):
             self.method, self.param_names, self.st, b'http://' + self.gateway_address, self.path, **self.kwargs
         ), self.post_bytes)
 
+    def test_template_reused_for_requests(self):
+        template = SOAPRequestTemplate(self.method, self.param_names, self.st, self.gateway_address, self.path)
+        self.assertEqual(self.post_bytes, template.serialize(**self.kwargs))
+        self.assertEqual(self.post_bytes, template.serialize(**self.kwargs))
+        self.assertEqual(self.post_bytes.replace(b'Connection: Close', b'Connection: keep-alive'),
+                         template.serialize(keep_alive=True, **self.kwargs))
+
+    def test_serialize_post_escapes_arguments(self):
+        description = 'a < b & "c" > d é'
+        request = serialize_soap_post(
+            'AddPortMapping', ['NewExternalPort', 'NewPortMappingDescription'], self.st, self.gateway_address,
+            self.path, NewExternalPort=4567, NewPortMappingDescription=description
+        )
+        head, body = request.split(b'\r\n\r\n', 1)
+        self.assertIn(b'<NewExternalPort>4567</NewExternalPort>', body)
+        # the content length counts the bytes of the blank line before the body, but not the trailing \r\n
+        self.assertIn(b'Content-Length: %i\r\n' % len(body), head + b'\r\n')
+        self.assertEqual(
+            {'NewPortMappingDescription': description, 'NewExternalPort': '4567'},
+            deserialize_soap_post_response(body.replace(b'AddPortMapping', b'AddPortMappingResponse'),
+                                           'AddPortMapping', self.st.decode())
+        )
+
     def test_deserialize_post_response(self):
         self.assertDictEqual(
             deserialize_soap_post_response(self.post_response, self.method, service_id=self.st.decode()),
@@ -103,6 +139,7 @@ class TestSOAPSerialization(unittest.TestCase):
         except UPnPError as err:
             raised = True
             self.assertEqual(str(err), 'SpecifiedArrayIndexInvalid')
+            self.assertEqual(713, err.error_code)
         self.assertTrue(raised)
 
     def test_raise_from_error_response_without_error_description(self):
@@ -122,3 +159,194 @@ class TestSOAPSerialization(unittest.TestCase):
             deserialize_soap_post_response(response, 'GetExternalIPAddress', self.st.decode()),
             {'NewExternalIPAddress': '100.100.100.100'}
         )
+
+
+class TestDeserializeMatchesFlattenKeys(unittest.TestCase):
+    """
+    Differential test of soap responses parsed with the namespaces stripped while parsing against stripping the
+    service namespace afterwards with flatten_keys, as was done before
+    """
+    def test_replayed_responses(self):
+        replays_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replays")
+        for name in os.listdir(replays_dir):
+            with open(os.path.join(replays_dir, name), 'r') as f:
+                gateway_info = json.loads(f.read())['gateway']
+            for method, requests in gateway_info['soap_requests'].items():
+                service_id = gateway_info['registered_soap_commands'][method]
+                for _, response in requests:
+                    if not find_envelope(response.encode()):
+                        with self.assertRaises(Exception):
+                            deserialize_soap_post_response(response.encode(), method, service_id)
+                        continue
+                    envelope = xml_to_dict(find_envelope(response.encode()).decode())[
+                        "{http://schemas.xmlsoap.org/soap/envelope/}Envelope"
+                    ]
+                    body = flatten_keys(envelope["{http://schemas.xmlsoap.org/soap/envelope/}Body"],
+                                        "{%s}" % service_id)
+                    if "{http://schemas.xmlsoap.org/soap/envelope/}Fault" in body:
+                        with self.assertRaises(UPnPError):
+                            deserialize_soap_post_response(response.encode(), method, service_id)
+                        continue
+                    self.assertEqual(body[f"{method}Response"],
+                                     deserialize_soap_post_response(response.encode(), method, service_id))
+
+
+class TestDecodeResponseFields(unittest.TestCase):
+    """
+    Differential test of decoding responses straight into typed results against recasting the deserialized dict
+    """
+    st = TestSOAPSerialization.st.decode()
+
+    def assertDecodesLikeRecast(self, response: bytes, method: str, service_id: str, outputs: list) -> bool:
+        annotation = typing.get_type_hints(getattr(SOAPCommands, method))['return']
+        field_map = ResponseFieldMap.from_annotation(annotation, outputs)
+        self.assertIsNotNone(field_map)
+        values = decode_soap_post_response_fields(response, method, field_map.fields)
+        if values is None:
+            return False
+        self.assertEqual(recast_return(annotation, deserialize_soap_post_response(response, method, service_id),
+                                       outputs), field_map.build(values))
+        return True
+
+    def test_replayed_responses(self):
+        replays_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replays")
+        decoded = 0
+        for name in os.listdir(replays_dir):
+            with open(os.path.join(replays_dir, name), 'r') as f:
+                gateway_info = json.loads(f.read())['gateway']
+            outputs = {}
+            for response in gateway_info['service_descriptors'].values():
+                service_dict = deserialize_scpd_get_response(response.split('\r\n\r\n', 1)[1].encode())
+                outputs.update({method: out for method, _, out in get_action_list(service_dict)})
+            for method, requests in gateway_info['soap_requests'].items():
+                for _, response in requests:
+                    decoded += self.assertDecodesLikeRecast(
+                        response.encode(), method, gateway_info['registered_soap_commands'][method], outputs[method]
+                    )
+        self.assertGreater(decoded, 0)
+
+    def test_single_field(self):
+        self.assertTrue(self.assertDecodesLikeRecast(
+            TestSOAPSerialization.post_response, 'GetExternalIPAddress', self.st, ['NewExternalIPAddress']
+        ))
+        self.assertTrue(self.assertDecodesLikeRecast(
+            TestSOAPSerialization.post_response.replace(b'NewExternalIPAddress', b'newexternalipaddress'),
+            'GetExternalIPAddress', self.st, ['NewExternalIPAddress']
+        ))
+
+    def test_fall_back_to_deserializing(self):
+        fields = {'NewExternalIPAddress': 0}
+        for response in (TestSOAPSerialization.error_response, TestSOAPSerialization.blank_response,
+                         TestSOAPSerialization.blank_response_body,
+                         TestSOAPSerialization.post_response.replace(b'NewExternalIPAddress>', b'derp>'),
+                         TestSOAPSerialization.post_response.replace(b'11.22.33.44', b'<a>11.22.33.44</a>'),
+                         TestSOAPSerialization.post_response.replace(
+                             b'<NewExternalIPAddress>11.22.33.44</NewExternalIPAddress>', b'11.22.33.44'),
+                         TestSOAPSerialization.post_response.replace(
+                             b'</NewExternalIPAddress>', b'</NewExternalIPAddress><NewExternalIPAddress/>')):
+            self.assertIsNone(decode_soap_post_response_fields(response, 'GetExternalIPAddress', fields), response)
+        self.assertIsNone(decode_soap_post_response_fields(TestSOAPSerialization.post_response, 'GetFoo', fields))
+
+
+
+def port_mapping_list(entries: typing.List[str]) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<p:PortMappingList xmlns:p="urn:schemas-upnp-org:gw:WANIPConnection" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:schemaLocation="urn:schemas-upnp-org:gw:WANIPConnection '
+        'http://www.upnp.org/schemas/gw/WANIPConnection-v2.xsd">\n' + ''.join(entries) + '</p:PortMappingList>\n'
+    )
+
+
+def port_mapping_entry(external_port: int, description: str = 'test', remote_host: str = '') -> str:
+    return (
+        f'<p:PortMappingEntry>\n<p:NewRemoteHost>{remote_host}</p:NewRemoteHost>\n'
+        f'<p:NewExternalPort>{external_port}</p:NewExternalPort>\n<p:NewProtocol>TCP</p:NewProtocol>\n'
+        f'<p:NewInternalPort>{external_port}</p:NewInternalPort>\n'
+        f'<p:NewInternalClient>192.168.1.137</p:NewInternalClient>\n<p:NewEnabled>1</p:NewEnabled>\n'
+        f'<p:NewDescription>{description}</p:NewDescription>\n<p:NewLeaseTime>345</p:NewLeaseTime>\n'
+        f'</p:PortMappingEntry>\n'
+    )
+
+
+class TestDecodePortMappingList(unittest.TestCase):
+    def test_decode(self):
+        listing = port_mapping_list([
+            port_mapping_entry(2345, 'a &amp; b', '202.233.2.1'), port_mapping_entry(2346)
+        ])
+        self.assertListEqual([
+            ['202.233.2.1', '2345', 'TCP', '2345', '192.168.1.137', '1', 'a & b', '345'],
+            [None, '2346', 'TCP', '2346', '192.168.1.137', '1', 'test', '345'],
+        ], decode_port_mapping_list(listing, PORT_MAPPING_LIST_FIELDS))
+        self.assertListEqual([
+            GetGenericPortMappingEntryResponse('202.233.2.1', 2345, 'TCP', 2345, '192.168.1.137', True, 'a & b', 345),
+            GetGenericPortMappingEntryResponse(None, 2346, 'TCP', 2346, '192.168.1.137', True, 'test', 345),
+        ], soap_port_mapping_list(listing))
+
+    def test_decode_large_listing(self):
+        listing = port_mapping_list([port_mapping_entry(port) for port in range(1024, 6024)])
+        entries = soap_port_mapping_list(listing)
+        self.assertEqual(5000, len(entries))
+        self.assertListEqual(list(range(1024, 6024)), [entry.external_port for entry in entries])
+
+    def test_decode_empty_listing(self):
+        self.assertListEqual([], soap_port_mapping_list(None))
+        self.assertListEqual([], soap_port_mapping_list(''))
+        self.assertListEqual([], soap_port_mapping_list(port_mapping_list([])))
+
+    def test_malformed_listing(self):
+        with self.assertRaises(Exception):
+            decode_port_mapping_list(port_mapping_list([port_mapping_entry(2345)])[:-20], PORT_MAPPING_LIST_FIELDS)
+
+    def test_recast_listing(self):
+        listing = port_mapping_list([port_mapping_entry(2345)])
+        self.assertListEqual(
+            soap_port_mapping_list(listing),
+            recast_return(typing.List[GetGenericPortMappingEntryResponse], {'NewPortListing': listing},
+                          ['NewPortListing'])
+        )
+
+
+class TestFindEnvelope(unittest.TestCase):
+    head = b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"'
+    old_pattern = re.compile(
+        b"(\\<([^:>]*)\\:Envelope xmlns\\:[^:>]*=\\\"http\\:\\/\\/schemas\\.xmlsoap\\.org\\/soap\\/envelope\\/\\\"(\\s*.)*\\>)"
+    )
+
+    def test_replayed_responses_match_the_old_regex(self):
+        replays_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replays")
+        responses = [TestSOAPSerialization.post_response, TestSOAPSerialization.error_response]
+        for name in os.listdir(replays_dir):
+            with open(os.path.join(replays_dir, name), 'r') as f:
+                gateway_info = json.loads(f.read())['gateway']
+            for requests in gateway_info['soap_requests'].values():
+                responses.extend(response.encode() for _, response in requests)
+        for response in responses:
+            parsed = self.old_pattern.findall(response)
+            self.assertEqual(b'' if not parsed else parsed[0][0], find_envelope(response), response)
+
+    def test_envelope_bounds(self):
+        envelope = self.head + b'><s:Body/></s:Envelope>'
+        self.assertEqual(envelope, find_envelope(b'<?xml version="1.0"?>\n' + envelope + b'\n'))
+        self.assertEqual(envelope, find_envelope(envelope + b'\r\n0\r\n'))
+        self.assertEqual(b'', find_envelope(b''))
+        self.assertEqual(b'', find_envelope(b'<s:Body></s:Body>'))
+        self.assertEqual(b'', find_envelope(self.head))
+        self.assertEqual(b'', find_envelope(self.head.replace(b'soap/envelope', b'soap/other')))
+        self.assertEqual(b'', find_envelope(b'<' + b's' * 65 + self.head[2:] + b'></s:Envelope>'))
+
+    def test_malformed_responses_are_linear(self):
+        size = 1024 * 1024
+        responses = [
+            self.head + b' ' * size,
+            self.head + b'\n>' * (size // 2),
+            b'<s:Envelope xmlns:' * (size // 18),
+            b'<' * size,
+            b'<' + b's' * size + b':Envelope xmlns:',
+            b'<s:Envelope xmlns:' + b's' * size + b'="http://schemas.xmlsoap.org/soap/envelope/">',
+        ]
+        for response in responses:
+            started = time.perf_counter()
+            find_envelope(response)
+            self.assertLess(time.perf_counter() - started, 1.0)
@@ -1,8 +1,13 @@
+import os
+import re
+import json
+import random
 import unittest
 from collections import OrderedDict
 from aioupnp.serialization.ssdp import SSDPDatagram
 from aioupnp.fault import UPnPError
-from aioupnp.constants import UPNP_ORG_IGD
+from aioupnp.constants import UPNP_ORG_IGD, line_separator
+from aioupnp.protocols.m_search_patterns import packet_generator
 
 
 class TestSSDPDatagram(unittest.TestCase):
@@ -323,3 +328,92 @@ class TestParseNotify(unittest.TestCase):
         self.assertEqual(packet.nts, 'ssdp:alive')
         self.assertEqual(packet.server, 'LINUX/2.4 UPnP/1.0 BRCM400/1.0')
         self.assertEqual(packet.usn, 'uuid:000c-29ea-247500c00068::upnp:rootdevice')
+
+
+class TestHeaderDecoderMatchesRegexDecoder(unittest.TestCase):
+    """
+    Differential test of the single pass header decoder against the regex based decoder it replaced
+    """
+
+    @staticmethod
+    def regex_lines_to_content_dict(lines):
+        def compile_find(pattern):
+            p = re.compile(pattern)
+
+            def find(line):
+                result = []
+                for outer in p.findall(line):
+                    result.append([])
+                    for inner in outer:
+                        result[-1].append(inner)
+                if result:
+                    return result[-1][-1].lstrip(" ").rstrip(" ")
+                return None
+            return find
+
+        template = "(?i)^(%s):[ ]*(.*)$"
+        patterns = {
+            'host': compile_find("(?i)^(host):(.*)$"),
+            'st': compile_find(template % 'st'),
+            'man': compile_find(template % 'man'),
+            'mx': compile_find(template % 'mx'),
+            'nt': compile_find(template % 'nt'),
+            'nts': compile_find(template % 'nts'),
+            'usn': compile_find(template % 'usn'),
+            'location': compile_find(template % 'location'),
+            'cache_control': compile_find(template % 'cache[-|_]control'),
+            'server': compile_find(template % 'server'),
+        }
+        result = OrderedDict()
+        matched_keys = []
+        for line in lines:
+            if not line:
+                continue
+            for name, pattern in patterns.items():
+                if name not in matched_keys:
+                    match = pattern(line)
+                    if match is not None:
+                        result[line[:len(name)]] = int(match) if name == 'mx' else match
+                        matched_keys.append(name)
+                        break
+        return result
+
+    def assertDecodesLikeRegex(self, lines):
+        self.assertEqual(
+            list(self.regex_lines_to_content_dict(lines).items()),
+            list(SSDPDatagram._lines_to_content_dict(lines).items()), lines
+        )
+
+    def test_replayed_datagrams(self):
+        replays_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replays")
+        for name in os.listdir(replays_dir):
+            with open(os.path.join(replays_dir, name), 'r') as f:
+                gateway_info = json.loads(f.read())['gateway']
+            for packet_type, args in (("OK", gateway_info['reply']), ("M-SEARCH", gateway_info['m_search_args'])):
+                self.assertDecodesLikeRegex(SSDPDatagram(packet_type, args).encode().split(line_separator))
+        for args in packet_generator():
+            self.assertDecodesLikeRegex(SSDPDatagram("M-SEARCH", args).encode().split(line_separator))
+
+    def test_edge_cases(self):
+        self.assertDecodesLikeRegex([
+            'HTTP/1.1 200 OK', 'CACHE-CONTROL:max-age=1800', 'cache_control: 5', 'Cache|Control: 6',
+            'ST: a', 'st: b', 'HOST:  239.255.255.250:1900 ', ' USN: x', 'USN : y', 'usn:', 'EXT:', 'DATE: now',
+            'Location: http://10.0.0.1:80/a\n', 'Server: a\nb', 'nts: x', 'NT: y', 'MX:\t3', 'mx: 4',
+            'ſERVER: folded', 'LOCATİON: dotted', ':', '', 'no colon'
+        ])
+
+    def test_fuzzed_lines(self):
+        rand = random.Random(5)
+        names = ['host', 'st', 'man', 'mx', 'nt', 'nts', 'usn', 'location', 'cache-control', 'cache_control',
+                 'server', 'date', 'ext', 'stx', 's', '']
+        values = ['', ' ', '1', ' 2 ', 'ssdp:discover', '"ssdp:discover"', 'http://10.0.0.1:49152/a.xml',
+                  'a:b:c', '  x  y  ', 'v\n', 'v\nw', '\tq']
+        for _ in range(2000):
+            lines = []
+            for _ in range(rand.randint(0, 12)):
+                name = ''.join(c.upper() if rand.random() < 0.5 else c for c in rand.choice(names))
+                value = rand.choice(values)
+                if name.lower() == 'mx':
+                    value = rand.choice(['1', ' 5', '120 '])
+                lines.append(name + rand.choice([':', ': ', ' :', '']) + value)
+            self.assertDecodesLikeRegex(lines)
@@ -0,0 +1,104 @@
+import os
+import json
+import typing
+import unittest
+from aioupnp.cache import ParseCache
+from aioupnp.constants import UPNP_NAMESPACES
+from aioupnp.serialization.scpd import find_xml_content, deserialize_scpd_get_response
+from aioupnp.serialization.soap import deserialize_soap_post_response, decode_soap_post_response_fields
+from aioupnp.serialization.xml import XML_BACKENDS, get_xml_backend, set_xml_backend, xml_to_local_dict
+from aioupnp.serialization.xml import XMLStreamParser
+
+PARSE_FAILED = object()
+
+
+def load_replays() -> typing.List[typing.Dict[str, typing.Any]]:
+    replays_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replays")
+    replays = []
+    for name in sorted(os.listdir(replays_dir)):
+        with open(os.path.join(replays_dir, name), 'r') as f:
+            replays.append(json.loads(f.read())['gateway'])
+    return replays
+
+
+class XMLBackendTestCase(unittest.TestCase):
+    def use_backend(self, name: str) -> None:
+        self.addCleanup(set_xml_backend, get_xml_backend())
+        set_xml_backend(name)
+
+    def parse_with_each_backend(self, fn: typing.Callable[[], typing.Any]) -> typing.Dict[str, typing.Any]:
+        results = {}
+        previous = get_xml_backend()
+        try:
+            for name in XML_BACKENDS:
+                set_xml_backend(name)
+                try:
+                    results[name] = fn()
+                except Exception:
+                    results[name] = PARSE_FAILED
+        finally:
+            set_xml_backend(previous)
+        return results
+
+
+@unittest.skipIf('lxml' not in XML_BACKENDS, "lxml is not installed")
+class TestBackendsAgree(XMLBackendTestCase):
+    def assertBackendsAgree(self, fn: typing.Callable[[], typing.Any]) -> None:
+        results = self.parse_with_each_backend(fn)
+        self.assertEqual(results['defusedxml'], results['lxml'])
+        self.assertIsNot(PARSE_FAILED, results['lxml'])
+
+    def test_replayed_descriptors(self):
+        for gateway_info in load_replays():
+            for response in [gateway_info['gateway_xml']] + list(gateway_info['service_descriptors'].values()):
+                body = response.split('\r\n\r\n', 1)[1].encode()
+                self.assertBackendsAgree(lambda: xml_to_local_dict(find_xml_content(body).decode(), UPNP_NAMESPACES))
+                self.assertBackendsAgree(lambda: deserialize_scpd_get_response(body, ParseCache(0)))
+
+                def stream() -> typing.Optional[typing.Dict[str, typing.Any]]:
+                    parser = XMLStreamParser(UPNP_NAMESPACES)
+                    for i in range(0, len(body), 64):
+                        parser.feed(body[i:i + 64])
+                    return parser.close()
+                self.assertBackendsAgree(stream)
+
+    def test_replayed_soap_responses(self):
+        for gateway_info in load_replays():
+            for method, requests in gateway_info['soap_requests'].items():
+                service_id = gateway_info['registered_soap_commands'][method]
+                for _, response in requests:
+                    results = self.parse_with_each_backend(
+                        lambda: deserialize_soap_post_response(response.encode(), method, service_id)
+                    )
+                    self.assertEqual(results['defusedxml'], results['lxml'])
+                    fields = {'NewExternalIPAddress': 0, 'NewExternalPort': 1, 'NewInternalClient': 2}
+                    self.assertBackendsAgree(
+                        lambda: decode_soap_post_response_fields(response.encode(), method, fields)
+                    )
+
+
+class TestBackendsAreHardened(XMLBackendTestCase):
+    documents = [
+        b'<?xml version="1.0"?>\n<!DOCTYPE root [<!ENTITY a "aaaaaaaaaa"><!ENTITY b "&a;&a;&a;&a;&a;&a;">]>\n'
+        b'<root xmlns="urn:schemas-upnp-org:device-1-0"><a>&b;</a></root>',
+        b'<?xml version="1.0"?>\n<!DOCTYPE root [<!ENTITY a SYSTEM "file:///etc/passwd">]>\n'
+        b'<root xmlns="urn:schemas-upnp-org:device-1-0"><a>&a;</a></root>',
+    ]
+
+    def test_entities_are_refused(self):
+        for name in XML_BACKENDS:
+            self.use_backend(name)
+            for document in self.documents:
+                with self.assertRaises(ValueError):
+                    xml_to_local_dict(document.decode(), UPNP_NAMESPACES)
+                parser = XMLStreamParser(UPNP_NAMESPACES)
+                parser.feed(document)
+                with self.assertRaises(ValueError):
+                    parser.close()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            set_xml_backend('derp')
+
+    def test_defusedxml_is_the_default(self):
+        self.assertEqual('defusedxml', get_xml_backend())
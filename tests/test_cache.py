@@ -0,0 +1,213 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+from aioupnp import gateway
+from aioupnp.cache import DiscoveryCache, ParseCache, PARSE_CACHE
+from aioupnp.serialization.scpd import deserialize_scpd_get_response, DescriptorStreamParser
+from aioupnp.serialization.ssdp import SSDPDatagram
+from aioupnp.upnp import UPnP
+from tests import AsyncioTestCase, mock_tcp_and_udp
+
+
+class GatewayReplayTestCase(AsyncioTestCase):
+    name = "Actiontec GT784WN"
+
+    def setUp(self) -> None:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "replays", self.name), 'r') as f:
+            data = json.loads(f.read())
+            self.gateway_info = data['gateway']
+            self.client_address = data['client_address']
+        self.gateway_address = self.gateway_info['gateway_address']
+        self.udp_replies = {
+            (SSDPDatagram('M-SEARCH', self.gateway_info['m_search_args']).encode().encode(),
+             ("239.255.255.250", 1900)): SSDPDatagram("OK", self.gateway_info['reply']).encode().encode()
+        }
+        location = self.gateway_info['reply']['Location'].split(
+            f"{self.gateway_address}:{self.gateway_info['soap_port']}"
+        )[-1]
+        self.tcp_replies = {
+            self._get_request(path): xml_bytes.encode()
+            for path, xml_bytes in self.gateway_info['service_descriptors'].items()
+        }
+        self.tcp_replies[self._get_request(location)] = self.gateway_info['gateway_xml'].encode()
+        self.description_request = self._get_request(location)
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_path = os.path.join(tmp_dir.name, "gateways.json")
+        super().setUp()
+
+    def _get_request(self, path: str) -> bytes:
+        return (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Accept-Encoding: gzip\r\n"
+            f"Host: {self.gateway_address}\r\n"
+            f"Connection: Close\r\n"
+            f"\r\n"
+        ).encode()
+
+    async def _discover(self, udp_replies, tcp_replies, sent_tcp_packets=None, sent_udp_packets=None) -> UPnP:
+        with mock_tcp_and_udp(self.loop, udp_replies=udp_replies, tcp_replies=tcp_replies,
+                              udp_expected_addr=self.gateway_address, sent_tcp_packets=sent_tcp_packets,
+                              sent_udp_packets=sent_udp_packets):
+            return await UPnP.discover(
+                self.client_address, self.gateway_address, loop=self.loop, cache_path=self.cache_path
+            )
+
+
+
+class TestDiscoveryCache(GatewayReplayTestCase):
+    async def test_warm_start_from_cache(self):
+        discovered = await self._discover(self.udp_replies, self.tcp_replies)
+        entry = DiscoveryCache(self.cache_path).get('default', self.client_address, self.gateway_address)
+        self.assertDictEqual(discovered.gateway._registered_commands, entry['registered_soap_commands'])
+
+        sent_tcp_packets, sent_udp_packets = [], []
+        cached = await self._discover({}, self.tcp_replies, sent_tcp_packets, sent_udp_packets)
+        self.assertListEqual([], sent_udp_packets)
+        self.assertListEqual([self.description_request], sent_tcp_packets)
+        self.assertDictEqual(discovered.gateway._registered_commands, cached.gateway._registered_commands)
+        self.assertDictEqual(
+            {k: v for k, v in discovered.gateway.debug_gateway().items() if k != 'soap_requests'},
+            {k: v for k, v in cached.gateway.debug_gateway().items() if k != 'soap_requests'}
+        )
+
+    async def test_fall_back_to_discovery_when_validation_fails(self):
+        cache = DiscoveryCache(self.cache_path)
+        await self._discover(self.udp_replies, self.tcp_replies)
+        entry = cache.get('default', self.client_address, self.gateway_address)
+        entry['gateway_xml'] = entry['gateway_xml'].replace('Actiontec', 'Other Vendor')
+        cache.set('default', self.client_address, self.gateway_address, entry)
+
+        sent_udp_packets = []
+        u = await self._discover(self.udp_replies, self.tcp_replies, sent_udp_packets=sent_udp_packets)
+        self.assertTrue(sent_udp_packets)
+        self.assertEqual(self.gateway_info['gateway_xml'], u.gateway.get_cache_entry()['gateway_xml'])
+        self.assertDictEqual(
+            u.gateway.get_cache_entry(), cache.get('default', self.client_address, self.gateway_address)
+        )
+
+    async def test_fall_back_to_discovery_when_gateway_is_unreachable(self):
+        cache = DiscoveryCache(self.cache_path)
+        await self._discover(self.udp_replies, self.tcp_replies)
+        for error in (OSError(113, "No route to host"), asyncio.TimeoutError()):
+            async def from_cache_entry(*args, **kwargs):
+                raise error
+
+            sent_udp_packets = []
+            with mock.patch.object(gateway.Gateway, 'from_cache_entry', from_cache_entry):
+                u = await self._discover(self.udp_replies, self.tcp_replies, sent_udp_packets=sent_udp_packets)
+            self.assertTrue(sent_udp_packets)
+            self.assertDictEqual(
+                u.gateway.get_cache_entry(), cache.get('default', self.client_address, self.gateway_address)
+            )
+
+    def test_ignore_unreadable_cache(self):
+        with open(self.cache_path, 'w') as f:
+            f.write("not json")
+        cache = DiscoveryCache(self.cache_path)
+        self.assertIsNone(cache.get('default', self.client_address, self.gateway_address))
+        cache.set('default', self.client_address, self.gateway_address, {'reply': {}})
+        self.assertDictEqual({'reply': {}}, cache.get('default', self.client_address, self.gateway_address))
+        self.assertIsNone(cache.get('eth1', self.client_address, self.gateway_address))
+
+    async def test_lead_with_learned_m_search_variant(self):
+        cache = DiscoveryCache(self.cache_path)
+        await self._discover(self.udp_replies, self.tcp_replies)
+        self.assertDictEqual(
+            {self.gateway_info['reply']['Server']: self.gateway_info['m_search_args']},
+            cache.get_m_search_preferences()
+        )
+        cache.remove('default', self.client_address, self.gateway_address)
+
+        sent_udp_packets = []
+        u = await self._discover(self.udp_replies, self.tcp_replies, sent_udp_packets=sent_udp_packets)
+        self.assertEqual(self.gateway_info['m_search_args'], u.gateway.m_search_args)
+        self.assertListEqual(
+            [SSDPDatagram('M-SEARCH', self.gateway_info['m_search_args']).encode().encode()] * 2, sent_udp_packets
+        )
+
+
+class TestParseCache(unittest.TestCase):
+    def test_lru_size_bound_and_counters(self):
+        cache = ParseCache(max_size=2)
+        for document in (b'a', b'b', b'c'):
+            cache.set(document, {document.decode(): 'x'})
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get(b'a'))
+        self.assertDictEqual({'b': 'x'}, cache.get(b'b'))
+        cache.set(b'd', {'d': 'x'})
+        self.assertIsNone(cache.get(b'c'))
+        self.assertDictEqual({'b': 'x'}, cache.get(b'b'))
+        self.assertEqual((2, 2), (cache.hits, cache.misses))
+        self.assertTrue(cache.may_contain(b'd'))
+        self.assertFalse(cache.may_contain(b'c'))
+
+    def test_action_lists(self):
+        cache = ParseCache()
+        cache.set_action_list(b'a', [('GetExternalIPAddress', [], ['NewExternalIPAddress'])])
+        self.assertIsNone(cache.get_action_list(b'a'))
+        cache.set(b'a', {})
+        cache.set_action_list(b'a', [('GetExternalIPAddress', [], ['NewExternalIPAddress'])])
+        self.assertListEqual([('GetExternalIPAddress', [], ['NewExternalIPAddress'])], cache.get_action_list(b'a'))
+
+    def test_identical_documents_are_parsed_once(self):
+        cache = ParseCache()
+        body = TestSCPDStreamParser.body
+        self.assertDictEqual(deserialize_scpd_get_response(body, cache), deserialize_scpd_get_response(body, cache))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+
+class TestSCPDStreamParser(unittest.TestCase):
+    body = b'<?xml version="1.0"?>\r\n<root xmlns="urn:schemas-upnp-org:device-1-0">' + b' ' * 1024 + \
+           b'<specVersion><major>1</major><minor>0</minor></specVersion></root>\r\n'
+
+    def parse(self, cache: ParseCache, body: bytes):
+        parser = DescriptorStreamParser(cache)
+        for i in range(0, len(body), 100):
+            parser.feed(body[i:i + 100])
+        return parser.close(body)
+
+    def test_cached_document_is_looked_up_when_complete(self):
+        cache = ParseCache()
+        cache.set(self.body, {'cached': 'document'})
+        self.assertDictEqual({'cached': 'document'}, self.parse(cache, self.body))
+        self.assertEqual((1, 0), (cache.hits, cache.misses))
+
+    def test_document_with_a_cached_prefix(self):
+        cache = ParseCache()
+        cache.set(self.body, {'cached': 'document'})
+        other = self.body.replace(b'<minor>0</minor>', b'<minor>1</minor>')
+        expected = {'{urn:schemas-upnp-org:device-1-0}root': {'specVersion': {'major': '1', 'minor': '1'}}}
+        self.assertDictEqual(expected, self.parse(cache, other))
+        self.assertDictEqual(expected, self.parse(cache, other))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_body_is_not_kept(self):
+        for cached in (False, True):
+            cache = ParseCache()
+            if cached:
+                cache.set(self.body, {'cached': 'document'})
+            parser = DescriptorStreamParser(cache)
+            for i in range(0, len(self.body), 100):
+                parser.feed(self.body[i:i + 100])
+                self.assertLessEqual(len(parser._head), cache.prefix_size)
+            self.assertIsNotNone(parser.close(self.body))
+
+
+class TestDiscoveryParseCache(GatewayReplayTestCase):
+    async def test_rediscovery_parses_nothing(self):
+        PARSE_CACHE.clear()
+        self.addCleanup(PARSE_CACHE.clear)
+        first = await self._discover(self.udp_replies, self.tcp_replies)
+        documents = len(self.tcp_replies)
+        self.assertEqual(documents, len(PARSE_CACHE))
+        self.assertEqual((0, documents), (PARSE_CACHE.hits, PARSE_CACHE.misses))
+
+        os.remove(self.cache_path)
+        with mock.patch.object(gateway, 'get_action_list', side_effect=AssertionError("parsed again")):
+            second = await self._discover(self.udp_replies, self.tcp_replies)
+        self.assertEqual((documents, documents), (PARSE_CACHE.hits, PARSE_CACHE.misses))
+        self.assertDictEqual(first.gateway._registered_commands, second.gateway._registered_commands)
@@ -1,5 +1,6 @@
 import unittest
 from aioupnp.device import CaseInsensitive
+from aioupnp.util import CaseInsensitiveDict
 
 
 class _TestService(CaseInsensitive):
@@ -43,3 +44,55 @@ class TestCaseInsensitive(unittest.TestCase):
         self.assertEqual('foo', getattr(s, 'serviceType'))
         self.assertEqual('foo', getattr(s, 'servicetype'))
         self.assertEqual('foo', getattr(s, 'SERVICETYPE'))
+
+    def test_unset_attribute_defaults(self):
+        s = _TestService(serviceType="test")
+        self.assertIsNone(s.serviceId)
+        self.assertIsNone(s.SERVICEID)
+        self.assertDictEqual({'serviceType': 'test'}, s.as_dict())
+
+    def test_extra_attributes(self):
+        s = _TestService(serviceType="test", vendorField="x")
+        self.assertEqual('x', s.vendorField)
+        with self.assertRaises(AttributeError):
+            getattr(s, 'derp')
+        with self.assertRaises(AttributeError):
+            setattr(s, '_derp', 'x')
+        self.assertDictEqual({'serviceType': 'test', 'vendorField': 'x'}, s.as_dict())
+
+    def test_slots(self):
+        s = _TestService(serviceType="test")
+        self.assertFalse(hasattr(s, '__dict__'))
+        self.assertDictEqual(
+            {'servicetype': 'serviceType', 'serviceid': 'serviceId', 'controlurl': 'controlURL',
+             'eventsuburl': 'eventSubURL', 'scpdurl': 'SCPDURL'},
+            _TestService._attribute_names
+        )
+
+
+class TestCaseInsensitiveDict(unittest.TestCase):
+    def test_lookup(self):
+        headers = CaseInsensitiveDict([(b'Content-Length', b'10'), (b'SERVER', b'derp')])
+        self.assertEqual(b'10', headers[b'content-length'])
+        self.assertEqual(b'derp', headers.get(b'Server'))
+        self.assertIsNone(headers.get(b'Connection'))
+        self.assertIn(b'CONTENT-LENGTH', headers)
+        self.assertNotIn('content-length', CaseInsensitiveDict({'Content-Type': 'text/xml'}))
+        with self.assertRaises(KeyError):
+            headers[b'connection']
+
+    def test_keeps_original_keys(self):
+        headers = CaseInsensitiveDict({'Content-Length': '10', 'SERVER': 'derp'})
+        self.assertEqual(['Content-Length', 'SERVER'], list(headers))
+        self.assertDictEqual({'Content-Length': '10', 'SERVER': 'derp'}, dict(headers))
+        del headers['server']
+        self.assertEqual(1, len(headers))
+
+    def test_overlapping_keys(self):
+        headers = CaseInsensitiveDict({'Content-Length': '10'})
+        headers['Content-Length'] = '11'
+        self.assertEqual('11', headers['content-length'])
+        with self.assertRaises(KeyError):
+            headers['content-length'] = '12'
+        with self.assertRaises(KeyError):
+            CaseInsensitiveDict({'device': {}, 'Device': {}})
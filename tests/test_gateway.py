@@ -3,7 +3,9 @@ import json
 from collections import OrderedDict
 from aioupnp.fault import UPnPError
 from tests import AsyncioTestCase, mock_tcp_and_udp
-from aioupnp.gateway import Gateway, get_action_list
+from aioupnp.gateway import Gateway, get_action_list, get_probe_priority
+from aioupnp.constants import SSDP_IP_ADDRESS, UPNP_ORG_IGD
+from aioupnp.protocols.m_search_patterns import packet_generator
 from aioupnp.serialization.ssdp import SSDPDatagram
 from aioupnp.serialization.soap import serialize_soap_post
 from aioupnp.upnp import UPnP
@@ -144,6 +146,37 @@ class TestParseActionList(AsyncioTestCase):
                     ('GetExternalIPAddress', [], ['NewExternalIPAddress'])]
         self.assertEqual(expected, get_action_list(self.test_action_list))
 
+    def test_parse_single_action(self):
+        action_list = {'actionList': {'action': {'name': 'GetExternalIPAddress', 'argumentList': {'argument': {
+            'name': 'NewExternalIPAddress', 'direction': 'out', 'relatedStateVariable': 'ExternalIPAddress'
+        }}}}}
+        self.assertEqual([('GetExternalIPAddress', [], ['NewExternalIPAddress'])], get_action_list(action_list))
+        self.assertEqual([('ForceTermination', [], [])],
+                         get_action_list({'actionList': {'action': {'name': 'ForceTermination'}}}))
+        self.assertEqual([], get_action_list({'actionList': ''}))
+
+
+class TestProbePriority(AsyncioTestCase):
+    def test_probe_priority(self):
+        def datagram(st):
+            return SSDPDatagram("OK", OrderedDict([
+                ('Cache_Control', 'max-age=1800'), ('Location', 'http://10.0.0.1:49152/rootDesc.xml'),
+                ('Server', 'Linux UPnP/1.0'), ('ST', st), ('USN', 'uuid:0::%s' % st)
+            ]))
+
+        sts = [
+            'upnp:rootdevice',
+            'urn:schemas-upnp-org:device:WANDevice:1',
+            'urn:schemas-upnp-org:service:WANIPConnection:1',
+            UPNP_ORG_IGD,
+        ]
+        ranked = sorted(sts, key=lambda st: get_probe_priority(datagram(st)))
+        self.assertEqual(ranked[-1], 'upnp:rootdevice')
+        self.assertEqual(ranked[-2], 'urn:schemas-upnp-org:device:WANDevice:1')
+        self.assertEqual(
+            set(ranked[:2]), {'urn:schemas-upnp-org:service:WANIPConnection:1', UPNP_ORG_IGD}
+        )
+
 
 class TestDiscoverDLinkDIR890L(AsyncioTestCase):
     gateway_info = \
@@ -249,6 +282,111 @@ class TestDiscoverDLinkDIR890L(AsyncioTestCase):
             self.assertDictEqual(self.gateway_info['registered_soap_commands'], gateway._registered_commands)
             self.assertDictEqual(gateway.debug_gateway(), self.gateway_info)
 
+    async def test_compiled_command_index(self):
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
+            gateway = Gateway(
+                SSDPDatagram("OK", self.gateway_info['reply']),
+                self.client_address, self.gateway_info['gateway_address'], loop=self.loop
+            )
+            await gateway.discover_commands()
+        for name, service_type in self.gateway_info['registered_soap_commands'].items():
+            command = gateway.commands.get_command(name)
+            self.assertTrue(gateway.commands.is_registered(name))
+            self.assertIs(command.service, gateway.commands.get_service(name))
+            self.assertIs(command.service, gateway.services[service_type])
+            self.assertEqual(command.service.controlURL, command.control_url)
+            self.assertEqual(name != 'GetExternalIPAddress', command.takes_arguments)
+        self.assertEqual(
+            ['NewRemoteHost', 'NewExternalPort', 'NewProtocol'],
+            gateway.commands.get_command('DeletePortMapping').inputs
+        )
+        with self.assertRaises(ValueError):
+            gateway.commands.get_command('SetConnectionType')
+
+    async def test_device_tree_indexes_are_cached(self):
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
+            gateway = Gateway(
+                SSDPDatagram("OK", self.gateway_info['reply']),
+                self.client_address, self.gateway_info['gateway_address'], loop=self.loop
+            )
+            self.assertDictEqual({}, gateway.services)
+            await gateway.discover_commands()
+            services, devices = gateway.services, gateway.devices
+            self.assertTrue(services)
+            self.assertTrue(devices)
+            self.assertIs(services, gateway.services)
+            self.assertIs(devices, gateway.devices)
+            gateway._device_tree_changed()
+            self.assertIsNot(services, gateway.services)
+            self.assertDictEqual(services, gateway.services)
+            self.assertDictEqual(devices, gateway.devices)
+
+    def test_description_keys_differing_by_case(self):
+        gateway = Gateway(
+            SSDPDatagram("OK", self.gateway_info['reply']),
+            self.client_address, self.gateway_info['gateway_address'], loop=self.loop
+        )
+        gateway._load_device_description({
+            'specVersion': {'major': '1', 'minor': '0'}, 'URLBase': 'http://10.0.0.1:5000',
+            'extra': 'a', 'EXTRA': 'b', 'device': {'deviceType': 'urn:schemas-upnp-org:device:InternetGatewayDevice:1'}
+        })
+        self.assertEqual('http://10.0.0.1:5000', gateway.url_base)
+        self.assertEqual('urn:schemas-upnp-org:device:InternetGatewayDevice:1', gateway._device.deviceType)
+
+    def _m_search_replies(self, st_and_locations):
+        replies = {}
+        for st, location in st_and_locations:
+            args = [args for args in packet_generator() if args['ST'] == st][0]
+            reply = SSDPDatagram("OK", self.gateway_info['reply'])
+            reply.st, reply.location = st, location
+            replies[(SSDPDatagram("M-SEARCH", args).encode().encode(), (SSDP_IP_ADDRESS, 1900))] = \
+                reply.encode().encode()
+        return replies
+
+    async def _timed_discover(self, udp_replies, max_concurrent_probes):
+        with mock_tcp_and_udp(self.loop, udp_replies=udp_replies, tcp_replies=self.replies,
+                              udp_expected_addr=self.gateway_info['gateway_address']):
+            started = self.loop.time()
+            gateway = await Gateway.discover_gateway(
+                self.client_address, self.gateway_info['gateway_address'], 3, loop=self.loop,
+                max_concurrent_probes=max_concurrent_probes
+            )
+            return gateway, self.loop.time() - started
+
+    async def test_discover_gateway_probe_order(self):
+        dead_location = f"{self.gateway_info['urlBase']}/not_a_gateway.xml"
+        udp_replies = self._m_search_replies([
+            ('upnp:rootdevice', dead_location),
+            (UPNP_ORG_IGD, self.gateway_info['location'])
+        ])
+        gateway, elapsed = await self._timed_discover(udp_replies, 1)
+        self.assertEqual(self.gateway_info['location'], gateway.location.decode())
+        self.assertLess(elapsed, 1.0)
+
+    async def test_discover_gateway_concurrent_probes(self):
+        dead_location = f"{self.gateway_info['urlBase']}/not_a_gateway.xml"
+        udp_replies = self._m_search_replies([
+            (UPNP_ORG_IGD, dead_location),
+            ('urn:schemas-upnp-org:service:WANIPConnection:1', self.gateway_info['location'])
+        ])
+        gateway, elapsed = await self._timed_discover(udp_replies, 2)
+        self.assertEqual(self.gateway_info['location'], gateway.location.decode())
+        self.assertLess(elapsed, 1.0)
+
+    async def test_discover_commands_concurrency_limit(self):
+        registered_orders = []
+        for max_concurrent_requests in (1, 2, 6):
+            with mock_tcp_and_udp(self.loop, tcp_replies=self.replies, tcp_delay_reply=0.01):
+                gateway = Gateway(
+                    SSDPDatagram("OK", self.gateway_info['reply']),
+                    self.client_address, self.gateway_info['gateway_address'], loop=self.loop
+                )
+                await gateway.discover_commands(max_concurrent_requests)
+                self.assertDictEqual(gateway.debug_gateway(), self.gateway_info)
+                registered_orders.append(list(gateway._registered_commands.items()))
+        self.assertEqual(registered_orders[0], registered_orders[1])
+        self.assertEqual(registered_orders[0], registered_orders[2])
+
 
 class TestDiscoverNetgearNighthawkAC2350(TestDiscoverDLinkDIR890L):
     gateway_info = {'manufacturer_string': 'NETGEAR NETGEAR Nighthawk X4 AC2350 Smart WiFi Router',
@@ -352,7 +490,8 @@ class TestActiontec(AsyncioTestCase):
             self.tcp_replies.update({
                 serialize_soap_post(
                     method, list(args.keys()), self.registered_soap_commands[method].encode(),
-                    self.gateway_address.encode(), u.gateway.services[self.registered_soap_commands[method]].controlURL.encode()
+                    self.gateway_address.encode(), u.gateway.services[self.registered_soap_commands[method]].controlURL.encode(),
+                    keep_alive=True
                 ): response.encode() for args, response in reqs
             })
 
@@ -0,0 +1,164 @@
+import asyncio
+import unittest
+from aioupnp.fault import UPnPError
+from aioupnp.commands import GetGenericPortMappingEntryResponse
+from aioupnp.mappings import PortMappingTable, FetchWindow, walk_mapping_table, port_probe_sequence
+from tests import AsyncioTestCase
+
+
+def make_mapping(external_port: int, protocol: str = 'UDP') -> GetGenericPortMappingEntryResponse:
+    return GetGenericPortMappingEntryResponse(
+        '', external_port, protocol, external_port, '10.0.0.2', True, 'test', 0
+    )
+
+
+class TestPortMappingTable(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.table = PortMappingTable(10.0, clock=lambda: self.now)
+
+    def test_ttl(self):
+        self.assertFalse(self.table.is_fresh)
+        self.table.load([make_mapping(1000)])
+        self.assertTrue(self.table.is_fresh)
+        self.now = 9.9
+        self.assertTrue(self.table.is_fresh)
+        self.now = 10.0
+        self.assertFalse(self.table.is_fresh)
+        self.table.load([])
+        self.assertTrue(self.table.is_fresh)
+        self.table.invalidate()
+        self.assertFalse(self.table.is_fresh)
+
+    def test_updates(self):
+        self.table.add(make_mapping(999))
+        self.assertEqual(0, len(self.table))
+        self.table.load([make_mapping(1000), make_mapping(1000, 'TCP')])
+        self.table.add(make_mapping(1001))
+        self.assertEqual(make_mapping(1000, 'TCP'), self.table.get(1000, 'tcp'))
+        self.assertIn((1001, 'UDP'), self.table)
+        self.assertNotIn((1001, 'TCP'), self.table)
+        self.table.remove(1000, 'UDP')
+        self.table.remove(1002, 'UDP')
+        self.assertListEqual([make_mapping(1000, 'TCP'), make_mapping(1001)], self.table.mappings())
+
+
+class TestFetchWindow(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.window = FetchWindow(2, 8, clock=lambda: self.now)
+
+    def complete(self, count: int, elapsed: float) -> None:
+        for _ in range(count):
+            self.now += elapsed / count
+            self.window.completed()
+
+    def test_grows_while_the_rate_improves(self):
+        self.window.start()
+        self.complete(4, 0.04)
+        self.assertEqual(4, self.window.size)
+        self.complete(8, 0.04)
+        self.assertEqual(8, self.window.size)
+        self.complete(16, 0.08)
+        self.assertEqual(8, self.window.size)
+        self.complete(16, 0.16)
+        self.assertEqual(4, self.window.size)
+
+    def test_failures_cap_the_size(self):
+        self.window.start()
+        self.complete(4, 0.04)
+        self.window.failed()
+        self.assertEqual(2, self.window.size)
+        self.complete(4, 0.04)
+        self.complete(4, 0.01)
+        self.assertEqual(2, self.window.size)
+        self.window.failed()
+        self.window.failed()
+        self.assertEqual(1, self.window.size)
+
+
+class TestPortProbeSequence(unittest.TestCase):
+    def test_requested_port_first(self):
+        self.assertEqual(80, next(port_probe_sequence(80, 'seed')))
+        self.assertEqual(4567, next(port_probe_sequence(4567, 'seed')))
+
+    def test_covers_the_range_once(self):
+        ports = list(port_probe_sequence(5000, 'seed', low=4000, high=4999))
+        self.assertEqual(5000, ports[0])
+        self.assertListEqual(list(range(4000, 5000)), sorted(ports[1:]))
+        ports = list(port_probe_sequence(4500, 'seed', low=4000, high=4999))
+        self.assertListEqual(list(range(4000, 5000)), sorted(ports))
+
+    def test_seeded(self):
+        first = list(zip(range(16), port_probe_sequence(4567, '10.0.0.2|UDP|4567|test')))
+        self.assertListEqual(first, list(zip(range(16), port_probe_sequence(4567, '10.0.0.2|UDP|4567|test'))))
+        self.assertNotEqual(first, list(zip(range(16), port_probe_sequence(4567, '10.0.0.3|UDP|4567|test'))))
+
+
+class MockMappingTable:
+    def __init__(self, loop: asyncio.AbstractEventLoop, size: int, max_concurrent: int = 0,
+                 end_error: str = 'SpecifiedArrayIndexInvalid', latency: float = 0.001) -> None:
+        self.loop = loop
+        self.latency = latency
+        self.entries = [make_mapping(1000 + i) for i in range(size)]
+        self.max_concurrent = max_concurrent
+        self.end_error = end_error
+        self.requested = []
+        self.in_flight = 0
+
+    async def fetch(self, index: int) -> GetGenericPortMappingEntryResponse:
+        self.requested.append(index)
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency, loop=self.loop)
+            if self.max_concurrent and self.in_flight > self.max_concurrent:
+                raise UPnPError("Timeout")
+            if index >= len(self.entries):
+                raise UPnPError(self.end_error)
+            return self.entries[index]
+        finally:
+            self.in_flight -= 1
+
+
+class TestWalkMappingTable(AsyncioTestCase):
+    async def test_walk(self):
+        for size in (0, 1, 5, 40):
+            for window_size in (1, 4):
+                table = MockMappingTable(self.loop, size)
+                window = FetchWindow(window_size)
+                self.assertListEqual(table.entries, await walk_mapping_table(table.fetch, window, self.loop))
+                self.assertLessEqual(len(table.requested), size + window.max_size)
+                self.assertListEqual(list(range(size + 1)), sorted(set(table.requested))[:size + 1])
+
+    async def test_serial_walk(self):
+        table = MockMappingTable(self.loop, 5)
+        await walk_mapping_table(table.fetch, FetchWindow(1, 1), self.loop)
+        self.assertListEqual([0, 1, 2, 3, 4, 5], table.requested)
+
+    async def test_concurrency_failures_shrink_window(self):
+        for end_error in ('SpecifiedArrayIndexInvalid', 'Timeout'):
+            window = FetchWindow(8)
+            table = MockMappingTable(self.loop, 30, max_concurrent=2, end_error=end_error)
+            self.assertListEqual(table.entries, await walk_mapping_table(table.fetch, window, self.loop))
+            self.assertLessEqual(window.size, 2)
+
+    async def test_entries_past_the_end_are_dropped(self):
+        table = MockMappingTable(self.loop, 10)
+
+        async def fetch(index: int) -> GetGenericPortMappingEntryResponse:
+            if index == 3:
+                raise UPnPError('NoSuchEntryInArray')
+            return await table.fetch(index)
+
+        self.assertListEqual(table.entries[:3], await walk_mapping_table(fetch, FetchWindow(8), self.loop))
+
+    async def test_other_errors_are_raised(self):
+        table = MockMappingTable(self.loop, 10)
+
+        async def fetch(index: int) -> GetGenericPortMappingEntryResponse:
+            if index == 5:
+                raise NotImplementedError()
+            return await table.fetch(index)
+
+        with self.assertRaises(NotImplementedError):
+            await walk_mapping_table(fetch, FetchWindow(4), self.loop)
@@ -1,10 +1,14 @@
+import asyncio
+from unittest import mock
 from tests import AsyncioTestCase, mock_tcp_and_udp
 from collections import OrderedDict
+from xml.sax.saxutils import escape
 from aioupnp.upnp import UPnP
 from aioupnp.fault import UPnPError
 from aioupnp.gateway import Gateway
 from aioupnp.serialization.ssdp import SSDPDatagram
 from aioupnp.commands import GetSpecificPortMappingEntryResponse, GetGenericPortMappingEntryResponse
+from aioupnp.mappings import port_probe_sequence, PortMappingSpec
 
 
 class UPnPCommandTestCase(AsyncioTestCase):
@@ -41,7 +45,7 @@ class TestGetExternalIPAddress(UPnPCommandTestCase):
     client_address = '11.2.3.222'
 
     async def test_get_external_ip(self):
-        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
+        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
         self.replies.update({request: b"HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:25:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 365 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetExternalIPAddressResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n<NewExternalIPAddress>11.222.3.44</NewExternalIPAddress>\n</u:GetExternalIPAddressResponse>\n\t</s:Body>\n</s:Envelope>\n"})
         self.addCleanup(self.replies.pop, request)
         with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
@@ -52,7 +56,7 @@ class TestGetExternalIPAddress(UPnPCommandTestCase):
             self.assertEqual("11.222.3.44", external_ip)
 
     async def test_handle_got_ipv6(self):
-        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
+        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
         self.replies.update({request: b"HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:25:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 392 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetExternalIPAddressResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n<NewExternalIPAddress>2a02:2e02:30c:db00:4a8d:36ff:feb0:5202</NewExternalIPAddress>\n</u:GetExternalIPAddressResponse>\n\t</s:Body>\n</s:Envelope>\n"})
         self.addCleanup(self.replies.pop, request)
         with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
@@ -64,7 +68,7 @@ class TestGetExternalIPAddress(UPnPCommandTestCase):
                 self.assertTrue(str(err).startswith("Got invalid external ipv4 address"))
 
     async def test_handle_got_invalid_ip(self):
-        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
+        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
         self.replies.update({request: b"HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:25:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 360 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetExternalIPAddressResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n<NewExternalIPAddress>potato</NewExternalIPAddress>\n</u:GetExternalIPAddressResponse>\n\t</s:Body>\n</s:Envelope>\n"})
         self.addCleanup(self.replies.pop, request)
         with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
@@ -76,7 +80,7 @@ class TestGetExternalIPAddress(UPnPCommandTestCase):
                 self.assertTrue(str(err).startswith("Got invalid external ipv4 address"))
 
     async def test_handle_got_carrier_nat_ip(self):
-        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
+        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
         self.replies.update({request: b"HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:25:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 365 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetExternalIPAddressResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n<NewExternalIPAddress>192.88.99.2</NewExternalIPAddress>\n</u:GetExternalIPAddressResponse>\n\t</s:Body>\n</s:Envelope>\n"})
         self.addCleanup(self.replies.pop, request)
         with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
@@ -88,7 +92,7 @@ class TestGetExternalIPAddress(UPnPCommandTestCase):
                 self.assertTrue(str(err).startswith("Got invalid external ipv4 address"))
 
     async def test_null_external_ip(self):
-        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
+        request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
         self.replies.update({
                                 request: b"HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:25:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 354 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetExternalIPAddressResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n<NewExternalIPAddress></NewExternalIPAddress>\n</u:GetExternalIPAddressResponse>\n\t</s:Body>\n</s:Envelope>\n"})
         self.addCleanup(self.replies.pop, request)
@@ -102,7 +106,7 @@ class TestGetExternalIPAddress(UPnPCommandTestCase):
 
 class TestMalformedGetExternalIPAddressResponse(UPnPCommandTestCase):
     client_address = '11.2.3.222'
-    get_ip_request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
+    get_ip_request = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 285\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetExternalIPAddress"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetExternalIPAddress xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"></u:GetExternalIPAddress></s:Body></s:Envelope>\r\n'
 
     async def test_response_key_mismatch(self):
         self.replies.update({self.get_ip_request: b"HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:25:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 333 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetExternalIPAddressResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n"
@@ -140,7 +144,7 @@ class TestMalformedGetExternalIPAddressResponse(UPnPCommandTestCase):
 
 class TestGetGenericPortMappingEntry(UPnPCommandTestCase):
     def setUp(self) -> None:
-        query = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 341\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetGenericPortMappingEntry"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetGenericPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewPortMappingIndex>0</NewPortMappingIndex></u:GetGenericPortMappingEntry></s:Body></s:Envelope>\r\n'
+        query = b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 341\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetGenericPortMappingEntry"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetGenericPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewPortMappingIndex>0</NewPortMappingIndex></u:GetGenericPortMappingEntry></s:Body></s:Envelope>\r\n'
         response = b"HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:25:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 663 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetGenericPortMappingEntryResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n\n<NewRemoteHost></NewRemoteHost>\n<NewExternalPort>9308</NewExternalPort>\n<NewProtocol>UDP</NewProtocol>\n<NewInternalPort>9308</NewInternalPort>\n<NewInternalClient>11.2.3.44</NewInternalClient>\n<NewEnabled>1</NewEnabled>\n<NewPortMappingDescription>11.2.3.44:9308 to 9308 (UDP)</NewPortMappingDescription>\n<NewLeaseDuration>0</NewLeaseDuration>\n</u:GetGenericPortMappingEntryResponse>\n\t</s:Body>\n</s:Envelope>\n"
 
         self.replies.update({
@@ -157,18 +161,38 @@ class TestGetGenericPortMappingEntry(UPnPCommandTestCase):
                                                                 "11.2.3.44:9308 to 9308 (UDP)", 0), result)
 
 
-class TestGetNextPortMapping(UPnPCommandTestCase):
+class PortMappingTestCase(UPnPCommandTestCase):
     client_address = '11.2.3.4'
+    service_type = "urn:schemas-upnp-org:service:WANIPConnection:1"
+    description = "aioupnp test mapping"
 
     def setUp(self) -> None:
         self.replies.update({
-            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 341\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetGenericPortMappingEntry"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetGenericPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewPortMappingIndex>0</NewPortMappingIndex></u:GetGenericPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 663 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetGenericPortMappingEntryResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n\n<NewRemoteHost></NewRemoteHost>\n<NewExternalPort>9308</NewExternalPort>\n<NewProtocol>UDP</NewProtocol>\n<NewInternalPort>9308</NewInternalPort>\n<NewInternalClient>11.2.3.55</NewInternalClient>\n<NewEnabled>1</NewEnabled>\n<NewPortMappingDescription>11.2.3.55:9308 to 9308 (UDP)</NewPortMappingDescription>\n<NewLeaseDuration>0</NewLeaseDuration>\n</u:GetGenericPortMappingEntryResponse>\n\t</s:Body>\n</s:Envelope>\n',
-            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 341\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetGenericPortMappingEntry"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetGenericPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewPortMappingIndex>1</NewPortMappingIndex></u:GetGenericPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 663 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetGenericPortMappingEntryResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n\n<NewRemoteHost></NewRemoteHost>\n<NewExternalPort>9305</NewExternalPort>\n<NewProtocol>UDP</NewProtocol>\n<NewInternalPort>9305</NewInternalPort>\n<NewInternalClient>11.2.3.55</NewInternalClient>\n<NewEnabled>1</NewEnabled>\n<NewPortMappingDescription>11.2.3.55:9305 to 9305 (UDP)</NewPortMappingDescription>\n<NewLeaseDuration>0</NewLeaseDuration>\n</u:GetGenericPortMappingEntryResponse>\n\t</s:Body>\n</s:Envelope>\n',
-            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 341\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetGenericPortMappingEntry"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetGenericPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewPortMappingIndex>2</NewPortMappingIndex></u:GetGenericPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 500 Internal Server Error\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 482 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<s:Fault>\n\t\t\t<faultcode>s:Client</faultcode>\n\t\t\t<faultstring>UPnPError</faultstring>\n\t\t\t<detail>\n\t\t\t\t<UPnPError xmlns=\"urn:schemas-upnp-org:control-1-0\">\n\t\t\t\t\t<errorCode>713</errorCode>\n\t\t\t\t\t<errorDescription>SpecifiedArrayIndexInvalid</errorDescription>\n\t\t\t\t</UPnPError>\n\t\t\t</detail>\n\t\t</s:Fault>\n\t</s:Body>\n</s:Envelope>\n',
-            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 598\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#AddPortMapping"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:AddPortMapping xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewRemoteHost></NewRemoteHost><NewExternalPort>4567</NewExternalPort><NewProtocol>UDP</NewProtocol><NewInternalPort>4567</NewInternalPort><NewInternalClient>11.2.3.4</NewInternalClient><NewEnabled>1</NewEnabled><NewPortMappingDescription>aioupnp test mapping</NewPortMappingDescription><NewLeaseDuration>0</NewLeaseDuration></u:AddPortMapping></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 295 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:AddPortMappingResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\"></u:AddPortMappingResponse>\n\t</s:Body>\n</s:Envelope>\n',
-            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 379\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#DeletePortMapping"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:DeletePortMapping xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewRemoteHost></NewRemoteHost><NewExternalPort>4567</NewExternalPort><NewProtocol>UDP</NewProtocol></u:DeletePortMapping></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 301 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:DeletePortMappingResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\"></u:DeletePortMappingResponse>\n\t</s:Body>\n</s:Envelope>\n'
+            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 341\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetGenericPortMappingEntry"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetGenericPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewPortMappingIndex>0</NewPortMappingIndex></u:GetGenericPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 663 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetGenericPortMappingEntryResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n\n<NewRemoteHost></NewRemoteHost>\n<NewExternalPort>9308</NewExternalPort>\n<NewProtocol>UDP</NewProtocol>\n<NewInternalPort>9308</NewInternalPort>\n<NewInternalClient>11.2.3.55</NewInternalClient>\n<NewEnabled>1</NewEnabled>\n<NewPortMappingDescription>11.2.3.55:9308 to 9308 (UDP)</NewPortMappingDescription>\n<NewLeaseDuration>0</NewLeaseDuration>\n</u:GetGenericPortMappingEntryResponse>\n\t</s:Body>\n</s:Envelope>\n',
+            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 341\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetGenericPortMappingEntry"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetGenericPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewPortMappingIndex>1</NewPortMappingIndex></u:GetGenericPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 663 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:GetGenericPortMappingEntryResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\">\n\n<NewRemoteHost></NewRemoteHost>\n<NewExternalPort>9305</NewExternalPort>\n<NewProtocol>UDP</NewProtocol>\n<NewInternalPort>9305</NewInternalPort>\n<NewInternalClient>11.2.3.55</NewInternalClient>\n<NewEnabled>1</NewEnabled>\n<NewPortMappingDescription>11.2.3.55:9305 to 9305 (UDP)</NewPortMappingDescription>\n<NewLeaseDuration>0</NewLeaseDuration>\n</u:GetGenericPortMappingEntryResponse>\n\t</s:Body>\n</s:Envelope>\n',
+            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 341\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetGenericPortMappingEntry"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetGenericPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewPortMappingIndex>2</NewPortMappingIndex></u:GetGenericPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 500 Internal Server Error\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 482 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<s:Fault>\n\t\t\t<faultcode>s:Client</faultcode>\n\t\t\t<faultstring>UPnPError</faultstring>\n\t\t\t<detail>\n\t\t\t\t<UPnPError xmlns=\"urn:schemas-upnp-org:control-1-0\">\n\t\t\t\t\t<errorCode>713</errorCode>\n\t\t\t\t\t<errorDescription>SpecifiedArrayIndexInvalid</errorDescription>\n\t\t\t\t</UPnPError>\n\t\t\t</detail>\n\t\t</s:Fault>\n\t</s:Body>\n</s:Envelope>\n',
+            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 598\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#AddPortMapping"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:AddPortMapping xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewRemoteHost></NewRemoteHost><NewExternalPort>4567</NewExternalPort><NewProtocol>UDP</NewProtocol><NewInternalPort>4567</NewInternalPort><NewInternalClient>11.2.3.4</NewInternalClient><NewEnabled>1</NewEnabled><NewPortMappingDescription>aioupnp test mapping</NewPortMappingDescription><NewLeaseDuration>0</NewLeaseDuration></u:AddPortMapping></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 295 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:AddPortMappingResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\"></u:AddPortMappingResponse>\n\t</s:Body>\n</s:Envelope>\n',
+            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 379\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#DeletePortMapping"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:DeletePortMapping xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewRemoteHost></NewRemoteHost><NewExternalPort>4567</NewExternalPort><NewProtocol>UDP</NewProtocol></u:DeletePortMapping></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 03:55:24 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\nCONTENT-LENGTH: 301 \r\nEXT:\r\n\r\n<?xml version=\"1.0\"?>\n<s:Envelope xmlns:s=\"http://schemas.xmlsoap.org/soap/envelope/\" s:encodingStyle=\"http://schemas.xmlsoap.org/soap/encoding/\">\n\t<s:Body>\n\t\t<u:DeletePortMappingResponse xmlns:u=\"urn:schemas-upnp-org:service:WANIPConnection:1\"></u:DeletePortMappingResponse>\n\t</s:Body>\n</s:Envelope>\n'
         })
 
+    def add_reply(self, request: bytes, response: bytes) -> None:
+        self.replies[request] = response
+        self.addCleanup(self.replies.pop, request, None)
+
+    def add_request(self, gateway: Gateway, port: int) -> bytes:
+        return gateway.commands.get_command('AddPortMapping').template.serialize(
+            keep_alive=True, NewRemoteHost='', NewExternalPort=port, NewProtocol='UDP', NewInternalPort=4567,
+            NewInternalClient=self.client_address, NewEnabled=1, NewPortMappingDescription=self.description,
+            NewLeaseDuration='0'
+        )
+
+    def specific_request(self, gateway: Gateway, port: int) -> bytes:
+        return gateway.commands.get_command('GetSpecificPortMappingEntry').template.serialize(
+            keep_alive=True, NewRemoteHost='', NewExternalPort=port, NewProtocol='UDP'
+        )
+
+
+class TestGetNextPortMapping(PortMappingTestCase):
     async def test_get_next_mapping(self):
         with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
             gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
@@ -179,14 +203,300 @@ class TestGetNextPortMapping(UPnPCommandTestCase):
             result = await upnp.delete_port_mapping(ext_port, "UDP")
             self.assertIsNone(result)
 
+    async def test_get_next_mapping_uses_cached_table(self):
+        sent = []
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies, sent_tcp_packets=sent):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
+            await gateway.discover_commands()
+            upnp = UPnP(self.client_address, self.gateway_address, gateway)
+            del sent[:]
+            self.assertEqual(4567, await upnp.get_next_mapping(4567, "UDP", "aioupnp test mapping"))
+            self.assertIn((4567, "UDP"), upnp.port_mappings)
+            self.assertEqual(4567, await upnp.get_next_mapping(4567, "UDP", "aioupnp test mapping"))
+            await upnp.delete_port_mapping(4567, "UDP")
+            self.assertNotIn((4567, "UDP"), upnp.port_mappings)
+            self.assertEqual(4567, await upnp.get_next_mapping(4567, "UDP", "aioupnp test mapping"))
+        self.assertEqual(1, len([p for p in sent if b'<NewPortMappingIndex>0</NewPortMappingIndex>' in p]))
+        self.assertEqual(2, len([p for p in sent if b'#AddPortMapping' in p]))
+
+    async def test_get_next_mapping_reloads_table_on_conflict(self):
+        sent = []
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies, sent_tcp_packets=sent):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
+            await gateway.discover_commands()
+            # 4567 was mapped by someone else after the table was listed, and the gateway doesn't list it
+            self.add_reply(self.add_request(gateway, 4567), soap_fault(718, 'ConflictInMappingEntry'))
+            self.add_reply(self.add_request(gateway, 4568), soap_response(
+                f'<u:AddPortMappingResponse xmlns:u="{self.service_type}"></u:AddPortMappingResponse>'
+            ))
+            upnp = UPnP(self.client_address, self.gateway_address, gateway)
+            await upnp.get_port_mapping_table()
+            del sent[:]
+            self.assertEqual(4568, await upnp.get_next_mapping(4567, "UDP", self.description))
+        self.assertEqual(1, len([p for p in sent if b'<NewPortMappingIndex>0</NewPortMappingIndex>' in p]))
+        self.assertEqual(3, len([p for p in sent if b'#AddPortMapping' in p]))
+
+
+def soap_response(body: str, status: str = "200 OK") -> bytes:
+    content = (
+        '<?xml version="1.0"?>\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+        's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n<s:Body>\n' + body + '\n</s:Body>\n</s:Envelope>\n'
+    ).encode()
+    return b"HTTP/1.1 %s\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset=\"utf-8\"\r\n" \
+           b"CONTENT-LENGTH: %i\r\n\r\n%s" % (status.encode(), len(content), content)
+
+
+def soap_fault(error_code: int, error_description: str) -> bytes:
+    return soap_response(
+        '<s:Fault>\n<faultcode>s:Client</faultcode>\n<faultstring>UPnPError</faultstring>\n<detail>\n'
+        '<UPnPError xmlns="urn:schemas-upnp-org:control-1-0">\n'
+        f'<errorCode>{error_code}</errorCode>\n<errorDescription>{error_description}</errorDescription>\n'
+        '</UPnPError>\n</detail>\n</s:Fault>', "500 Internal Server Error"
+    )
+
+
+class TestGetListOfPortMappings(PortMappingTestCase):
+    @staticmethod
+    def listing(protocol: str, ports: list) -> str:
+        entries = ''.join(
+            f'<p:PortMappingEntry><p:NewRemoteHost></p:NewRemoteHost><p:NewExternalPort>{port}</p:NewExternalPort>'
+            f'<p:NewProtocol>{protocol}</p:NewProtocol><p:NewInternalPort>{port}</p:NewInternalPort>'
+            f'<p:NewInternalClient>11.2.3.44</p:NewInternalClient><p:NewEnabled>1</p:NewEnabled>'
+            f'<p:NewDescription>test</p:NewDescription><p:NewLeaseTime>0</p:NewLeaseTime></p:PortMappingEntry>'
+            for port in ports
+        )
+        return escape(
+            '<?xml version="1.0" encoding="UTF-8"?>\n<p:PortMappingList '
+            f'xmlns:p="urn:schemas-upnp-org:gw:WANIPConnection">{entries}</p:PortMappingList>'
+        )
+
+    async def discover_with_listing(self, replies: dict, page_size: int = 1000) -> UPnP:
+        gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
+        await gateway.discover_commands()
+        gateway.commands.register(
+            'GetListOfPortMappings', gateway.commands.get_service('GetGenericPortMappingEntry'),
+            ['NewStartPort', 'NewEndPort', 'NewProtocol', 'NewManage', 'NewNumberOfPorts'], ['NewPortListing']
+        )
+        template = gateway.commands.get_command('GetListOfPortMappings').template
+        for (protocol, start_port), response in replies.items():
+            request = template.serialize(
+                keep_alive=True, NewStartPort=start_port, NewEndPort=65535, NewProtocol=protocol, NewManage=1,
+                NewNumberOfPorts=page_size
+            )
+            self.replies[request] = response
+        return UPnP(self.client_address, self.gateway_address, gateway)
+
+    def listing_response(self, protocol: str, ports: list) -> bytes:
+        return soap_response(
+            f'<u:GetListOfPortMappingsResponse xmlns:u="{self.service_type}">'
+            f'<NewPortListing>{self.listing(protocol, ports)}</NewPortListing></u:GetListOfPortMappingsResponse>'
+        )
+
+    async def test_get_redirects_with_listing(self):
+        sent = []
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies, sent_tcp_packets=sent):
+            upnp = await self.discover_with_listing({
+                ('TCP', 0): self.listing_response('TCP', [1000, 1001]),
+                ('UDP', 0): soap_fault(730, 'PortMappingNotFound'),
+            })
+            del sent[:]
+            redirects = await upnp.get_redirects()
+        self.assertListEqual(
+            [(1000, 'TCP'), (1001, 'TCP')], [(redirect.external_port, redirect.protocol) for redirect in redirects]
+        )
+        self.assertEqual(
+            GetGenericPortMappingEntryResponse(None, 1000, 'TCP', 1000, '11.2.3.44', True, 'test', 0), redirects[0]
+        )
+        self.assertEqual(2, len(sent))
+        self.assertFalse([p for p in sent if b'#GetGenericPortMappingEntry' in p])
+        self.assertIn((1001, 'TCP'), upnp.port_mappings)
+
+    async def test_get_redirects_with_listing_pages(self):
+        sent = []
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies, sent_tcp_packets=sent):
+            upnp = await self.discover_with_listing({
+                ('TCP', 0): self.listing_response('TCP', [1000, 1001]),
+                ('TCP', 1002): soap_fault(730, 'PortMappingNotFound'),
+                ('UDP', 0): self.listing_response('UDP', [2000, 2001]),
+                ('UDP', 2002): self.listing_response('UDP', [2002]),
+            }, page_size=2)
+            del sent[:]
+            with mock.patch('aioupnp.upnp.PORT_MAPPING_LIST_PAGE_SIZE', 2):
+                redirects = await upnp.get_redirects()
+        self.assertListEqual(
+            [(1000, 'TCP'), (1001, 'TCP'), (2000, 'UDP'), (2001, 'UDP'), (2002, 'UDP')],
+            [(redirect.external_port, redirect.protocol) for redirect in redirects]
+        )
+        self.assertEqual(4, len(sent))
+
+    async def test_get_redirects_falls_back_to_walk(self):
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
+            upnp = await self.discover_with_listing({('TCP', 0): soap_fault(606, 'Action not authorized')})
+            redirects = await upnp.get_redirects()
+        self.assertListEqual(
+            [(9308, 'UDP'), (9305, 'UDP')], [(redirect.external_port, redirect.protocol) for redirect in redirects]
+        )
+
+
+class TestAllocatePortMapping(PortMappingTestCase):
+    def reply_not_mapped(self, gateway: Gateway, *ports: int) -> None:
+        for port in ports:
+            self.add_reply(self.specific_request(gateway, port), soap_fault(714, 'NoSuchEntryInArray'))
+
+    async def test_allocate_requested_port(self):
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
+            await gateway.discover_commands()
+            self.reply_not_mapped(gateway, 4567)
+            upnp = UPnP(self.client_address, self.gateway_address, gateway)
+            self.assertEqual(4567, await upnp.allocate_port_mapping(4567, "UDP", self.description))
+
+    async def test_allocate_probes_past_conflicts(self):
+        candidates = list(zip(range(3), port_probe_sequence(
+            4567, f"{self.client_address}|UDP|4567|{self.description}"
+        )))
+        sent = []
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies, sent_tcp_packets=sent):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
+            await gateway.discover_commands()
+            self.reply_not_mapped(gateway, *(port for _, port in candidates))
+            for _, port in candidates[:2]:
+                self.add_reply(self.add_request(gateway, port), soap_fault(718, 'ConflictInMappingEntry'))
+            self.add_reply(self.add_request(gateway, candidates[2][1]), soap_response(
+                f'<u:AddPortMappingResponse xmlns:u="{self.service_type}"></u:AddPortMappingResponse>'
+            ))
+            upnp = UPnP(self.client_address, self.gateway_address, gateway)
+            del sent[:]
+            self.assertEqual(candidates[2][1], await upnp.allocate_port_mapping(4567, "UDP", self.description))
+            with self.assertRaises(UPnPError):
+                await upnp.allocate_port_mapping(4567, "UDP", self.description, max_attempts=2)
+        self.assertEqual(5, len([p for p in sent if b'#AddPortMapping' in p]))
+        self.assertEqual(5, len([p for p in sent if b'#GetSpecificPortMappingEntry' in p]))
+        self.assertFalse([p for p in sent if b'#GetGenericPortMappingEntry' in p])
+
+    async def test_allocate_skips_other_mappings_of_this_host(self):
+        candidates = list(zip(range(2), port_probe_sequence(
+            4567, f"{self.client_address}|UDP|4567|{self.description}"
+        )))
+        sent = []
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies, sent_tcp_packets=sent):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
+            await gateway.discover_commands()
+            self.add_reply(self.specific_request(gateway, 4567), soap_response(
+                f'<u:GetSpecificPortMappingEntryResponse xmlns:u="{self.service_type}">'
+                f'<NewInternalPort>4000</NewInternalPort><NewInternalClient>{self.client_address}</NewInternalClient>'
+                f'<NewEnabled>1</NewEnabled><NewPortMappingDescription>other</NewPortMappingDescription>'
+                f'<NewLeaseDuration>0</NewLeaseDuration></u:GetSpecificPortMappingEntryResponse>'
+            ))
+            self.reply_not_mapped(gateway, candidates[1][1])
+            self.add_reply(self.add_request(gateway, candidates[1][1]), soap_response(
+                f'<u:AddPortMappingResponse xmlns:u="{self.service_type}"></u:AddPortMappingResponse>'
+            ))
+            upnp = UPnP(self.client_address, self.gateway_address, gateway)
+            del sent[:]
+            self.assertEqual(candidates[1][1], await upnp.allocate_port_mapping(4567, "UDP", self.description))
+        self.assertFalse([p for p in sent if b'#AddPortMapping' in p and b'<NewExternalPort>4567<' in p])
+
+    async def test_allocate_with_add_any_port_mapping(self):
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
+            await gateway.discover_commands()
+            gateway.commands.register(
+                'AddAnyPortMapping', gateway.commands.get_service('AddPortMapping'),
+                ['NewRemoteHost', 'NewExternalPort', 'NewProtocol', 'NewInternalPort', 'NewInternalClient',
+                 'NewEnabled', 'NewPortMappingDescription', 'NewLeaseDuration'], ['NewReservedPort']
+            )
+            request = gateway.commands.get_command('AddAnyPortMapping').template.serialize(
+                keep_alive=True, NewRemoteHost='', NewExternalPort=4567, NewProtocol='UDP', NewInternalPort=4567,
+                NewInternalClient=self.client_address, NewEnabled=1, NewPortMappingDescription=self.description,
+                NewLeaseDuration='0'
+            )
+            self.replies[request] = soap_response(
+                f'<u:AddAnyPortMappingResponse xmlns:u="{self.service_type}">'
+                f'<NewReservedPort>4568</NewReservedPort></u:AddAnyPortMappingResponse>'
+            )
+            self.addCleanup(self.replies.pop, request)
+            upnp = UPnP(self.client_address, self.gateway_address, gateway)
+            self.assertEqual(4568, await upnp.allocate_port_mapping(4567, "UDP", self.description))
+
+
+class TestBatchPortMappings(PortMappingTestCase):
+    async def test_add_and_delete_port_mappings(self):
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop)
+            await gateway.discover_commands()
+            self.replies[self.add_request(gateway, 4568)] = soap_fault(718, 'ConflictInMappingEntry')
+            self.addCleanup(self.replies.pop, self.add_request(gateway, 4568))
+            upnp = UPnP(self.client_address, self.gateway_address, gateway)
+            results = await upnp.add_port_mappings([
+                PortMappingSpec(4567, 'UDP', 4567, self.client_address, self.description),
+                PortMappingSpec(4568, 'UDP', 4567, self.client_address, self.description),
+            ])
+            self.assertIsNone(results[0])
+            self.assertIsInstance(results[1], UPnPError)
+            self.assertEqual('ConflictInMappingEntry', str(results[1]))
+            self.assertListEqual([None], await upnp.delete_port_mappings([(4567, 'UDP')]))
+
+    async def test_batch_reuses_pooled_connections(self):
+        sent = []
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies, sent_tcp_packets=sent):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop,
+                              soap_pool_size=2)
+            await gateway.discover_commands()
+            self.replies[self.add_request(gateway, 4567)] = soap_response(
+                f'<u:AddPortMappingResponse xmlns:u="{self.service_type}"></u:AddPortMappingResponse>'
+            ).replace(b'Connection: close', b'Connection: keep-alive')
+            self.addCleanup(self.replies.pop, self.add_request(gateway, 4567))
+            create_connection = self.loop.create_connection
+            connections = []
+
+            async def counting_create_connection(*args, **kwargs):
+                connections.append(args)
+                return await create_connection(*args, **kwargs)
+
+            self.loop.create_connection = counting_create_connection
+            upnp = UPnP(self.client_address, self.gateway_address, gateway)
+            del sent[:]
+            results = await upnp.add_port_mappings(
+                [PortMappingSpec(4567, 'UDP', 4567, self.client_address, self.description)] * 8
+            )
+            gateway.commands._pool.close()
+        self.assertListEqual([None] * 8, results)
+        self.assertEqual(2, len(connections))
+        self.assertEqual(8, len([p for p in sent if b'\r\nConnection: keep-alive\r\n' in p]))
+
+    async def test_concurrency_is_bounded_by_the_gateway(self):
+        with mock_tcp_and_udp(self.loop, tcp_replies=self.replies):
+            gateway = Gateway(self.reply, self.client_address, self.gateway_address, loop=self.loop,
+                              soap_pool_size=2)
+        upnp = UPnP(self.client_address, self.gateway_address, gateway)
+        in_flight = []
+        most_in_flight = 0
+
+        async def add_port_mapping(external_port, *_):
+            nonlocal most_in_flight
+            in_flight.append(external_port)
+            most_in_flight = max(most_in_flight, len(in_flight))
+            await asyncio.sleep(0.01, loop=self.loop)
+            in_flight.remove(external_port)
+            if external_port % 2:
+                raise UPnPError('ConflictInMappingEntry')
+
+        upnp.add_port_mapping = add_port_mapping
+        results = await upnp.add_port_mappings(
+            [(port, 'UDP', port, self.client_address, self.description) for port in range(4000, 4010)]
+        )
+        self.assertEqual(2, most_in_flight)
+        self.assertListEqual([None, 'ConflictInMappingEntry'] * 5, [r if r is None else str(r) for r in results])
+
 
 class TestGetSpecificPortMapping(UPnPCommandTestCase):
     client_address = '11.2.3.4'
 
     def setUp(self) -> None:
         self.replies.update({
-            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 399\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetSpecificPortMappingEntry"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetSpecificPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewRemoteHost></NewRemoteHost><NewExternalPort>1000</NewExternalPort><NewProtocol>UDP</NewProtocol></u:GetSpecificPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 500 Internal Server Error\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 06:48:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset="utf-8"\r\nCONTENT-LENGTH: 474 \r\nEXT:\r\n\r\n<?xml version="1.0"?>\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n\t<s:Body>\n\t\t<s:Fault>\n\t\t\t<faultcode>s:Client</faultcode>\n\t\t\t<faultstring>UPnPError</faultstring>\n\t\t\t<detail>\n\t\t\t\t<UPnPError xmlns="urn:schemas-upnp-org:control-1-0">\n\t\t\t\t\t<errorCode>714</errorCode>\n\t\t\t\t\t<errorDescription>NoSuchEntryInArray</errorDescription>\n\t\t\t\t</UPnPError>\n\t\t\t</detail>\n\t\t</s:Fault>\n\t</s:Body>\n</s:Envelope>\n',
-            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 399\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetSpecificPortMappingEntry"\r\nConnection: Close\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetSpecificPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewRemoteHost></NewRemoteHost><NewExternalPort>9308</NewExternalPort><NewProtocol>UDP</NewProtocol></u:GetSpecificPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 06:50:07 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset="utf-8"\r\nCONTENT-LENGTH: 562 \r\nEXT:\r\n\r\n<?xml version="1.0"?>\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n\t<s:Body>\n\t\t<u:GetSpecificPortMappingEntryResponse xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1">\n\n<NewInternalPort>9308</NewInternalPort>\n<NewInternalClient>11.2.3.55</NewInternalClient>\n<NewEnabled>1</NewEnabled>\n<NewPortMappingDescription>11.2.3.55:9308 to 9308 (UDP)</NewPortMappingDescription>\n<NewLeaseDuration>0</NewLeaseDuration>\n</u:GetSpecificPortMappingEntryResponse>\n\t</s:Body>\n</s:Envelope>\n'
+            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 399\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetSpecificPortMappingEntry"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetSpecificPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewRemoteHost></NewRemoteHost><NewExternalPort>1000</NewExternalPort><NewProtocol>UDP</NewProtocol></u:GetSpecificPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 500 Internal Server Error\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 06:48:57 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset="utf-8"\r\nCONTENT-LENGTH: 474 \r\nEXT:\r\n\r\n<?xml version="1.0"?>\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n\t<s:Body>\n\t\t<s:Fault>\n\t\t\t<faultcode>s:Client</faultcode>\n\t\t\t<faultstring>UPnPError</faultstring>\n\t\t\t<detail>\n\t\t\t\t<UPnPError xmlns="urn:schemas-upnp-org:control-1-0">\n\t\t\t\t\t<errorCode>714</errorCode>\n\t\t\t\t\t<errorDescription>NoSuchEntryInArray</errorDescription>\n\t\t\t\t</UPnPError>\n\t\t\t</detail>\n\t\t</s:Fault>\n\t</s:Body>\n</s:Envelope>\n',
+            b'POST /soap.cgi?service=WANIPConn1 HTTP/1.1\r\nHost: 11.2.3.4\r\nUser-Agent: python3/aioupnp, UPnP/1.0, MiniUPnPc/1.9\r\nContent-Length: 399\r\nContent-Type: text/xml\r\nSOAPAction: "urn:schemas-upnp-org:service:WANIPConnection:1#GetSpecificPortMappingEntry"\r\nConnection: keep-alive\r\nCache-Control: no-cache\r\nPragma: no-cache\r\n\r\n<?xml version="1.0"?>\r\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body><u:GetSpecificPortMappingEntry xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1"><NewRemoteHost></NewRemoteHost><NewExternalPort>9308</NewExternalPort><NewProtocol>UDP</NewProtocol></u:GetSpecificPortMappingEntry></s:Body></s:Envelope>\r\n': b'HTTP/1.1 200 OK\r\nServer: WebServer\r\nDate: Wed, 22 May 2019 06:50:07 GMT\r\nConnection: close\r\nCONTENT-TYPE: text/xml; charset="utf-8"\r\nCONTENT-LENGTH: 562 \r\nEXT:\r\n\r\n<?xml version="1.0"?>\n<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">\n\t<s:Body>\n\t\t<u:GetSpecificPortMappingEntryResponse xmlns:u="urn:schemas-upnp-org:service:WANIPConnection:1">\n\n<NewInternalPort>9308</NewInternalPort>\n<NewInternalClient>11.2.3.55</NewInternalClient>\n<NewEnabled>1</NewEnabled>\n<NewPortMappingDescription>11.2.3.55:9308 to 9308 (UDP)</NewPortMappingDescription>\n<NewLeaseDuration>0</NewLeaseDuration>\n</u:GetSpecificPortMappingEntryResponse>\n\t</s:Body>\n</s:Envelope>\n'
         })
 
     async def test_get_specific_port_mapping(self):